@@ -0,0 +1,245 @@
+"""
+Admission control for generation endpoints.
+
+Two layers protect the LLM-backed POST endpoints:
+
+- A token bucket per client (API key, otherwise client IP) answers 429 with
+  Retry-After once a client exceeds its rate.
+- A global in-flight cap sized to the Gemini quota. Requests beyond it wait in
+  a bounded queue; when the queue is full or the expected wait exceeds the
+  latency budget they are shed immediately with 503 and Retry-After.
+
+Read and health endpoints are never subject to admission control. Limits are
+per worker process, so divide them by WEB_CONCURRENCY when sizing.
+"""
+
+import asyncio
+import hashlib
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+MAX_INFLIGHT_GENERATIONS = int(os.getenv("MAX_INFLIGHT_GENERATIONS", "8"))
+MAX_QUEUED_GENERATIONS = int(os.getenv("MAX_QUEUED_GENERATIONS", "32"))
+QUEUE_LATENCY_BUDGET_SECONDS = float(os.getenv("QUEUE_LATENCY_BUDGET_SECONDS", "10"))
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+# Comma-separated X-API-Key values that get their own bucket; any other key is ignored
+RATE_LIMIT_API_KEYS = [key.strip() for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if key.strip()]
+
+_MAX_TRACKED_CLIENTS = 10_000
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets, pruned least-recently-used beyond max_clients"""
+
+    def __init__(self, rate_per_second: float, burst: float, max_clients: int = _MAX_TRACKED_CLIENTS):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def acquire(self, key: str, now: Optional[float] = None) -> float:
+        """
+        Take one token for key. Returns 0 when admitted, otherwise the number
+        of seconds until a token becomes available.
+        """
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            retry_after = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            retry_after = (1 - tokens) / self.rate if self.rate > 0 else 60.0
+
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+class ConcurrencyLimiter:
+    """Global in-flight cap with a bounded, latency-budgeted wait queue"""
+
+    def __init__(self, max_in_flight: int, max_queued: int, latency_budget: float):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.latency_budget = latency_budget
+        self.in_flight = 0
+        self.queued = 0
+        # Exponentially weighted average of how long a generation holds a slot
+        self.avg_service_seconds = 5.0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    def expected_wait(self) -> float:
+        """Rough time a newly queued request would wait for a slot"""
+        if self.in_flight < self.max_in_flight:
+            return 0.0
+        return (self.queued + 1) * self.avg_service_seconds / self.max_in_flight
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot. Returns None when admitted, otherwise the shed reason."""
+        semaphore = self._get_semaphore()
+        if self.in_flight >= self.max_in_flight:
+            if self.queued >= self.max_queued:
+                return "queue_full"
+            if self.expected_wait() > self.latency_budget:
+                return "over_budget"
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.latency_budget)
+        except asyncio.TimeoutError:
+            return "timeout"
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        return None
+
+    def release(self, service_seconds: float):
+        self.in_flight -= 1
+        self.avg_service_seconds = 0.8 * self.avg_service_seconds + 0.2 * service_seconds
+        self._get_semaphore().release()
+
+    async def try_borrow(self) -> bool:
+        """
+        Take an extra slot only if one is free right now and nobody is queued
+        (never waits, so a request holding a slot cannot deadlock on more).
+        """
+        semaphore = self._get_semaphore()
+        if self.queued or semaphore.locked() or self.in_flight >= self.max_in_flight:
+            return False
+        await semaphore.acquire()
+        self.in_flight += 1
+        return True
+
+    def return_borrowed(self):
+        self.in_flight -= 1
+        self._get_semaphore().release()
+
+
+def _key_digest(key: bytes) -> str:
+    return hashlib.sha256(key).hexdigest()[:16]
+
+
+_ALLOWED_KEY_DIGESTS = frozenset(_key_digest(key.encode("latin-1")) for key in RATE_LIMIT_API_KEYS)
+
+
+def _client_key(scope, allowed_keys: frozenset = _ALLOWED_KEY_DIGESTS) -> str:
+    """
+    API key when it is in RATE_LIMIT_API_KEYS (hashed, never stored raw),
+    otherwise client IP. Unknown keys are ignored, so rotating made-up keys
+    does not get a client fresh buckets.
+    """
+    forwarded_for = None
+    for name, value in scope["headers"]:
+        if name == b"x-api-key" and value:
+            digest = _key_digest(value)
+            if digest in allowed_keys:
+                return "key:" + digest
+        elif name == b"x-forwarded-for":
+            forwarded_for = value
+    if TRUST_FORWARDED_FOR and forwarded_for:
+        return "ip:" + forwarded_for.split(b",")[0].strip().decode("latin-1")
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionController:
+    """Rate limiter, concurrency limiter and their outcome counters"""
+
+    def __init__(self, rate_limiter: TokenBucketLimiter, concurrency: ConcurrencyLimiter):
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.counters: Dict[str, int] = {
+            "admitted": 0,
+            "rate_limited": 0,
+            "shed_queue_full": 0,
+            "shed_over_budget": 0,
+            "shed_timeout": 0,
+            "borrowed_slots": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            TokenBucketLimiter(RATE_LIMIT_PER_MINUTE / 60.0, RATE_LIMIT_BURST),
+            ConcurrencyLimiter(MAX_INFLIGHT_GENERATIONS, MAX_QUEUED_GENERATIONS, QUEUE_LATENCY_BUDGET_SECONDS)
+        )
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            **self.counters,
+            "in_flight": self.concurrency.in_flight,
+            "queued": self.concurrency.queued,
+            "max_in_flight": self.concurrency.max_in_flight,
+            "avg_service_seconds": round(self.concurrency.avg_service_seconds, 3),
+        }
+
+
+admission_controller = AdmissionController.from_env()
+
+
+class AdmissionControlMiddleware:
+    """Rate-limit and load-shed POST requests to the generation endpoints"""
+
+    def __init__(self, app, limited_paths: Iterable[str], controller: AdmissionController = admission_controller):
+        self.app = app
+        self.limited_paths = frozenset(limited_paths)
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.limited_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        retry_after = controller.rate_limiter.acquire(_client_key(scope))
+        if retry_after > 0:
+            controller.counters["rate_limited"] += 1
+            await self._reject(scope, receive, send, 429, "Rate limit exceeded", retry_after)
+            return
+
+        shed_reason = await controller.concurrency.acquire()
+        if shed_reason is not None:
+            controller.counters[f"shed_{shed_reason}"] += 1
+            await self._reject(
+                scope, receive, send, 503,
+                "Server is at capacity, please retry shortly",
+                max(1.0, controller.concurrency.expected_wait())
+            )
+            return
+
+        controller.counters["admitted"] += 1
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.concurrency.release(time.monotonic() - started)
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, detail: str, retry_after: float):
+        response = JSONResponse(
+            status_code=status_code,
+            content={"detail": detail},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
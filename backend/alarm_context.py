@@ -0,0 +1,204 @@
+"""
+Alarm-to-trend correlation for the handover prompt.
+
+A tag index maps normalized tag names to their trend series, so each alarm
+finds its series with a constant number of dictionary lookups (by tag, by
+alarm ID, and by alarm ID without its limit suffix, e.g. ``B201-DO-HI`` ->
+``B201_DO``). For every active alarm with a series the prompt gets one
+compact line: the value at alarm time, how long the series was beyond the
+setpoint, the slope over the window before the alarm and the latest value,
+instead of leaving the model to correlate the raw alarm and trend blobs.
+"""
+
+import os
+import re
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional
+
+from incremental import iter_alarm_records
+from trend_series import TIME_BASE_INDEX, TrendSeries, parse_timestamp, parse_trend_series
+
+ALARM_CONTEXT_WINDOW_MINUTES = float(os.getenv("ALARM_CONTEXT_WINDOW_MINUTES", "30"))
+ALARM_CONTEXT_MAX_ALARMS = int(os.getenv("ALARM_CONTEXT_MAX_ALARMS", "40"))
+
+_NUMBER = re.compile(r"[-+]?\d+(?:\.\d+)?")
+_LIMIT_SUFFIX = re.compile(r"[-_.](HIHI|LOLO|HH|LL|HI|LO|HIGH|LOW|OC|DEV|FAIL)$", re.IGNORECASE)
+_LOW_LIMIT = re.compile(r"(^|[-_.\s])(LO|LL|LOLO|LOW)($|[-_.\s])", re.IGNORECASE)
+_HIGH_LIMIT = re.compile(r"(^|[-_.\s])(HI|HH|HIHI|HIGH)($|[-_.\s])", re.IGNORECASE)
+# Whole status words (not substrings: "Unresolved" and "Abnormal" are active)
+_INACTIVE = frozenset({"clear", "cleared", "resolved", "inactive", "normal", "rtn"})
+_NEGATIONS = frozenset({"not", "no", "never"})
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def normalize_tag(name: str) -> str:
+    """Case- and punctuation-insensitive key: Reactor-B.Pressure -> reactorbpressure"""
+    return re.sub(r"[^0-9a-z]", "", name.lower())
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _NUMBER.search(str(value or ""))
+    return float(match.group()) if match else None
+
+
+class TagIndex:
+    """Trend series keyed by normalized tag name"""
+
+    def __init__(self, series: Dict[str, TrendSeries]):
+        self._by_key: Dict[str, TrendSeries] = {}
+        for tag, entry in series.items():
+            self._by_key.setdefault(normalize_tag(tag), entry)
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def lookup(self, alarm: Dict[str, Any]) -> Optional[TrendSeries]:
+        """Series for an alarm by tag, then alarm ID, then alarm ID without its limit suffix"""
+        alarm_id = str(alarm.get("id") or "")
+        for candidate in (str(alarm.get("tag") or ""), alarm_id, _LIMIT_SUFFIX.sub("", alarm_id)):
+            entry = self._by_key.get(normalize_tag(candidate)) if candidate else None
+            if entry is not None:
+                return entry
+        return None
+
+
+def value_at(entry: TrendSeries, at: float) -> float:
+    """Linearly interpolated value, clamped to the ends of the series"""
+    times, values = entry.times, entry.values
+    i = bisect_left(times, at)
+    if i <= 0:
+        return values[0]
+    if i >= len(times):
+        return values[-1]
+    t0, t1 = times[i - 1], times[i]
+    if t1 == t0:
+        return values[i]
+    return values[i - 1] + (values[i] - values[i - 1]) * (at - t0) / (t1 - t0)
+
+
+def time_beyond(entry: TrendSeries, setpoint: float, above: bool) -> float:
+    """Seconds the series spent beyond the setpoint, with crossings interpolated"""
+    def beyond(value: float) -> bool:
+        return value > setpoint if above else value < setpoint
+
+    total = 0.0
+    times, values = entry.times, entry.values
+    for i in range(1, len(times)):
+        t0, t1, v0, v1 = times[i - 1], times[i], values[i - 1], values[i]
+        b0, b1 = beyond(v0), beyond(v1)
+        if b0 and b1:
+            total += t1 - t0
+        elif b0 != b1 and v1 != v0:
+            crossing = t0 + (setpoint - v0) / (v1 - v0) * (t1 - t0)
+            total += (t1 - crossing) if b1 else (crossing - t0)
+    return total
+
+
+def slope_before(entry: TrendSeries, at: float, window_seconds: float) -> Optional[float]:
+    """Least-squares slope (units per minute) over the window ending at `at`"""
+    start = bisect_left(entry.times, at - window_seconds)
+    end = bisect_right(entry.times, at)
+    times, values = entry.times[start:end], entry.values[start:end]
+    if len(times) < 2:
+        return None
+    mean_t = sum(times) / len(times)
+    mean_v = sum(values) / len(values)
+    spread = sum((t - mean_t) ** 2 for t in times)
+    if spread == 0:
+        return None
+    return sum((t - mean_t) * (v - mean_v) for t, v in zip(times, values)) / spread * 60
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.4g}"
+
+
+def _minutes(seconds: float) -> str:
+    return f"{seconds / 60:.0f} min" if seconds < 5400 else f"{seconds / 3600:.1f} h"
+
+
+def _status_words(text: str) -> List[str]:
+    """Lower-case words of a status or section name: clearedAlarms -> [cleared, alarms]"""
+    return re.split(r"[^0-9a-z]+", _CAMEL_BOUNDARY.sub(" ", text).lower())
+
+
+def _says_inactive(text: str) -> bool:
+    words = _status_words(text)
+    return bool(_INACTIVE.intersection(words)) and not _NEGATIONS.intersection(words)
+
+
+def _is_active(section: str, alarm: Dict[str, Any]) -> bool:
+    return not (_says_inactive(str(alarm.get("status") or "")) or _says_inactive(section))
+
+
+def _is_high_limit(alarm: Dict[str, Any]) -> bool:
+    """Limit direction from the alarm ID suffix, else from whole words of the description (high by default)"""
+    alarm_id = str(alarm.get("id") or "")
+    if _LOW_LIMIT.search(alarm_id):
+        return False
+    if _HIGH_LIMIT.search(alarm_id):
+        return True
+    words = _status_words(str(alarm.get("description") or ""))
+    return not ("low" in words and "high" not in words)
+
+
+def describe_alarm(alarm: Dict[str, Any], entry: TrendSeries) -> str:
+    """One line of trend evidence for an alarm"""
+    unit = f" {entry.unit}" if entry.unit else ""
+    name = alarm.get("id") or alarm.get("tag") or entry.tag
+    parts = [f"{name} ({entry.tag}):"]
+
+    alarm_time = None
+    if entry.time_base != TIME_BASE_INDEX:
+        seconds, time_base = parse_timestamp(str(alarm.get("timestamp") or alarm.get("time") or ""))
+        if seconds is not None and time_base == entry.time_base:
+            alarm_time = entry.align_time(seconds)
+    if alarm_time is not None:
+        parts.append(f"value at alarm {_fmt(value_at(entry, alarm_time))}{unit}")
+
+    setpoint = next(
+        (_number(alarm[key]) for key in ("setpoint", "limit", "threshold") if alarm.get(key) is not None), None
+    )
+    if setpoint is not None:
+        above = _is_high_limit(alarm)
+        direction = "above" if above else "below"
+        parts.append(f"setpoint {_fmt(setpoint)}{unit} ({'high' if above else 'low'} limit)")
+        if entry.time_base != TIME_BASE_INDEX:
+            parts.append(f"{_minutes(time_beyond(entry, setpoint, above))} {direction} setpoint in trend window")
+
+    if alarm_time is not None:
+        slope = slope_before(entry, alarm_time, ALARM_CONTEXT_WINDOW_MINUTES * 60)
+        if slope is not None:
+            parts.append(
+                f"slope {slope:+.3g}{unit}/min over {ALARM_CONTEXT_WINDOW_MINUTES:g} min before alarm"
+            )
+
+    parts.append(f"latest {_fmt(entry.values[-1])}{unit}")
+    return parts[0] + " " + "; ".join(parts[1:])
+
+
+def build_alarm_context(
+    alarms_json: Optional[Dict[str, Any]],
+    trends_csv: Optional[str],
+    index: Optional[TagIndex] = None
+) -> str:
+    """Evidence lines for active alarms that have a trend series ("" when none match)"""
+    if not alarms_json or (index is None and not trends_csv):
+        return ""
+    index = index if index is not None else TagIndex(parse_trend_series(trends_csv))
+    if not len(index):
+        return ""
+
+    lines: List[str] = []
+    for section, alarm in iter_alarm_records(alarms_json):
+        if not _is_active(section, alarm):
+            continue
+        entry = index.lookup(alarm)
+        if entry is None or not entry.values:
+            continue
+        lines.append("- " + describe_alarm(alarm, entry))
+        if len(lines) >= ALARM_CONTEXT_MAX_ALARMS:
+            break
+    return "\n".join(lines)
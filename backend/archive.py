@@ -0,0 +1,45 @@
+"""
+Compressed archive blocks for old handover sessions.
+
+Archived sessions are packed into blocks of up to ARCHIVE_BLOCK_ROWS JSON
+lines, gzip-compressed and stored in the archive_blocks table. Archives live
+in the same database as everything else, so every replica can read them. The
+archived_sessions table maps each session to its block, so a single session is
+read back by decompressing only that block.
+"""
+
+import gzip
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import fast_json
+
+ARCHIVE_BLOCK_ROWS = int(os.getenv("ARCHIVE_BLOCK_ROWS", "64"))
+
+
+def encode_block(rows: List[Dict[str, Any]]) -> bytes:
+    """Gzip-compressed JSON lines; created_at must already be an ISO string"""
+    payload = "".join(fast_json.dumps(row) + "\n" for row in rows).encode("utf-8")
+    return gzip.compress(payload, compresslevel=9, mtime=0)
+
+
+def decode_block(content: bytes) -> List[Dict[str, Any]]:
+    """Rows of a block, with created_at parsed back into a datetime"""
+    rows = []
+    for line in gzip.decompress(content).decode("utf-8").splitlines():
+        if not line:
+            continue
+        row = fast_json.loads(line)
+        if row.get("created_at"):
+            row["created_at"] = datetime.fromisoformat(row["created_at"])
+        rows.append(row)
+    return rows
+
+
+def read_row(content: bytes, session_id: str) -> Optional[Dict[str, Any]]:
+    """Read one archived session from its block"""
+    for row in decode_block(content):
+        if row["session_id"] == session_id:
+            return row
+    return None
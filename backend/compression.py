@@ -0,0 +1,233 @@
+"""
+Negotiated response compression.
+
+Supports zstd, brotli and gzip (zstd and brotli only when their optional
+packages are installed), chosen from the client's Accept-Encoding. The
+middleware compresses compressible responses above a size threshold, also
+streaming ones chunk by chunk, and leaves responses that already carry a
+Content-Encoding (e.g. precompressed stored payloads) untouched.
+"""
+
+import gzip
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+# Encoding used for payloads compressed once at write time (stored responses, cached PDFs)
+PRECOMPRESSED_ENCODING = os.getenv("PRECOMPRESSED_ENCODING", "gzip")
+
+_COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/pdf",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def available_encodings() -> List[str]:
+    """Supported encodings in server preference order"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def _accepted(accept_encoding: Optional[str]) -> Dict[str, float]:
+    accepted: Dict[str, float] = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+def negotiate(accept_encoding: Optional[str], offered: Optional[Iterable[str]] = None) -> Optional[str]:
+    """
+    Pick the best offered encoding the client accepts (highest q-value, ties
+    broken by server preference), or None for identity.
+    """
+    accepted = _accepted(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in offered if offered is not None else available_encodings():
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def accepts(accept_encoding: Optional[str], encoding: str) -> bool:
+    return negotiate(accept_encoding, [encoding]) == encoding
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """One-shot compression at the highest practical level, for stored payloads"""
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=11)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br" and brotli is not None:
+        return brotli.decompress(data)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+class _StreamCompressor:
+    """Incremental compressor with fast settings for on-the-fly responses"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._zstd = zstandard.ZstdCompressor(level=3).compressobj()
+        elif encoding == "br":
+            self._br = brotli.Compressor(quality=4)
+        else:
+            self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        """Compress a chunk; non-final chunks are flushed so streams keep flowing"""
+        if self.encoding == "zstd":
+            out = self._zstd.compress(data)
+            return out + self._zstd.flush(
+                zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+        if self.encoding == "br":
+            out = self._br.process(data)
+            return out + (self._br.finish() if final else self._br.flush())
+        out = self._gzip.compress(data)
+        return out + self._gzip.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def merge_vary(values: List[bytes], field: bytes = b"Accept-Encoding") -> bytes:
+    """One Vary value holding every field already listed plus field (case-insensitive)"""
+    fields: List[bytes] = []
+    for value in values:
+        fields.extend(part.strip() for part in value.split(b",") if part.strip())
+    if b"*" in fields:
+        return b"*"
+    if field.lower() not in {part.lower() for part in fields}:
+        fields.append(field)
+    return b", ".join(fields)
+
+
+def _is_compressible(content_type: str) -> bool:
+    return content_type.lower().startswith(_COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """Compress responses with the negotiated encoding once they reach minimum_size"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        buffered: List[bytes] = []
+        buffered_size = 0
+        compressor: Optional[_StreamCompressor] = None
+        passthrough = False
+
+        async def start_compressed():
+            nonlocal compressor
+            compressor = _StreamCompressor(encoding)
+            headers = [
+                (name, value) for name, value in start_message["headers"]
+                if name not in (b"content-length", b"vary")
+            ]
+            vary = [value for name, value in start_message["headers"] if name == b"vary"]
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+            headers.append((b"vary", merge_vary(vary)))
+            await send({**start_message, "headers": headers})
+
+        async def compressing_send(message):
+            nonlocal start_message, buffered_size, passthrough
+
+            if message["type"] == "http.response.start":
+                headers = dict(message["headers"])
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in headers or not _is_compressible(content_type):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                buffered.append(body)
+                buffered_size += len(body)
+                if buffered_size < self.minimum_size and more_body:
+                    return
+                body = b"".join(buffered)
+                buffered.clear()
+                if buffered_size < self.minimum_size:
+                    # Small complete response: not worth compressing
+                    passthrough = True
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": body, "more_body": False})
+                    return
+                await start_compressed()
+
+            await send({
+                "type": "http.response.body",
+                "body": compressor.compress(body, final=not more_body),
+                "more_body": more_body,
+            })
+
+        await self.app(scope, receive, compressing_send)
@@ -0,0 +1,193 @@
+"""
+Model-side context caching of the static Gemini instructions.
+
+Each instruction set (handover, incremental update, JSON repair, chunk
+summary) is sent as a system instruction. When it is large enough for the
+API's cached-content minimum it is also registered once with
+``client.caches.create`` and later requests reference the cache by name
+instead of re-sending it. Handles are refreshed before they expire and
+recreated when the API no longer knows them. Instructions below the minimum
+still go out as an identical system-instruction prefix, which the API can
+cache implicitly; the usage counters show cached vs uncached prompt tokens
+either way.
+
+Calls happen in worker threads (asyncio.to_thread), hence the locks; the
+lock only guards the handles and is never held across an API call.
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# Extend the TTL once less than this is left
+CONTEXT_CACHE_REFRESH_SECONDS = int(os.getenv("CONTEXT_CACHE_REFRESH_SECONDS", "300"))
+# Smallest instruction worth caching; the API rejects caches below its model minimum
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "1024"))
+# Wait this long before trying again after a failed create
+CONTEXT_CACHE_RETRY_SECONDS = int(os.getenv("CONTEXT_CACHE_RETRY_SECONDS", "600"))
+
+# Cached content needs at least one turn besides the system instruction
+_CACHE_PREAMBLE = "Apply the system instructions to every request that follows."
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English prose
+    return len(text) // 4
+
+
+@dataclass
+class _CacheHandle:
+    name: Optional[str] = None
+    expires_at: float = 0.0
+    retry_after: float = 0.0
+    in_progress: bool = False  # A thread is refreshing or creating this cache
+
+
+class ContextCacheManager:
+    """Cached-content handles for the static instructions, keyed by instruction name"""
+
+    def __init__(self, client, model: str):
+        self.client = client
+        self.model = model
+        self._handles: Dict[str, _CacheHandle] = {}
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"created": 0, "refreshed": 0, "recreated": 0, "create_failed": 0}
+
+    def cache_name(self, key: str, instruction: str) -> Optional[str]:
+        """Name of a live cache holding instruction, or None to send it inline"""
+        if not CONTEXT_CACHE_ENABLED or estimate_tokens(instruction) < CONTEXT_CACHE_MIN_TOKENS:
+            return None
+
+        # Decide under the lock, call the API outside it: one thread per key
+        # refreshes or creates while the others use the current handle (or
+        # send the instruction inline) instead of queueing behind the call
+        with self._lock:
+            handle = self._handles.setdefault(key, _CacheHandle())
+            now = time.monotonic()
+            live = handle.name if handle.name and now < handle.expires_at else None
+
+            if live and now < handle.expires_at - CONTEXT_CACHE_REFRESH_SECONDS:
+                return live
+            if handle.in_progress:
+                return live
+            if not live and now < handle.retry_after:
+                return None
+            handle.in_progress = True
+
+        try:
+            if live:
+                name = self._refresh(key, live)
+                if name:
+                    return name
+            return self._create(key, instruction)
+        finally:
+            with self._lock:
+                handle.in_progress = False
+
+    def _refresh(self, key: str, name: str) -> Optional[str]:
+        try:
+            self.client.caches.update(
+                name=name,
+                config=types.UpdateCachedContentConfig(ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s")
+            )
+        except Exception as e:
+            logger.warning(f"Refreshing context cache {key} failed, recreating: {e}")
+            with self._lock:
+                self.counters["recreated"] += 1
+            return None
+
+        with self._lock:
+            handle = self._handles[key]
+            if handle.name == name:  # Unless invalidated meanwhile
+                handle.expires_at = time.monotonic() + CONTEXT_CACHE_TTL_SECONDS
+            self.counters["refreshed"] += 1
+        return name
+
+    def _create(self, key: str, instruction: str) -> Optional[str]:
+        try:
+            cached = self.client.caches.create(
+                model=self.model,
+                contents=[_CACHE_PREAMBLE],
+                config=types.CreateCachedContentConfig(
+                    system_instruction=instruction,
+                    display_name=f"shift-handover-{key}",
+                    ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s",
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Creating context cache {key} failed, sending instructions inline: {e}")
+            with self._lock:
+                handle = self._handles[key]
+                handle.name = None
+                handle.retry_after = time.monotonic() + CONTEXT_CACHE_RETRY_SECONDS
+                self.counters["create_failed"] += 1
+            return None
+
+        with self._lock:
+            handle = self._handles[key]
+            handle.name = cached.name
+            handle.expires_at = time.monotonic() + CONTEXT_CACHE_TTL_SECONDS
+            self.counters["created"] += 1
+        return cached.name
+
+    def invalidate(self, key: str):
+        """Forget a handle the API rejected (expired or deleted); the next call recreates it"""
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle and handle.name:
+                handle.name = None
+                handle.expires_at = 0.0
+                self.counters["recreated"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            live = sorted(key for key, handle in self._handles.items() if handle.name)
+        return {"enabled": CONTEXT_CACHE_ENABLED, "live": live, **self.counters}
+
+
+class TokenUsage:
+    """Prompt/cached/output token totals and latency per instruction name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, float]] = {}
+
+    def record(self, key: str, usage_metadata: Any, seconds: float, via_cache: bool):
+        prompt = getattr(usage_metadata, "prompt_token_count", None) or 0
+        cached = getattr(usage_metadata, "cached_content_token_count", None) or 0
+        output = getattr(usage_metadata, "candidates_token_count", None) or 0
+        with self._lock:
+            totals = self._totals.setdefault(key, {
+                "calls": 0, "explicitCacheCalls": 0, "promptTokens": 0, "cachedTokens": 0,
+                "outputTokens": 0, "seconds": 0.0,
+            })
+            totals["calls"] += 1
+            totals["explicitCacheCalls"] += via_cache
+            totals["promptTokens"] += prompt
+            totals["cachedTokens"] += cached
+            totals["outputTokens"] += output
+            totals["seconds"] += seconds
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                key: {
+                    "calls": int(totals["calls"]),
+                    "explicitCacheCalls": int(totals["explicitCacheCalls"]),
+                    "promptTokens": int(totals["promptTokens"]),
+                    "cachedTokens": int(totals["cachedTokens"]),
+                    "uncachedTokens": int(totals["promptTokens"] - totals["cachedTokens"]),
+                    "outputTokens": int(totals["outputTokens"]),
+                    "avgLatencyMs": round(totals["seconds"] / totals["calls"] * 1000, 1),
+                }
+                for key, totals in self._totals.items()
+            }
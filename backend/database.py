@@ -1,12 +1,26 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, String, Text, DateTime
-from datetime import datetime
+from sqlalchemy.pool import NullPool
+from sqlalchemy import (
+    Boolean, Column, Date, DateTime, Float, Integer, LargeBinary, String, Text, func, insert, inspect, select, text
+)
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import date, datetime
+import asyncio
+import logging
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-import json
-from typing import Dict, Any, Optional
+import archive
+import compression
+import fast_json
+import postgres
+from rollups import extract_alarm_facts, extract_issue_facts
+from schemas import encode_handover_response
+from typing import Dict, Any, Optional, AsyncIterator, List, Tuple
+
+logger = logging.getLogger(__name__)
 
 # Load .env from project root (two levels up from this file)
 env_path = Path(__file__).parent.parent / ".env"
@@ -14,10 +28,61 @@ load_dotenv(dotenv_path=env_path)
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./handover.db")
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Hosting providers hand out plain postgres:// URLs; always use the asyncpg driver
+for _prefix in ("postgres://", "postgresql://"):
+    if DATABASE_URL.startswith(_prefix):
+        DATABASE_URL = "postgresql+asyncpg://" + DATABASE_URL[len(_prefix):]
+
+IS_POSTGRES = DATABASE_URL.startswith("postgresql+asyncpg://")
+
+
+def _json_text_serializer(value: Any) -> str:
+    # Handover JSON is serialized by the caller; pass it through unchanged
+    return value if isinstance(value, str) else fast_json.dumps(value)
+
+
+def _json_text_deserializer(value: str) -> str:
+    # Return JSONB as text, like the TEXT columns on SQLite
+    return value
+
+
+def _engine_options(is_postgres: bool = IS_POSTGRES) -> Dict[str, Any]:
+    if not is_postgres:
+        return {}
+    return {
+        # Per worker process: size so that replicas * workers * (size + overflow)
+        # stays below the server's max_connections
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800")),
+        "pool_pre_ping": True,
+        "json_serializer": _json_text_serializer,
+        "json_deserializer": _json_text_deserializer,
+        "connect_args": {
+            "command_timeout": float(os.getenv("DB_COMMAND_TIMEOUT", "30")),
+            # Set to 0 behind PgBouncer in transaction pooling mode
+            "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+            "server_settings": {
+                "application_name": "shift-handover-intelligence",
+                "jit": "off",
+            },
+        },
+    }
+
+
+engine = create_async_engine(DATABASE_URL, echo=True, **_engine_options())
+# Health checks connect outside the request pool, so an exhausted pool does not
+# fail the probe and a hung ping does not hold a connection traffic needs
+ping_engine = create_async_engine(
+    DATABASE_URL, poolclass=NullPool, connect_args=_engine_options().get("connect_args", {})
+)
 async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
+# JSON exchanged as text in Python; JSONB on PostgreSQL, TEXT elsewhere
+JSONText = Text().with_variant(JSONB(none_as_null=True), "postgresql")
+
 
 class HandoverSessionDB(Base):
     """SQLAlchemy model for handover sessions"""
@@ -26,17 +91,178 @@ class HandoverSessionDB(Base):
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String, unique=True, index=True, nullable=False)
     shift_notes = Column(Text, nullable=False)
-    alarms_json = Column(Text, nullable=True)  # JSON stored as text
+    alarms_json = Column(JSONText, nullable=True)  # JSON stored as text (JSONB on PostgreSQL)
     trends_csv = Column(Text, nullable=True)
     markdown_output = Column(Text, nullable=False)
-    json_output = Column(Text, nullable=False)  # JSON stored as text
+    json_output = Column(JSONText, nullable=False)  # JSON stored as text (JSONB on PostgreSQL)
+    previous_session_id = Column(String, nullable=True, index=True)  # Set for incremental handovers
+    request_hash = Column(String(64), nullable=True, index=True)  # Exact-match cache key
+    similarity_signature = Column(Text, nullable=True)  # Near-duplicate cache key (see handover_cache)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    # Full HandoverResponse body, compressed once at write time for GET /api/handover/{id}
+    response_body = Column(LargeBinary, nullable=True)
+    response_encoding = Column(String(8), nullable=True)
+
+
+class HandoverIssueDB(Base):
+    """One row per open issue of each session (see rollups)"""
+    __tablename__ = "handover_issues"
+
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String, nullable=False, index=True)
+    day = Column(Date, nullable=False, index=True)
+    issue_key = Column(String(64), nullable=False, index=True)
+    issue = Column(Text, nullable=False)
+    priority = Column(String(8), nullable=False)
+    confidence = Column(Float, nullable=False)
+
+
+class HandoverAlarmDB(Base):
+    """One row per input alarm of each session (see rollups)"""
+    __tablename__ = "handover_alarms"
+
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String, nullable=False, index=True)
+    day = Column(Date, nullable=False, index=True)
+    alarm_key = Column(String, nullable=False)
+    tag = Column(String, nullable=False, index=True)
+    unit = Column(String, nullable=False)
+    priority = Column(String(16), nullable=False)
+    critical = Column(Boolean, nullable=False)
+
+
+class IssueDailyRollupDB(Base):
+    """Per-day issue counts, incremented as sessions are saved"""
+    __tablename__ = "issue_daily_rollups"
+
+    day = Column(Date, primary_key=True)
+    issue_key = Column(String(64), primary_key=True)
+    occurrences = Column(Integer, nullable=False)
+    high_priority = Column(Integer, nullable=False)
+    confidence_sum = Column(Float, nullable=False)
+    sample_issue = Column(Text, nullable=False)  # Most recent wording
+    last_session_id = Column(String, nullable=False)
+
+
+class AlarmDailyRollupDB(Base):
+    """Per-day alarm counts by tag, incremented as sessions are saved"""
+    __tablename__ = "alarm_daily_rollups"
+
+    day = Column(Date, primary_key=True)
+    tag = Column(String, primary_key=True)
+    unit = Column(String, nullable=False, index=True)
+    occurrences = Column(Integer, nullable=False)
+    critical_occurrences = Column(Integer, nullable=False)
+    sessions = Column(Integer, nullable=False)
+
+
+class HandoverPdfDB(Base):
+    """Rendered PDF reports, stored compressed"""
+    __tablename__ = "handover_pdfs"
+
+    session_id = Column(String, primary_key=True)
+    content = Column(LargeBinary, nullable=False)
+    encoding = Column(String(8), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class NoteChunkSummaryDB(Base):
+    """Cached map-step summaries of long shift-log chunks (see long_notes)"""
+    __tablename__ = "note_chunk_summaries"
+
+    chunk_hash = Column(String(64), primary_key=True)
+    summary = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ArchiveBlockDB(Base):
+    """Gzip-compressed JSON lines of up to ARCHIVE_BLOCK_ROWS archived sessions (see archive)"""
+    __tablename__ = "archive_blocks"
+
+    id = Column(Integer, primary_key=True)
+    archive_month = Column(String(7), nullable=False, index=True)  # YYYY-MM
+    row_count = Column(Integer, nullable=False)
+    content = Column(LargeBinary, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class ArchivedSessionDB(Base):
+    """Which archive block holds an archived handover session"""
+    __tablename__ = "archived_sessions"
+
+    session_id = Column(String, primary_key=True)
+    archive_month = Column(String(7), nullable=False, index=True)  # YYYY-MM
+    block_id = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=True, index=True)
+
+
+# Columns copied into archive blocks (id and cache keys are not kept)
+ARCHIVED_COLUMNS = (
+    "session_id",
+    "shift_notes",
+    "alarms_json",
+    "trends_csv",
+    "markdown_output",
+    "json_output",
+    "previous_session_id",
+    "created_at",
+)
+
+
+# handover_sessions columns added after the original schema; create_all does
+# not alter existing tables, so init_db adds them to older databases
+ADDED_SESSION_COLUMNS = (
+    ("previous_session_id", "VARCHAR"),
+    ("request_hash", "VARCHAR(64)"),
+    ("similarity_signature", "TEXT"),
+    ("response_body", "BLOB"),
+    ("response_encoding", "VARCHAR(8)"),
+)
+ADDED_SESSION_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS ix_handover_sessions_created_at ON handover_sessions (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_handover_sessions_previous_session_id "
+    "ON handover_sessions (previous_session_id)",
+    "CREATE INDEX IF NOT EXISTS ix_handover_sessions_request_hash ON handover_sessions (request_hash)",
+)
+
+
+def _add_missing_session_columns(sync_conn) -> List[str]:
+    """ALTER an existing handover_sessions table up to the current model; returns the added columns"""
+    existing = {column["name"] for column in inspect(sync_conn).get_columns("handover_sessions")}
+    added = []
+    for name, column_type in ADDED_SESSION_COLUMNS:
+        if name not in existing:
+            sync_conn.execute(text(f"ALTER TABLE handover_sessions ADD COLUMN {name} {column_type}"))
+            added.append(name)
+    for statement in ADDED_SESSION_INDEXES:
+        sync_conn.execute(text(statement))
+    return added
+
+
 async def init_db():
     """Initialize database tables"""
     async with engine.begin() as conn:
+        if IS_POSTGRES:
+            # Partitioned handover_sessions; create_all then skips it
+            await postgres.create_schema(conn)
+        else:
+            # Takes effect only for a new file (before its first table); existing
+            # files are converted by maintenance when MAINTENANCE_CONVERT_AUTO_VACUUM is set
+            await conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
         await conn.run_sync(Base.metadata.create_all)
+        if not IS_POSTGRES:
+            added = await conn.run_sync(_add_missing_session_columns)
+            if added:
+                logger.info(f"Added handover_sessions columns: {', '.join(added)}")
+
+
+async def ping_database(pooled: bool = False):
+    """
+    Round-trip a trivial query on a fresh, unpooled connection, or on a
+    pooled one with pooled=True (warm-up uses that to open the pool)
+    """
+    async with (engine if pooled else ping_engine).connect() as conn:
+        await conn.execute(text("SELECT 1"))
 
 
 async def get_session() -> AsyncSession:
@@ -45,6 +271,80 @@ async def get_session() -> AsyncSession:
         yield session
 
 
+_dialect_insert = pg_insert if IS_POSTGRES else sqlite_insert
+
+
+async def record_session_facts(
+    session: AsyncSession,
+    session_id: str,
+    day: date,
+    alarms_json: Optional[Dict[str, Any]],
+    json_output: Dict[str, Any]
+):
+    """
+    Insert the session's issue and alarm rows and bump the daily rollups.
+    Runs in the caller's transaction, so facts commit with the session.
+    """
+    issues = extract_issue_facts(json_output)
+    alarms = extract_alarm_facts(alarms_json, json_output)
+
+    if issues:
+        await session.execute(insert(HandoverIssueDB), [
+            {"session_id": session_id, "day": day, **issue} for issue in issues
+        ])
+        per_issue: Dict[str, Dict[str, Any]] = {}
+        for issue in issues:
+            rollup = per_issue.setdefault(issue["issue_key"], {
+                "day": day, "issue_key": issue["issue_key"], "occurrences": 0, "high_priority": 0,
+                "confidence_sum": 0.0, "sample_issue": issue["issue"], "last_session_id": session_id,
+            })
+            rollup["occurrences"] += 1
+            rollup["high_priority"] += issue["priority"] == "High"
+            rollup["confidence_sum"] += issue["confidence"]
+        statement = _dialect_insert(IssueDailyRollupDB).values(list(per_issue.values()))
+        excluded = statement.excluded
+        await session.execute(statement.on_conflict_do_update(
+            index_elements=["day", "issue_key"],
+            set_={
+                "occurrences": IssueDailyRollupDB.occurrences + excluded.occurrences,
+                "high_priority": IssueDailyRollupDB.high_priority + excluded.high_priority,
+                "confidence_sum": IssueDailyRollupDB.confidence_sum + excluded.confidence_sum,
+                "sample_issue": excluded.sample_issue,
+                "last_session_id": excluded.last_session_id,
+            }
+        ))
+
+    if alarms:
+        await session.execute(insert(HandoverAlarmDB), [
+            {"session_id": session_id, "day": day, **alarm} for alarm in alarms
+        ])
+        per_tag: Dict[str, Dict[str, Any]] = {}
+        for alarm in alarms:
+            rollup = per_tag.setdefault(alarm["tag"], {
+                "day": day, "tag": alarm["tag"], "unit": alarm["unit"],
+                "occurrences": 0, "critical_occurrences": 0, "sessions": 1,
+            })
+            rollup["occurrences"] += 1
+            rollup["critical_occurrences"] += alarm["critical"]
+        statement = _dialect_insert(AlarmDailyRollupDB).values(list(per_tag.values()))
+        excluded = statement.excluded
+        await session.execute(statement.on_conflict_do_update(
+            index_elements=["day", "tag"],
+            set_={
+                "occurrences": AlarmDailyRollupDB.occurrences + excluded.occurrences,
+                "critical_occurrences": AlarmDailyRollupDB.critical_occurrences + excluded.critical_occurrences,
+                "sessions": AlarmDailyRollupDB.sessions + excluded.sessions,
+            }
+        ))
+
+
+def precompressed_response(markdown_output: str, json_text: str, session_id: str) -> Dict[str, Any]:
+    """response_body/response_encoding column values for a stored session"""
+    encoding = compression.PRECOMPRESSED_ENCODING
+    body = encode_handover_response(markdown_output, json_text, session_id)
+    return {"response_body": compression.compress(body, encoding), "response_encoding": encoding}
+
+
 async def save_handover_session(
     session: AsyncSession,
     session_id: str,
@@ -52,31 +352,336 @@ async def save_handover_session(
     alarms_json: Optional[Dict[str, Any]],
     trends_csv: Optional[str],
     markdown_output: str,
-    json_output: Dict[str, Any]
+    json_output: Dict[str, Any],
+    previous_session_id: Optional[str] = None,
+    request_hash: Optional[str] = None,
+    similarity_signature: Optional[str] = None,
+    record_facts: bool = True
 ) -> HandoverSessionDB:
-    """Save a handover session to the database"""
+    """
+    Save a handover session to the database. record_facts=False skips the
+    rollups, for results reused from the cache that were already counted.
+    """
 
+    json_text = fast_json.dumps(json_output)
     db_session = HandoverSessionDB(
         session_id=session_id,
         shift_notes=shift_notes,
-        alarms_json=json.dumps(alarms_json) if alarms_json else None,
+        alarms_json=fast_json.dumps(alarms_json) if alarms_json else None,
         trends_csv=trends_csv,
         markdown_output=markdown_output,
-        json_output=json.dumps(json_output)
+        json_output=json_text,
+        previous_session_id=previous_session_id,
+        request_hash=request_hash,
+        similarity_signature=similarity_signature,
+        **precompressed_response(markdown_output, json_text, session_id)
     )
 
     session.add(db_session)
+    if record_facts:
+        await record_session_facts(session, session_id, datetime.utcnow().date(), alarms_json, json_output)
     await session.commit()
-    await session.refresh(db_session)
 
+    # expire_on_commit is off, so the instance is still readable without a refresh round trip
     return db_session
 
 
+async def bulk_save_handover_sessions(session: AsyncSession, rows: List[Dict[str, Any]]) -> int:
+    """
+    Insert many sessions in one round trip: COPY on PostgreSQL, executemany
+    elsewhere. Rows use the save_handover_session argument names, including
+    record_facts (default True).
+    """
+    if not rows:
+        return 0
+
+    now = datetime.utcnow()
+    records = []
+    for row in rows:
+        json_text = fast_json.dumps(row["json_output"])
+        records.append({
+            "session_id": row["session_id"],
+            "shift_notes": row["shift_notes"],
+            "alarms_json": fast_json.dumps(row["alarms_json"]) if row.get("alarms_json") else None,
+            "trends_csv": row.get("trends_csv"),
+            "markdown_output": row["markdown_output"],
+            "json_output": json_text,
+            "previous_session_id": row.get("previous_session_id"),
+            "request_hash": row.get("request_hash"),
+            "similarity_signature": row.get("similarity_signature"),
+            "created_at": row.get("created_at") or now,
+            **precompressed_response(row["markdown_output"], json_text, row["session_id"]),
+        })
+
+    if IS_POSTGRES:
+        count = await postgres.copy_sessions(await session.connection(), records)
+    else:
+        await session.execute(insert(HandoverSessionDB), records)
+        count = len(records)
+    for row, record in zip(rows, records):
+        if not row.get("record_facts", True):
+            continue
+        await record_session_facts(
+            session, row["session_id"], record["created_at"].date(), row.get("alarms_json"), row["json_output"]
+        )
+    await session.commit()
+    return count
+
+
+# Sessions acknowledged by the write-behind queue but not committed yet, keyed
+# by session_id (rows use the save_handover_session argument names plus
+# created_at). Readers check it first so requests see their own writes.
+pending_sessions: Dict[str, Dict[str, Any]] = {}
+
+
+def _pending_session(row: Dict[str, Any]) -> HandoverSessionDB:
+    """Detached, read-only instance for a pending row"""
+    return HandoverSessionDB(
+        session_id=row["session_id"],
+        shift_notes=row["shift_notes"],
+        alarms_json=fast_json.dumps(row["alarms_json"]) if row.get("alarms_json") else None,
+        trends_csv=row.get("trends_csv"),
+        markdown_output=row["markdown_output"],
+        json_output=fast_json.dumps(row["json_output"]),
+        previous_session_id=row.get("previous_session_id"),
+        request_hash=row.get("request_hash"),
+        similarity_signature=row.get("similarity_signature"),
+        created_at=row["created_at"],
+    )
+
+
 async def get_handover_session(session: AsyncSession, session_id: str) -> Optional[HandoverSessionDB]:
-    """Retrieve a handover session by session_id"""
-    from sqlalchemy import select
+    """
+    Retrieve a handover session by session_id: pending write-behind rows
+    first, then the table, then the archive blocks for sessions moved out of
+    the hot table.
+    """
+    pending = pending_sessions.get(session_id)
+    if pending is not None:
+        return _pending_session(pending)
 
     result = await session.execute(
         select(HandoverSessionDB).where(HandoverSessionDB.session_id == session_id)
     )
+    db_session = result.scalar_one_or_none()
+    if db_session is not None:
+        return db_session
+
+    archived = await session.get(ArchivedSessionDB, session_id)
+    if archived is None:
+        return None
+
+    block = await session.get(ArchiveBlockDB, archived.block_id)
+    if block is None:
+        return None
+    row = await asyncio.to_thread(archive.read_row, block.content, session_id)
+    # Detached instance: readable like a live row, never added to the session
+    return HandoverSessionDB(**row) if row else None
+
+
+async def session_has_trends(session: AsyncSession, session_id: str) -> Optional[bool]:
+    """
+    Whether a session still has trend data (None when the session is gone),
+    without loading the CSV for sessions in the hot table
+    """
+    pending = pending_sessions.get(session_id)
+    if pending is not None:
+        return bool(pending.get("trends_csv"))
+
+    result = await session.execute(
+        select(HandoverSessionDB.trends_csv.isnot(None))
+        .where(HandoverSessionDB.session_id == session_id)
+    )
+    has_trends = result.scalar_one_or_none()
+    if has_trends is not None:
+        return bool(has_trends)
+
+    archived = await get_handover_session(session, session_id)
+    return None if archived is None else bool(archived.trends_csv)
+
+
+async def find_session_by_request_hash(
+    session: AsyncSession,
+    request_hash: str,
+    since: datetime
+) -> Optional[HandoverSessionDB]:
+    """Most recent session created since `since` for an identical request"""
+    for row in reversed(list(pending_sessions.values())):
+        if row.get("request_hash") == request_hash and row["created_at"] >= since:
+            return _pending_session(row)
+
+    result = await session.execute(
+        select(HandoverSessionDB)
+        .where(HandoverSessionDB.request_hash == request_hash)
+        .where(HandoverSessionDB.created_at >= since)
+        .order_by(HandoverSessionDB.created_at.desc())
+        .limit(1)
+    )
     return result.scalar_one_or_none()
+
+
+async def get_cached_pdf(session: AsyncSession, session_id: str) -> Optional[HandoverPdfDB]:
+    return await session.get(HandoverPdfDB, session_id)
+
+
+async def save_cached_pdf(session: AsyncSession, session_id: str, content: bytes, encoding: str):
+    """Store a compressed PDF for a session, replacing any previous one"""
+    await session.merge(HandoverPdfDB(session_id=session_id, content=content, encoding=encoding))
+    await session.commit()
+
+
+async def get_note_chunk_summaries(session: AsyncSession, chunk_hashes: List[str]) -> Dict[str, str]:
+    """Cached summaries for the given chunk hashes, keyed by hash"""
+    if not chunk_hashes:
+        return {}
+    result = await session.execute(
+        select(NoteChunkSummaryDB.chunk_hash, NoteChunkSummaryDB.summary)
+        .where(NoteChunkSummaryDB.chunk_hash.in_(chunk_hashes))
+    )
+    return {chunk_hash: summary for chunk_hash, summary in result.all()}
+
+
+async def save_note_chunk_summaries(session: AsyncSession, summaries: Dict[str, str]):
+    """Store chunk summaries; an existing row for the same hash is overwritten"""
+    for chunk_hash, summary in summaries.items():
+        await session.merge(NoteChunkSummaryDB(chunk_hash=chunk_hash, summary=summary))
+    await session.commit()
+
+
+async def top_recurring_issues(
+    session: AsyncSession,
+    start: date,
+    end: date,
+    limit: int,
+    min_occurrences: int = 1
+) -> List[Dict[str, Any]]:
+    """Issues ranked by occurrences between start and end (inclusive), from the daily rollups"""
+    occurrences = func.sum(IssueDailyRollupDB.occurrences).label("occurrences")
+    result = await session.execute(
+        select(
+            IssueDailyRollupDB.issue_key,
+            occurrences,
+            func.count(IssueDailyRollupDB.day).label("days_seen"),
+            func.sum(IssueDailyRollupDB.high_priority).label("high_priority"),
+            (func.sum(IssueDailyRollupDB.confidence_sum) / func.sum(IssueDailyRollupDB.occurrences)).label("avg_confidence"),
+            func.min(IssueDailyRollupDB.day).label("first_seen"),
+            func.max(IssueDailyRollupDB.day).label("last_seen"),
+            func.max(IssueDailyRollupDB.sample_issue).label("issue"),
+        )
+        .where(IssueDailyRollupDB.day >= start)
+        .where(IssueDailyRollupDB.day <= end)
+        .group_by(IssueDailyRollupDB.issue_key)
+        .having(occurrences >= min_occurrences)
+        .order_by(occurrences.desc(), IssueDailyRollupDB.issue_key)
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in result]
+
+
+async def alarm_frequency_by_tag(
+    session: AsyncSession,
+    start: date,
+    end: date,
+    limit: int,
+    unit: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Alarm counts per tag between start and end (inclusive), from the daily rollups"""
+    occurrences = func.sum(AlarmDailyRollupDB.occurrences).label("occurrences")
+    query = (
+        select(
+            AlarmDailyRollupDB.tag,
+            func.max(AlarmDailyRollupDB.unit).label("unit"),
+            occurrences,
+            func.sum(AlarmDailyRollupDB.critical_occurrences).label("critical_occurrences"),
+            func.sum(AlarmDailyRollupDB.sessions).label("sessions"),
+            func.count(AlarmDailyRollupDB.day).label("days_seen"),
+            func.max(AlarmDailyRollupDB.day).label("last_seen"),
+        )
+        .where(AlarmDailyRollupDB.day >= start)
+        .where(AlarmDailyRollupDB.day <= end)
+        .group_by(AlarmDailyRollupDB.tag)
+        .order_by(occurrences.desc(), AlarmDailyRollupDB.tag)
+        .limit(limit)
+    )
+    if unit:
+        query = query.where(AlarmDailyRollupDB.unit == unit)
+    result = await session.execute(query)
+    return [dict(row._mapping) for row in result]
+
+
+async def load_similarity_signatures(since: datetime, limit: int) -> List[Tuple[str, datetime, str]]:
+    """(session_id, created_at, similarity_signature) for recent sessions, oldest first"""
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(
+                HandoverSessionDB.session_id,
+                HandoverSessionDB.created_at,
+                HandoverSessionDB.similarity_signature
+            )
+            .where(HandoverSessionDB.created_at >= since)
+            .where(HandoverSessionDB.similarity_signature.is_not(None))
+            .order_by(HandoverSessionDB.created_at.desc())
+            .limit(limit)
+        )
+        return [tuple(row) for row in reversed(result.all())]
+
+
+async def _stream_archived_sessions(
+    start: Optional[datetime],
+    end: Optional[datetime]
+) -> AsyncIterator[List[Tuple[str, datetime, str]]]:
+    """Archived rows in the window, one decompressed block at a time"""
+    query = select(ArchivedSessionDB.block_id).distinct().order_by(ArchivedSessionDB.block_id)
+    if start is not None:
+        query = query.where(ArchivedSessionDB.created_at >= start)
+    if end is not None:
+        query = query.where(ArchivedSessionDB.created_at < end)
+
+    async with async_session_maker() as session:
+        block_ids = (await session.execute(query)).scalars().all()
+        for block_id in block_ids:
+            content = await session.scalar(select(ArchiveBlockDB.content).where(ArchiveBlockDB.id == block_id))
+            if content is None:
+                continue
+            rows = await asyncio.to_thread(archive.decode_block, content)
+            batch = sorted(
+                (
+                    (row["session_id"], row["created_at"], row["json_output"]) for row in rows
+                    if (start is None or row["created_at"] >= start) and (end is None or row["created_at"] < end)
+                ),
+                key=lambda row: row[1]
+            )
+            if batch:
+                yield batch
+
+
+async def stream_handover_sessions(
+    start: Optional[datetime],
+    end: Optional[datetime],
+    batch_size: int = 500
+) -> AsyncIterator[List[Tuple[str, datetime, str]]]:
+    """
+    Stream (session_id, created_at, json_output) rows in created_at order,
+    archived sessions first (they are older than anything in the table).
+
+    Uses a server-side cursor with its own database session so that callers
+    (e.g. streaming responses) hold at most one batch in memory.
+    """
+    async for batch in _stream_archived_sessions(start, end):
+        yield batch
+
+    query = select(
+        HandoverSessionDB.session_id,
+        HandoverSessionDB.created_at,
+        HandoverSessionDB.json_output
+    ).order_by(HandoverSessionDB.created_at, HandoverSessionDB.id)
+
+    if start is not None:
+        query = query.where(HandoverSessionDB.created_at >= start)
+    if end is not None:
+        query = query.where(HandoverSessionDB.created_at < end)
+
+    async with async_session_maker() as session:
+        result = await session.stream(query.execution_options(yield_per=batch_size))
+        async for partition in result.partitions():
+            yield [tuple(row) for row in partition]
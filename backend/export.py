@@ -0,0 +1,206 @@
+"""
+Bulk export of handover history for analytics.
+
+Rows are streamed from the database in batches and flattened into a columnar
+layout (parallel lists for open issues and critical alarms) so that downstream
+tools can query them without re-parsing the stored JSON output.
+"""
+
+import csv
+from datetime import datetime
+from io import StringIO
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+    pq = None
+
+import fast_json
+from database import stream_handover_sessions
+
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+EXPORT_COLUMNS = [
+    "session_id",
+    "created_at",
+    "shift_summary",
+    "critical_alarm",
+    "critical_alarm_meaning",
+    "open_issue",
+    "open_issue_priority",
+    "open_issue_confidence",
+    "recommended_actions",
+    "questions",
+    "critical_alarm_count",
+    "open_issue_count",
+    "high_priority_issue_count",
+]
+
+LIST_COLUMNS = {
+    "shift_summary",
+    "critical_alarm",
+    "critical_alarm_meaning",
+    "open_issue",
+    "open_issue_priority",
+    "open_issue_confidence",
+    "recommended_actions",
+    "questions",
+}
+
+
+def parquet_available() -> bool:
+    """Whether the optional pyarrow dependency is installed"""
+    return pa is not None
+
+
+def flatten_session(session_id: str, created_at: Optional[datetime], json_output: str) -> Dict[str, Any]:
+    """Flatten one stored handover into a single columnar export row"""
+    data = fast_json.loads(json_output) if json_output else {}
+    alarms = data.get("criticalAlarms") or []
+    issues = data.get("openIssues") or []
+
+    return {
+        "session_id": session_id,
+        "created_at": created_at,
+        "shift_summary": list(data.get("shiftSummary") or []),
+        "critical_alarm": [a.get("alarm", "") for a in alarms],
+        "critical_alarm_meaning": [a.get("meaning", "") for a in alarms],
+        "open_issue": [i.get("issue", "") for i in issues],
+        "open_issue_priority": [i.get("priority", "") for i in issues],
+        "open_issue_confidence": [float(i.get("confidence", 0)) for i in issues],
+        "recommended_actions": list(data.get("recommendedActions") or []),
+        "questions": list(data.get("questions") or []),
+        "critical_alarm_count": len(alarms),
+        "open_issue_count": len(issues),
+        "high_priority_issue_count": sum(1 for i in issues if i.get("priority") == "High"),
+    }
+
+
+async def _iter_flat_batches(
+    start: Optional[datetime],
+    end: Optional[datetime],
+    batch_size: int
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    async for batch in stream_handover_sessions(start, end, batch_size):
+        yield [flatten_session(*row) for row in batch]
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+async def iter_ndjson(start: Optional[datetime], end: Optional[datetime], batch_size: int) -> AsyncIterator[bytes]:
+    """Yield newline-delimited JSON, one encoded chunk per database batch"""
+    async for rows in _iter_flat_batches(start, end, batch_size):
+        lines = []
+        for row in rows:
+            row["created_at"] = _isoformat(row["created_at"])
+            lines.append(fast_json.dumps(row))
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+async def iter_csv(start: Optional[datetime], end: Optional[datetime], batch_size: int) -> AsyncIterator[bytes]:
+    """Yield CSV with list columns encoded as JSON arrays"""
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+
+    async for rows in _iter_flat_batches(start, end, batch_size):
+        for row in rows:
+            row["created_at"] = _isoformat(row["created_at"])
+            for column in LIST_COLUMNS:
+                row[column] = fast_json.dumps(row[column])
+            writer.writerow(row)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+
+    # Header-only export when the range is empty
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _DrainableSink:
+    """Write-only file object whose contents can be drained between row groups"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet_schema():
+    return pa.schema([
+        ("session_id", pa.string()),
+        ("created_at", pa.timestamp("us")),
+        ("shift_summary", pa.list_(pa.string())),
+        ("critical_alarm", pa.list_(pa.string())),
+        ("critical_alarm_meaning", pa.list_(pa.string())),
+        ("open_issue", pa.list_(pa.string())),
+        ("open_issue_priority", pa.list_(pa.string())),
+        ("open_issue_confidence", pa.list_(pa.float64())),
+        ("recommended_actions", pa.list_(pa.string())),
+        ("questions", pa.list_(pa.string())),
+        ("critical_alarm_count", pa.int32()),
+        ("open_issue_count", pa.int32()),
+        ("high_priority_issue_count", pa.int32()),
+    ])
+
+
+async def iter_parquet(start: Optional[datetime], end: Optional[datetime], batch_size: int) -> AsyncIterator[bytes]:
+    """Yield a Parquet file, writing one row group per database batch"""
+    if pa is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+
+    schema = _parquet_schema()
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+
+    try:
+        async for rows in _iter_flat_batches(start, end, batch_size):
+            table = pa.Table.from_pylist(rows, schema=schema)
+            writer.write_table(table)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+
+    data = sink.drain()
+    if data:
+        yield data
+
+
+EXPORT_WRITERS = {
+    "ndjson": iter_ndjson,
+    "csv": iter_csv,
+    "parquet": iter_parquet,
+}
@@ -0,0 +1,91 @@
+"""
+JSON encoding helpers.
+
+Uses orjson when it is installed and falls back to the standard library
+otherwise, so callers never need to care which backend is active.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so this catches both
+JSONDecodeError = json.JSONDecodeError
+
+
+def orjson_available() -> bool:
+    """Whether the orjson backend is in use"""
+    return orjson is not None
+
+
+def _json_dumps(obj: Any, **options: Any) -> str:
+    if "indent" not in options:
+        options["separators"] = (",", ":")
+    return json.dumps(obj, ensure_ascii=False, **options)
+
+
+def _too_wide(error: Exception) -> bool:
+    # orjson only handles 64-bit integers; the standard library has no limit
+    return "64-bit" in str(error)
+
+
+if orjson is not None:
+    _DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def _orjson_dumps(obj: Any, option: int, **fallback: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError as e:
+            if not _too_wide(e):
+                raise
+            return _json_dumps(obj, **fallback).encode("utf-8")
+
+    def dumps_bytes(obj: Any) -> bytes:
+        """Serialize to compact UTF-8 JSON bytes"""
+        return _orjson_dumps(obj, _DUMPS_OPTIONS)
+
+    def dumps(obj: Any) -> str:
+        """Serialize to a compact JSON string"""
+        return _orjson_dumps(obj, _DUMPS_OPTIONS).decode("utf-8")
+
+    def dumps_pretty(obj: Any) -> str:
+        """Serialize to a JSON string indented by two spaces"""
+        return _orjson_dumps(obj, _DUMPS_OPTIONS | orjson.OPT_INDENT_2, indent=2).decode("utf-8")
+
+    def dumps_canonical(obj: Any) -> bytes:
+        """Serialize with sorted keys, for hashing"""
+        return _orjson_dumps(obj, _DUMPS_OPTIONS | orjson.OPT_SORT_KEYS, sort_keys=True)
+
+    def loads(data: Any) -> Any:
+        """Parse JSON from str or bytes"""
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            if not _too_wide(e):
+                raise
+            return json.loads(data)
+
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        """Serialize to compact UTF-8 JSON bytes"""
+        return _json_dumps(obj).encode("utf-8")
+
+    def dumps(obj: Any) -> str:
+        """Serialize to a compact JSON string"""
+        return _json_dumps(obj)
+
+    def dumps_pretty(obj: Any) -> str:
+        """Serialize to a JSON string indented by two spaces"""
+        return _json_dumps(obj, indent=2)
+
+    def dumps_canonical(obj: Any) -> bytes:
+        """Serialize with sorted keys, for hashing"""
+        return _json_dumps(obj, sort_keys=True).encode("utf-8")
+
+    def loads(data: Any) -> Any:
+        """Parse JSON from str or bytes"""
+        return json.loads(data)
@@ -1,10 +1,15 @@
 from google import genai
+from google.genai import errors, types
 import os
-import json
 import logging
+import time
 from typing import Dict, Any, Tuple, Optional
 from pathlib import Path
 from dotenv import load_dotenv
+import fast_json
+from alarm_context import build_alarm_context
+from context_cache import ContextCacheManager, TokenUsage
+from health import gemini_calls
 from utils import (
     extract_json_from_text,
     validate_handover_json,
@@ -19,6 +24,20 @@ load_dotenv(dotenv_path=env_path)
 
 logger = logging.getLogger(__name__)
 
+# Markers of the placeholder handovers returned when generation fails
+API_ERROR_ISSUE = "Gemini API Error"
+PARSE_FAILURE_SUMMARY = "Could not parse Gemini response"
+
+
+def is_fallback_handover(json_data: Dict[str, Any]) -> bool:
+    """Whether a handover is a placeholder for a failed generation (never cache these)"""
+    issues = json_data.get('openIssues') or []
+    summary = json_data.get('shiftSummary') or []
+    return (
+        any(issue.get('issue') == API_ERROR_ISSUE for issue in issues)
+        or PARSE_FAILURE_SUMMARY in summary
+    )
+
 
 class GeminiClient:
     """Client for interacting with Google Gemini API"""
@@ -56,6 +75,36 @@ Return your response in this exact format:
 ```
 
 Then on a new line, provide the markdown report starting with # Shift Handover Intelligence Report
+"""
+
+    INCREMENTAL_INSTRUCTIONS = """
+INCREMENTAL UPDATE MODE:
+You are given the previous shift's structured handover, this shift's notes, and only the
+alarm and trend data that CHANGED since the previous shift. Unchanged alarms are still active.
+- Update the previous handover rather than starting over.
+- Keep the "id" field of every open issue that is still open; drop issues that were resolved.
+- New open issues must not have an "id".
+"""
+
+    REPAIR_PROMPT = """The user message is a response that should contain valid JSON but is malformed.
+
+Extract and return ONLY a valid JSON object that matches this schema:
+{
+  "shiftSummary": ["..."],
+  "criticalAlarms": [{"alarm": "...", "meaning": "..."}],
+  "openIssues": [{"issue": "...", "priority": "High|Med|Low", "confidence": 0-100}],
+  "recommendedActions": ["..."],
+  "questions": ["..."]
+}
+
+Return ONLY the JSON object, nothing else."""
+
+    CHUNK_SUMMARY_PROMPT = """You are an industrial operations assistant. The user message is one segment of a long shift log, in chronological order.
+
+Condense it into at most 15 concise bullet points for whoever writes the shift handover.
+Keep times, equipment/tag/alarm IDs, measured values, actions taken, unresolved problems and
+anything the next shift must follow up on. Drop routine "all normal" entries. Do not speculate.
+Return only the bullet points.
 """
 
     def __init__(self):
@@ -67,18 +116,68 @@ Then on a new line, provide the markdown report starting with # Shift Handover I
         os.environ['GOOGLE_API_KEY'] = api_key
         self.client = genai.Client(api_key=api_key)
         self.model_name = 'gemini-3-flash-preview'
+        self.context_cache = ContextCacheManager(self.client, self.model_name)
+        self.token_usage = TokenUsage()
+
+    def _generate(self, key: str, instruction: str, contents: str):
+        """
+        Call the model with the static instruction as a system instruction,
+        referenced through its context cache when one is live. A call the API
+        rejects because of the cache is retried once with the instruction inline.
+        """
+        try:
+            response = self._generate_once(key, instruction, contents)
+        except Exception as e:
+            gemini_calls.record_failure(e)
+            raise
+        gemini_calls.record_success()
+        return response
+
+    def _generate_once(self, key: str, instruction: str, contents: str):
+        cache_name = self.context_cache.cache_name(key, instruction)
+        if cache_name:
+            started = time.perf_counter()
+            try:
+                response = self.client.models.generate_content(
+                    model=self.model_name,
+                    contents=contents,
+                    config=types.GenerateContentConfig(cached_content=cache_name)
+                )
+                self.token_usage.record(key, response.usage_metadata, time.perf_counter() - started, True)
+                return response
+            except errors.ClientError as e:
+                if e.code not in (400, 403, 404):
+                    raise
+                logger.warning(f"Context cache {key} rejected ({e.code}), retrying without it")
+                self.context_cache.invalidate(key)
+
+        started = time.perf_counter()
+        response = self.client.models.generate_content(
+            model=self.model_name,
+            contents=contents,
+            config=types.GenerateContentConfig(system_instruction=instruction)
+        )
+        self.token_usage.record(key, response.usage_metadata, time.perf_counter() - started, False)
+        return response
+
+    def usage_metrics(self) -> Dict[str, Any]:
+        return {"contextCache": self.context_cache.metrics(), "tokens": self.token_usage.metrics()}
 
     def _build_prompt(
         self,
         shift_notes: str,
         alarms_json: Optional[Dict[str, Any]],
-        trends_csv: Optional[str]
+        trends_csv: Optional[str],
+        trend_summary: Optional[str] = None
     ) -> str:
-        """Build the complete prompt with all context"""
+        """
+        Build the per-request prompt (SYSTEM_PROMPT goes separately as the
+        system instruction). A precomputed trend_summary (e.g. from a streamed
+        upload) is used instead of parsing trends_csv.
+        """
 
         prompt_parts = [
-            self.SYSTEM_PROMPT,
-            "\n\n=== SHIFT HANDOVER NOTES ===\n",
+            "=== SHIFT HANDOVER NOTES ===\n",
             shift_notes
         ]
 
@@ -89,14 +188,22 @@ Then on a new line, provide the markdown report starting with # Shift Handover I
                 formatted_alarms
             ])
 
-        if trends_csv:
-            trend_summary = parse_csv_to_summary(trends_csv)
-            if trend_summary:
+            # Per-alarm evidence from the matching trend series
+            alarm_context = build_alarm_context(alarms_json, trends_csv)
+            if alarm_context:
                 prompt_parts.extend([
-                    "\n\n=== TREND DATA SUMMARY ===\n",
-                    trend_summary
+                    "\n\n=== ALARM-TREND CORRELATION (computed from trend data) ===\n",
+                    alarm_context
                 ])
 
+        if trend_summary is None and trends_csv:
+            trend_summary = parse_csv_to_summary(trends_csv)
+        if trend_summary:
+            prompt_parts.extend([
+                "\n\n=== TREND DATA SUMMARY ===\n",
+                trend_summary
+            ])
+
         prompt_parts.append(
             "\n\nNow generate the structured handover report as specified."
         )
@@ -106,26 +213,8 @@ Then on a new line, provide the markdown report starting with # Shift Handover I
     def _repair_json_with_gemini(self, invalid_response: str) -> Dict[str, Any]:
         """Use Gemini to repair invalid JSON response"""
 
-        repair_prompt = f"""The following response should contain valid JSON but is malformed:
-
-{invalid_response}
-
-Please extract and return ONLY a valid JSON object that matches this schema:
-{{
-  "shiftSummary": ["..."],
-  "criticalAlarms": [{{"alarm": "...", "meaning": "..."}}],
-  "openIssues": [{{"issue": "...", "priority": "High|Med|Low", "confidence": 0-100}}],
-  "recommendedActions": ["..."],
-  "questions": ["..."]
-}}
-
-Return ONLY the JSON object, nothing else."""
-
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=repair_prompt
-            )
+            response = self._generate("repair", self.REPAIR_PROMPT, invalid_response)
             repaired_text = response.text
 
             # Try to extract JSON
@@ -138,18 +227,64 @@ Return ONLY the JSON object, nothing else."""
 
         # If repair fails, return minimal structure
         return {
-            'shiftSummary': ["Could not parse Gemini response"],
+            'shiftSummary': [PARSE_FAILURE_SUMMARY],
             'criticalAlarms': [],
             'openIssues': [],
             'recommendedActions': ["Review original shift notes manually"],
             'questions': []
         }
 
+    def _parse_response(self, response_text: str) -> Tuple[str, Dict[str, Any]]:
+        """Extract (markdown, structured_json) from a raw Gemini response"""
+
+        # Extract JSON from response
+        json_data = extract_json_from_text(response_text)
+
+        if not json_data:
+            logger.warning("Failed to extract JSON, attempting repair...")
+            json_data = self._repair_json_with_gemini(response_text)
+        else:
+            # Validate and repair the JSON structure
+            json_data = validate_handover_json(json_data)
+
+        # Check if response contains markdown, otherwise generate it
+        if "# Shift Handover" in response_text or "## " in response_text:
+            # Extract markdown portion (after JSON block)
+            parts = response_text.split("```")
+            markdown = parts[-1].strip() if len(parts) > 2 else response_text
+
+            # If markdown is too short, generate it
+            if len(markdown) < 100:
+                markdown = create_markdown_from_structured(json_data)
+        else:
+            # Generate markdown from structured data
+            markdown = create_markdown_from_structured(json_data)
+
+        return markdown, json_data
+
+    def _fallback_response(self, error: Exception) -> Tuple[str, Dict[str, Any]]:
+        """Minimal valid response used when the Gemini call fails"""
+        error_message = f"Error generating handover: {str(error)}"
+        logger.error(error_message, exc_info=True)
+
+        fallback_json = {
+            'shiftSummary': [f"Error occurred: {str(error)}", "Please review shift notes manually"],
+            'criticalAlarms': [],
+            'openIssues': [{"issue": API_ERROR_ISSUE, "priority": "High", "confidence": 100}],
+            'recommendedActions': ["Check API key and connection", "Retry the request"],
+            'questions': []
+        }
+
+        fallback_markdown = create_markdown_from_structured(fallback_json)
+
+        return fallback_markdown, fallback_json
+
     def generate_handover(
         self,
         shift_notes: str,
         alarms_json: Optional[Dict[str, Any]] = None,
-        trends_csv: Optional[str] = None
+        trends_csv: Optional[str] = None,
+        trend_summary: Optional[str] = None
     ) -> Tuple[str, Dict[str, Any]]:
         """
         Generate handover summary using Gemini.
@@ -159,53 +294,93 @@ Return ONLY the JSON object, nothing else."""
         """
 
         # Build the prompt
-        prompt = self._build_prompt(shift_notes, alarms_json, trends_csv)
+        prompt = self._build_prompt(shift_notes, alarms_json, trends_csv, trend_summary)
         try:
             # Call Gemini API
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt
-            )
-            response_text = response.text
-
-            # Extract JSON from response
-            json_data = extract_json_from_text(response_text)
-
-            if not json_data:
-                logger.warning("Failed to extract JSON, attempting repair...")
-                json_data = self._repair_json_with_gemini(response_text)
-            else:
-                # Validate and repair the JSON structure
-                json_data = validate_handover_json(json_data)
-
-            # Check if response contains markdown, otherwise generate it
-            if "# Shift Handover" in response_text or "## " in response_text:
-                # Extract markdown portion (after JSON block)
-                parts = response_text.split("```")
-                markdown = parts[-1].strip() if len(parts) > 2 else response_text
-
-                # If markdown is too short, generate it
-                if len(markdown) < 100:
-                    markdown = create_markdown_from_structured(json_data)
-            else:
-                # Generate markdown from structured data
-                markdown = create_markdown_from_structured(json_data)
-
-            return markdown, json_data
+            response = self._generate("handover", self.SYSTEM_PROMPT, prompt)
+            return self._parse_response(response.text)
 
         except Exception as e:
             # Error handling - return minimal valid response
-            error_message = f"Error generating handover: {str(e)}"
-            logger.error(error_message, exc_info=True)
+            return self._fallback_response(e)
+
+    def summarize_notes_chunk(self, chunk: str) -> str:
+        """
+        Map step of long-notes summarization: condense one chunk of the shift
+        log to bullet points. Errors propagate so failed chunks are not cached.
+        """
+        response = self._generate("chunk_summary", self.CHUNK_SUMMARY_PROMPT, chunk)
+        summary = (response.text or "").strip()
+        if not summary:
+            raise ValueError("Empty chunk summary from Gemini")
+        return summary
+
+    def _build_incremental_prompt(
+        self,
+        previous_handover: Dict[str, Any],
+        shift_notes: str,
+        alarms_delta: Optional[Dict[str, Any]],
+        trends_delta_csv: Optional[str],
+        trend_summary: Optional[str] = None
+    ) -> str:
+        """
+        Build a prompt that updates the previous handover with this shift's
+        changes (the instructions go separately as the system instruction).
+        A precomputed trend_summary (from a streamed upload) stands in for
+        the trend delta when there is no trend CSV.
+        """
+
+        prompt_parts = [
+            "=== PREVIOUS SHIFT HANDOVER (JSON) ===\n",
+            fast_json.dumps(previous_handover),
+            "\n\n=== SHIFT HANDOVER NOTES ===\n",
+            shift_notes,
+            "\n\n=== ALARM CHANGES SINCE PREVIOUS SHIFT (JSON) ===\n",
+            format_alarms_json(alarms_delta) if alarms_delta else "No alarm changes.",
+        ]
 
-            fallback_json = {
-                'shiftSummary': [f"Error occurred: {str(e)}", "Please review shift notes manually"],
-                'criticalAlarms': [],
-                'openIssues': [{"issue": "Gemini API Error", "priority": "High", "confidence": 100}],
-                'recommendedActions': ["Check API key and connection", "Retry the request"],
-                'questions': []
-            }
+        if trends_delta_csv:
+            trend_summary = parse_csv_to_summary(trends_delta_csv)
+            if trend_summary:
+                prompt_parts.extend([
+                    "\n\n=== NEW TREND DATA SINCE PREVIOUS SHIFT ===\n",
+                    trend_summary
+                ])
+        elif trend_summary:
+            prompt_parts.extend([
+                "\n\n=== TREND DATA FOR THIS SHIFT ===\n",
+                trend_summary
+            ])
+
+        prompt_parts.append(
+            "\n\nNow generate the updated structured handover report as specified."
+        )
+
+        return "".join(prompt_parts)
+
+    def generate_incremental_handover(
+        self,
+        previous_handover: Dict[str, Any],
+        shift_notes: str,
+        alarms_delta: Optional[Dict[str, Any]] = None,
+        trends_delta_csv: Optional[str] = None,
+        trend_summary: Optional[str] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Update the previous shift's handover using only what changed since.
+
+        Returns:
+            Tuple of (markdown_string, structured_json_dict)
+        """
 
-            fallback_markdown = create_markdown_from_structured(fallback_json)
+        prompt = self._build_incremental_prompt(
+            previous_handover, shift_notes, alarms_delta, trends_delta_csv, trend_summary
+        )
+        try:
+            response = self._generate(
+                "incremental", self.SYSTEM_PROMPT + self.INCREMENTAL_INSTRUCTIONS, prompt
+            )
+            return self._parse_response(response.text)
 
-            return fallback_markdown, fallback_json
+        except Exception as e:
+            return self._fallback_response(e)
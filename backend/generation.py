@@ -0,0 +1,259 @@
+"""
+Handover generation pipeline shared by the API endpoints.
+
+Resolves the request against the handover cache, runs a full or incremental
+Gemini generation (off the event loop) when needed, and persists the session.
+Concurrent identical requests are coalesced into a single execution.
+"""
+
+import asyncio
+import logging
+import random
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+import fast_json
+from database import (
+    HandoverSessionDB,
+    async_session_maker,
+    find_session_by_request_hash,
+    get_handover_session,
+    save_handover_session
+)
+from gemini_client import GeminiClient, is_fallback_handover
+from handover_cache import (
+    HandoverSignature,
+    handover_agreement,
+    handover_cache,
+    request_fingerprint
+)
+from incremental import assign_issue_ids, build_incremental_inputs
+from long_notes import condense_notes, needs_map_reduce
+from schemas import HandoverRequest, HandoverResponse, HandoverStructured
+from singleflight import SingleFlight
+from write_behind import write_behind
+
+logger = logging.getLogger(__name__)
+
+# In-flight generations keyed by request fingerprint
+generation_flights = SingleFlight()
+
+
+@dataclass
+class GenerationResult:
+    response: HandoverResponse
+    cache_outcome: str
+    # Set when this similarity hit was sampled for a false-hit audit
+    audit_source_session_id: Optional[str] = None
+
+
+async def _resolve_cache(
+    db,
+    request: HandoverRequest,
+    fingerprint: str,
+    signature: HandoverSignature
+) -> Tuple[str, Optional[HandoverSessionDB], Optional[str]]:
+    """
+    Look the request up in the handover cache.
+
+    Returns (outcome, session, similar_session_id) where outcome is one of the
+    cache metric names: for exact/similar hits `session` holds the result to
+    reuse, for "seeded" it is a near-duplicate to use as the incremental
+    baseline.
+    """
+    if not handover_cache.enabled:
+        return "misses", None, None
+
+    cached = await find_session_by_request_hash(db, fingerprint, handover_cache.oldest_usable())
+    if cached:
+        return "exact_hits", cached, None
+
+    # Near-duplicates only make sense for full generations
+    if request.previousSessionId:
+        return "misses", None, None
+
+    match = handover_cache.find_similar(signature)
+    if match:
+        similar = await get_handover_session(db, match.session_id)
+        if similar:
+            if match.similarity >= handover_cache.serve_threshold:
+                return "similar_hits", similar, match.session_id
+            return "seeded", similar, match.session_id
+
+    return "misses", None, None
+
+
+async def generate_and_save(
+    request: HandoverRequest,
+    client: GeminiClient,
+    fingerprint: str,
+    trend_summary: Optional[str] = None
+) -> GenerationResult:
+    """
+    Produce a handover for the request and persist it as a new session.
+    trend_summary, when given, replaces the summary parsed from trendsCsv.
+    """
+
+    async with async_session_maker() as db:
+        previous_session = None
+        if request.previousSessionId:
+            previous_session = await get_handover_session(db, request.previousSessionId)
+            if not previous_session:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Previous handover session {request.previousSessionId} not found"
+                )
+
+        signature = HandoverSignature.from_request(request.shiftNotes, request.alarmsJson)
+        cache_outcome, cached_session, similar_session_id = await _resolve_cache(
+            db, request, fingerprint, signature
+        )
+        handover_cache.record(cache_outcome)
+
+        if cache_outcome == "seeded":
+            previous_session = cached_session
+            cached_session = None
+
+        try:
+            shift_notes = request.shiftNotes
+            if cached_session is None and needs_map_reduce(shift_notes):
+                # Long logs are condensed chunk by chunk; generation below is the reduce step
+                shift_notes = await condense_notes(db, client, shift_notes)
+
+            if cached_session is not None:
+                # Reuse a stored result for an identical or near-identical request
+                markdown = cached_session.markdown_output
+                json_data = fast_json.loads(cached_session.json_output)
+                previous_json = None
+            elif previous_session is not None:
+                # Incremental mode: send only what changed since the previous shift
+                previous_json = assign_issue_ids(
+                    fast_json.loads(previous_session.json_output), keep_existing=True
+                )
+                alarms_delta, trends_delta = build_incremental_inputs(
+                    previous_session.alarms_json,
+                    previous_session.trends_csv,
+                    request.alarmsJson,
+                    request.trendsCsv
+                )
+                markdown, json_data = await asyncio.to_thread(
+                    client.generate_incremental_handover,
+                    previous_handover=previous_json,
+                    shift_notes=shift_notes,
+                    alarms_delta=alarms_delta,
+                    trends_delta_csv=trends_delta,
+                    trend_summary=trend_summary
+                )
+            else:
+                previous_json = None
+                # Generate handover using Gemini
+                markdown, json_data = await asyncio.to_thread(
+                    client.generate_handover,
+                    shift_notes=shift_notes,
+                    alarms_json=request.alarmsJson,
+                    trends_csv=request.trendsCsv,
+                    trend_summary=trend_summary
+                )
+
+            assign_issue_ids(json_data, previous_json)
+
+            # Validate the structured data using Pydantic
+            structured_handover = HandoverStructured(**json_data)
+
+            # Generate unique session ID
+            session_id = str(uuid.uuid4())
+
+            # Failed generations are stored for reference but never served from cache
+            cacheable = not is_fallback_handover(json_data)
+
+            # Save to database
+            row = {
+                "session_id": session_id,
+                "shift_notes": request.shiftNotes,
+                "alarms_json": request.alarmsJson,
+                "trends_csv": request.trendsCsv,
+                "markdown_output": markdown,
+                "json_output": json_data,
+                "previous_session_id": previous_session.session_id if previous_session else None,
+                "request_hash": fingerprint if cacheable else None,
+                "similarity_signature": signature.to_text() if cacheable else None,
+                # An exact repeat of a request was counted when first generated; similar hits
+                # are separate shifts with near-identical input and are counted
+                "record_facts": cache_outcome != "exact_hits",
+            }
+            try:
+                if write_behind.enabled:
+                    # Acknowledged once pending (and journaled); committed by the next batch
+                    await write_behind.submit(row)
+                else:
+                    await save_handover_session(session=db, **row)
+                if cacheable:
+                    handover_cache.add(session_id, signature)
+                logger.info(f"Handover session saved: {session_id}")
+            except Exception as db_error:
+                logger.warning(f"Database save failed (non-critical): {db_error}")
+                # Continue even if DB save fails
+
+            audit = cache_outcome == "similar_hits" and random.random() < handover_cache.audit_rate
+
+            return GenerationResult(
+                response=HandoverResponse(
+                    markdown=markdown,
+                    json=structured_handover,
+                    sessionId=session_id
+                ),
+                cache_outcome=cache_outcome,
+                audit_source_session_id=similar_session_id if audit else None
+            )
+
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to generate handover: {str(e)}"
+            )
+
+
+async def generate_coalesced(
+    request: HandoverRequest,
+    client: GeminiClient,
+    trend_summary: Optional[str] = None,
+    trends_digest: Optional[str] = None
+) -> Tuple[GenerationResult, bool]:
+    """
+    Generate a handover, joining an identical in-flight generation if there is
+    one. Returns (result, coalesced).
+
+    Streamed uploads pass their precomputed trend_summary, and a trends_digest
+    when the raw trends were too large to keep on the request.
+    """
+    fingerprint = request_fingerprint(
+        request.shiftNotes, request.alarmsJson, request.trendsCsv, request.previousSessionId, trends_digest
+    )
+    return await generation_flights.do(
+        fingerprint, lambda: generate_and_save(request, client, fingerprint, trend_summary)
+    )
+
+
+def audit_similar_hit(
+    client: GeminiClient,
+    request: HandoverRequest,
+    result: GenerationResult,
+    trend_summary: Optional[str] = None
+):
+    """Regenerate a similarity-served handover and record how well they agree"""
+    if needs_map_reduce(request.shiftNotes):
+        # Would need the whole map-reduce pipeline; not worth it for a sample
+        return
+    _, fresh = client.generate_handover(
+        shift_notes=request.shiftNotes,
+        alarms_json=request.alarmsJson,
+        trends_csv=request.trendsCsv,
+        trend_summary=trend_summary
+    )
+    served: Dict[str, Any] = result.response.json.model_dump(mode="json")
+    handover_cache.record_audit(
+        handover_agreement(served, fresh), result.response.sessionId, result.audit_source_session_id
+    )
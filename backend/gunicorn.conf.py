@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for production serving.
+
+Runs N uvicorn workers. The app is imported once in the master (preload) so
+workers fork with the Gemini SDK, SQLAlchemy and ReportLab already imported;
+each worker then runs the lifespan warm-up before accepting requests.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+# Gemini calls can take tens of seconds
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+
+def post_fork(server, worker):
+    # Pooled connections opened in the master must not be shared with workers
+    from database import engine
+    engine.sync_engine.dispose(close=False)
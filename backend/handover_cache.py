@@ -0,0 +1,340 @@
+"""
+Result cache for handover generation.
+
+Two tiers sit in front of Gemini:
+
+- Exact: a canonical hash of the request, stored on each session row.
+- Similar: a one-permutation MinHash signature of the normalized shift notes
+  plus the set of active alarm IDs. Signatures live in an in-memory LSH index
+  over recent sessions and are persisted on the session row so the index can
+  be rebuilt on startup.
+
+A near-duplicate above the serve threshold reuses the stored result outright;
+one above the (lower) seed threshold is used as the previous session for
+incremental generation.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import fast_json
+from database import load_similarity_signatures
+from incremental import alarm_key, iter_alarm_records
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_VERSION = 1
+NUM_BINS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_BINS // BANDS
+_MAX_HASH = (1 << 64) - 1
+
+_INACTIVE_STATUSES = {"cleared", "resolved", "inactive", "normal", "rtn"}
+
+# Timestamps, dates and clock times vary from one shift to the next without
+# changing what the notes say, so they are dropped before shingling.
+_TIMESTAMP_PATTERN = re.compile(
+    r'\b\d{4}-\d{2}-\d{2}(?:[t ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?z?)?\b'
+    r'|\b\d{1,2}[/.]\d{1,2}[/.]\d{2,4}\b'
+    r'|\b\d{1,2}:\d{2}(?::\d{2})?\s*(?:am|pm)?\b'
+    r'|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2}(?:st|nd|rd|th)?,? \d{4}\b'
+)
+_NON_WORD_PATTERN = re.compile(r'[^a-z0-9.%]+')
+
+
+def request_fingerprint(
+    shift_notes: str,
+    alarms_json: Optional[Dict[str, Any]],
+    trends_csv: Optional[str],
+    previous_session_id: Optional[str] = None,
+    trends_digest: Optional[str] = None
+) -> str:
+    """
+    Canonical SHA-256 of a generation request, used as the exact-match key.
+    trends_digest stands in for trends too large to keep (streamed uploads).
+    """
+    digest = hashlib.sha256()
+    digest.update(shift_notes.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(fast_json.dumps_canonical(alarms_json))
+    digest.update(b"\x00")
+    if trends_digest is not None:
+        digest.update(b"sha256:" + trends_digest.encode("ascii"))
+    else:
+        digest.update((trends_csv or "").encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update((previous_session_id or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def normalize_notes(shift_notes: str) -> List[str]:
+    """Lowercase, drop timestamps and punctuation, and split into words"""
+    text = _TIMESTAMP_PATTERN.sub(" ", shift_notes.lower())
+    return [word for word in _NON_WORD_PATTERN.split(text) if word]
+
+
+def active_alarm_ids(alarms_json: Optional[Dict[str, Any]]) -> FrozenSet[str]:
+    """IDs of all alarms that are not explicitly cleared"""
+    return frozenset(
+        alarm_key(record) for _, record in iter_alarm_records(alarms_json)
+        if str(record.get("status", "")).lower() not in _INACTIVE_STATUSES
+    )
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash_signature(words: List[str], shingle_size: int = 3) -> Tuple[int, ...]:
+    """
+    One-permutation MinHash over word shingles.
+
+    Each shingle is hashed once; the low bits pick a bin and the remaining bits
+    compete for that bin's minimum. Empty bins borrow from the next non-empty
+    bin so that all signatures are comparable position by position.
+    """
+    if len(words) < shingle_size:
+        shingles = {" ".join(words)} if words else set()
+    else:
+        shingles = {" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+
+    bins = [_MAX_HASH] * NUM_BINS
+    for shingle in shingles:
+        value = _hash64(shingle)
+        index = value % NUM_BINS
+        rank = value // NUM_BINS
+        if rank < bins[index]:
+            bins[index] = rank
+
+    if all(value == _MAX_HASH for value in bins):
+        return tuple(bins)
+
+    # Densify: fill empty bins from the next originally non-empty bin to the right
+    original = list(bins)
+    for index in range(NUM_BINS):
+        if original[index] == _MAX_HASH:
+            offset = 1
+            while original[(index + offset) % NUM_BINS] == _MAX_HASH:
+                offset += 1
+            bins[index] = original[(index + offset) % NUM_BINS] + offset
+    return tuple(bins)
+
+
+def signature_similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_BINS
+
+
+def set_similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Exact Jaccard similarity of two small sets (1.0 when both are empty)"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+@dataclass(frozen=True)
+class HandoverSignature:
+    """Similarity key of a generation request"""
+    notes: Tuple[int, ...]
+    alarms: FrozenSet[str]
+
+    @classmethod
+    def from_request(cls, shift_notes: str, alarms_json: Optional[Dict[str, Any]]) -> "HandoverSignature":
+        return cls(
+            notes=minhash_signature(normalize_notes(shift_notes)),
+            alarms=active_alarm_ids(alarms_json)
+        )
+
+    def similarity(self, other: "HandoverSignature") -> float:
+        """Both the notes and the active alarm set must be similar"""
+        return min(signature_similarity(self.notes, other.notes), set_similarity(self.alarms, other.alarms))
+
+    def band_keys(self) -> List[Tuple[int, Tuple[int, ...]]]:
+        return [
+            (band, self.notes[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])
+            for band in range(BANDS)
+        ]
+
+    def to_text(self) -> str:
+        return fast_json.dumps({
+            "v": SIGNATURE_VERSION,
+            "notes": "".join(f"{value:016x}" for value in self.notes),
+            "alarms": sorted(self.alarms)
+        })
+
+    @classmethod
+    def from_text(cls, text: str) -> Optional["HandoverSignature"]:
+        try:
+            data = fast_json.loads(text)
+            if data.get("v") != SIGNATURE_VERSION:
+                return None
+            hex_notes = data["notes"]
+            notes = tuple(int(hex_notes[i:i + 16], 16) for i in range(0, len(hex_notes), 16))
+            if len(notes) != NUM_BINS:
+                return None
+            return cls(notes=notes, alarms=frozenset(data.get("alarms", [])))
+        except (ValueError, KeyError, TypeError):
+            return None
+
+
+@dataclass(frozen=True)
+class SimilarMatch:
+    session_id: str
+    similarity: float
+
+
+class HandoverCache:
+    """In-memory LSH index over recent sessions plus hit/miss metrics"""
+
+    def __init__(
+        self,
+        serve_threshold: float = 0.95,
+        seed_threshold: float = 0.8,
+        max_entries: int = 5000,
+        max_age: timedelta = timedelta(hours=24),
+        audit_rate: float = 0.0,
+        audit_min_agreement: float = 0.5
+    ):
+        self.serve_threshold = serve_threshold
+        self.seed_threshold = seed_threshold
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.audit_rate = audit_rate
+        self.audit_min_agreement = audit_min_agreement
+
+        self._entries: "OrderedDict[str, Tuple[HandoverSignature, datetime]]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], set] = {}
+        self._lock = threading.Lock()
+        self._metrics = {
+            "lookups": 0,
+            "exact_hits": 0,
+            "similar_hits": 0,
+            "seeded": 0,
+            "misses": 0,
+            "audits": 0,
+            "false_hits": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "HandoverCache":
+        return cls(
+            serve_threshold=float(os.getenv("SIMILARITY_SERVE_THRESHOLD", "0.95")),
+            seed_threshold=float(os.getenv("SIMILARITY_SEED_THRESHOLD", "0.8")),
+            max_entries=int(os.getenv("SIMILARITY_CACHE_MAX_ENTRIES", "5000")),
+            max_age=timedelta(hours=float(os.getenv("SIMILARITY_CACHE_MAX_AGE_HOURS", "24"))),
+            audit_rate=float(os.getenv("SIMILARITY_AUDIT_RATE", "0")),
+            audit_min_agreement=float(os.getenv("SIMILARITY_AUDIT_MIN_AGREEMENT", "0.5"))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def oldest_usable(self) -> datetime:
+        """Sessions created before this are too old to serve from cache"""
+        return datetime.utcnow() - self.max_age
+
+    def add(self, session_id: str, signature: HandoverSignature, created_at: Optional[datetime] = None):
+        """Index a session; evicts the oldest entry when full"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if session_id in self._entries:
+                self._remove(session_id)
+            self._entries[session_id] = (signature, created_at or datetime.utcnow())
+            for key in signature.band_keys():
+                self._buckets.setdefault(key, set()).add(session_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, session_id: str):
+        signature, _ = self._entries.pop(session_id)
+        for key in signature.band_keys():
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(session_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def find_similar(self, signature: HandoverSignature) -> Optional[SimilarMatch]:
+        """Best indexed session at or above the seed threshold, if any"""
+        if not self.enabled:
+            return None
+
+        oldest = self.oldest_usable()
+        best: Optional[SimilarMatch] = None
+        with self._lock:
+            candidates = set()
+            for key in signature.band_keys():
+                candidates.update(self._buckets.get(key, ()))
+            for session_id in candidates:
+                other, created_at = self._entries[session_id]
+                if created_at < oldest:
+                    continue
+                similarity = signature.similarity(other)
+                if similarity >= self.seed_threshold and (best is None or similarity > best.similarity):
+                    best = SimilarMatch(session_id, similarity)
+        return best
+
+    def record(self, outcome: str):
+        """Count a lookup outcome: exact_hits, similar_hits, seeded or misses"""
+        with self._lock:
+            self._metrics["lookups"] += 1
+            self._metrics[outcome] += 1
+
+    def record_audit(self, agreement: float, session_id: str, source_session_id: str):
+        with self._lock:
+            self._metrics["audits"] += 1
+            if agreement < self.audit_min_agreement:
+                self._metrics["false_hits"] += 1
+                logger.warning(
+                    f"Similarity cache false hit: session {session_id} served from "
+                    f"{source_session_id} (agreement {agreement:.2f})"
+                )
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["indexed_sessions"] = len(self._entries)
+        lookups = metrics["lookups"]
+        hits = metrics["exact_hits"] + metrics["similar_hits"]
+        metrics["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        metrics["false_hit_rate"] = round(metrics["false_hits"] / metrics["audits"], 4) if metrics["audits"] else 0.0
+        return metrics
+
+
+def handover_agreement(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+    """
+    Rough agreement between two structured handovers: Jaccard similarity of
+    their normalized open issue and critical alarm texts.
+    """
+    def keys(data: Dict[str, Any]) -> FrozenSet[str]:
+        items = [issue.get("issue", "") for issue in data.get("openIssues", [])]
+        items += [alarm.get("alarm", "") for alarm in data.get("criticalAlarms", [])]
+        return frozenset(" ".join(normalize_notes(item)) for item in items)
+
+    return set_similarity(keys(a), keys(b))
+
+
+handover_cache = HandoverCache.from_env()
+
+
+async def rebuild_index(cache: HandoverCache = handover_cache) -> int:
+    """Load persisted signatures of recent sessions into the index"""
+    if not cache.enabled:
+        return 0
+
+    loaded = 0
+    for session_id, created_at, text in await load_similarity_signatures(cache.oldest_usable(), cache.max_entries):
+        signature = HandoverSignature.from_text(text)
+        if signature is not None:
+            cache.add(session_id, signature, created_at)
+            loaded += 1
+    return loaded
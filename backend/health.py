@@ -0,0 +1,193 @@
+"""
+Health snapshot for the probe endpoints.
+
+A background task refreshes the dependency checks every
+HEALTH_CHECK_INTERVAL_SECONDS: a database ping, a timed request to the Gemini
+endpoint, the outcome of recent Gemini calls and event-loop lag. /livez,
+/readyz and /health only read the latest snapshot, so a probe costs a
+dictionary copy and never waits for a database connection that real traffic
+needs.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from database import ping_database
+from warmup import startup_state
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv("HEALTH_CHECK_INTERVAL_SECONDS", "10"))
+HEALTH_DB_TIMEOUT_SECONDS = float(os.getenv("HEALTH_DB_TIMEOUT_SECONDS", "2"))
+# Any HTTP response counts as reachable; empty disables the check
+HEALTH_GEMINI_URL = os.getenv("HEALTH_GEMINI_URL", "https://generativelanguage.googleapis.com/")
+HEALTH_GEMINI_TIMEOUT_SECONDS = float(os.getenv("HEALTH_GEMINI_TIMEOUT_SECONDS", "3"))
+# Consecutive failed Gemini calls before generation is reported as failing
+HEALTH_GEMINI_FAILURE_THRESHOLD = int(os.getenv("HEALTH_GEMINI_FAILURE_THRESHOLD", "3"))
+HEALTH_LOOP_LAG_SAMPLE_SECONDS = float(os.getenv("HEALTH_LOOP_LAG_SAMPLE_SECONDS", "0.5"))
+HEALTH_LOOP_LAG_DEGRADED_MS = float(os.getenv("HEALTH_LOOP_LAG_DEGRADED_MS", "250"))
+
+
+class GeminiCallState:
+    """Outcome of recent Gemini calls, recorded by GeminiClient from worker threads"""
+
+    def __init__(self):
+        self.consecutive_failures = 0
+        self.last_success_at: Optional[datetime] = None
+        self.last_failure_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.last_success_at = datetime.utcnow()
+
+    def record_failure(self, error: Exception):
+        self.consecutive_failures += 1
+        self.last_failure_at = datetime.utcnow()
+        self.last_error = f"{type(error).__name__}: {error}"[:300]
+
+    def to_dict(self) -> Dict[str, Any]:
+        failing = self.consecutive_failures >= HEALTH_GEMINI_FAILURE_THRESHOLD
+        return {
+            "state": "failing" if failing else "ok",
+            "consecutiveFailures": self.consecutive_failures,
+            "lastSuccessAt": self.last_success_at.isoformat() if self.last_success_at else None,
+            "lastFailureAt": self.last_failure_at.isoformat() if self.last_failure_at else None,
+            "lastError": self.last_error,
+        }
+
+
+gemini_calls = GeminiCallState()
+
+
+def _probe_url(url: str, timeout: float) -> Dict[str, Any]:
+    started = time.perf_counter()
+    request = urllib.request.Request(url, method="GET", headers={"User-Agent": "shift-handover-health"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        # An error status still proves the endpoint is reachable
+        status = e.code
+    except Exception as e:
+        return {
+            "status": "unreachable",
+            "latencyMs": round((time.perf_counter() - started) * 1000, 1),
+            "detail": str(getattr(e, "reason", e))[:200],
+        }
+    return {"status": "reachable", "latencyMs": round((time.perf_counter() - started) * 1000, 1), "httpStatus": status}
+
+
+class HealthMonitor:
+    """Background dependency checks and the snapshot the probes serve"""
+
+    def __init__(self):
+        self.snapshot: Dict[str, Any] = {}
+        self.refreshed_at = 0.0
+        self.loop_lag_ms = 0.0
+        self.max_loop_lag_ms = 0.0
+        self._tasks = []
+
+    def start(self, gemini_initialized: Callable[[], bool]):
+        """Start refreshing the snapshot (the first one right away) and sampling loop lag"""
+        self._tasks = [
+            asyncio.create_task(self._refresh_loop(gemini_initialized)),
+            asyncio.create_task(self._lag_loop()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _lag_loop(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(HEALTH_LOOP_LAG_SAMPLE_SECONDS)
+            self.loop_lag_ms = max(0.0, (time.perf_counter() - started - HEALTH_LOOP_LAG_SAMPLE_SECONDS) * 1000)
+            self.max_loop_lag_ms = max(self.max_loop_lag_ms, self.loop_lag_ms)
+
+    async def _refresh_loop(self, gemini_initialized: Callable[[], bool]):
+        while True:
+            try:
+                await self.refresh(gemini_initialized)
+            except Exception as e:
+                logger.error(f"Health snapshot refresh failed: {e}", exc_info=True)
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL_SECONDS)
+
+    async def _check_database(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(ping_database(), HEALTH_DB_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            status, detail = "timeout", f"no response within {HEALTH_DB_TIMEOUT_SECONDS:g}s"
+        except Exception as e:
+            logger.error(f"Database health check failed: {e}")
+            status, detail = "error", str(e)[:200]
+        else:
+            status, detail = "ok", None
+        result = {"status": status, "latencyMs": round((time.perf_counter() - started) * 1000, 1)}
+        if detail:
+            result["detail"] = detail
+        return result
+
+    async def _check_gemini(self, gemini_initialized: Callable[[], bool]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"client": "initialized" if gemini_initialized() else "not_initialized"}
+        if HEALTH_GEMINI_URL:
+            result["endpoint"] = await asyncio.to_thread(_probe_url, HEALTH_GEMINI_URL, HEALTH_GEMINI_TIMEOUT_SECONDS)
+        result["calls"] = gemini_calls.to_dict()
+        return result
+
+    async def refresh(self, gemini_initialized: Callable[[], bool]):
+        database, gemini = await asyncio.gather(self._check_database(), self._check_gemini(gemini_initialized))
+        loop = {
+            "lagMs": round(self.loop_lag_ms, 1),
+            "maxLagMs": round(self.max_loop_lag_ms, 1),
+            "sampleSeconds": HEALTH_LOOP_LAG_SAMPLE_SECONDS,
+        }
+        self.max_loop_lag_ms = self.loop_lag_ms
+
+        if database["status"] != "ok":
+            status = "unhealthy"
+        elif (
+            gemini["client"] != "initialized"
+            or gemini.get("endpoint", {}).get("status") == "unreachable"
+            or gemini["calls"]["state"] != "ok"
+            or loop["maxLagMs"] > HEALTH_LOOP_LAG_DEGRADED_MS
+        ):
+            status = "degraded"
+        else:
+            status = "healthy"
+
+        self.snapshot = {
+            "status": status,
+            "checkedAt": datetime.utcnow().isoformat(),
+            "checks": {"database": database, "gemini": gemini, "eventLoop": loop},
+        }
+        self.refreshed_at = time.monotonic()
+
+    def snapshot_age(self) -> Optional[float]:
+        """Seconds since the last refresh (None before the first)"""
+        return time.monotonic() - self.refreshed_at if self.snapshot else None
+
+    def ready(self) -> bool:
+        """Warm-up finished, the database answered and the snapshot is current"""
+        return (
+            startup_state.ready
+            and self.snapshot.get("checks", {}).get("database", {}).get("status") == "ok"
+            and self.snapshot_age() < HEALTH_CHECK_INTERVAL_SECONDS * 3
+        )
+
+
+health_monitor = HealthMonitor()
@@ -0,0 +1,161 @@
+"""
+Incremental handover generation support.
+
+Diffs the current shift's alarms and trends against the inputs stored for the
+previous session, so that only the delta (plus the previous structured
+handover) needs to be sent to the model, and keeps open issue IDs stable
+across shifts.
+"""
+
+import hashlib
+import re
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import fast_json
+
+
+def iter_alarm_records(alarms_json: Optional[Dict[str, Any]]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (section, alarm) for every alarm object in any top-level list"""
+    if not alarms_json:
+        return
+    for section, value in alarms_json.items():
+        if isinstance(value, list):
+            for record in value:
+                if isinstance(record, dict):
+                    yield section, record
+
+
+def alarm_key(record: Dict[str, Any]) -> str:
+    if record.get('id'):
+        return str(record['id'])
+    return f"{record.get('tag', '')}|{record.get('description', '')}"
+
+
+def diff_alarms(
+    previous: Optional[Dict[str, Any]],
+    current: Optional[Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """
+    Compare alarm payloads by alarm ID.
+
+    Returns None when nothing changed, otherwise a compact dict listing new,
+    changed and cleared alarms plus any changed non-list metadata.
+    """
+    previous_alarms = {alarm_key(r): (section, r) for section, r in iter_alarm_records(previous)}
+    current_alarms = {alarm_key(r): (section, r) for section, r in iter_alarm_records(current)}
+
+    new, changed = [], []
+    for key, (section, record) in current_alarms.items():
+        before = previous_alarms.get(key)
+        if before is None:
+            new.append({'section': section, **record})
+        elif before != (section, record):
+            changed.append({'section': section, 'previousSection': before[0], **record})
+
+    cleared = [key for key in previous_alarms if key not in current_alarms]
+
+    metadata = {
+        key: value for key, value in (current or {}).items()
+        if not isinstance(value, list) and (previous or {}).get(key) != value
+    }
+
+    if not (new or changed or cleared or metadata):
+        return None
+
+    delta: Dict[str, Any] = {}
+    if metadata:
+        delta['metadata'] = metadata
+    if new:
+        delta['newAlarms'] = new
+    if changed:
+        delta['changedAlarms'] = changed
+    if cleared:
+        delta['clearedAlarmIds'] = cleared
+    delta['unchangedAlarmCount'] = len(current_alarms) - len(new) - len(changed)
+    return delta
+
+
+def diff_trends(previous_csv: Optional[str], current_csv: Optional[str]) -> Optional[str]:
+    """
+    Return a CSV containing only the trend rows not present in the previous
+    shift's data (header included), or None when there are no new rows.
+    """
+    if not current_csv or not current_csv.strip():
+        return None
+
+    lines = current_csv.strip().splitlines()
+    header, rows = lines[0], lines[1:]
+
+    previous_lines = previous_csv.strip().splitlines() if previous_csv else []
+    if not previous_lines or previous_lines[0].strip() != header.strip():
+        # Different layout, nothing to diff against
+        return current_csv
+
+    seen = set(line.strip() for line in previous_lines[1:])
+    new_rows = [row for row in rows if row.strip() and row.strip() not in seen]
+    if not new_rows:
+        return None
+
+    return "\n".join([header] + new_rows)
+
+
+def _normalize_issue(text: str) -> str:
+    return re.sub(r'[^a-z0-9]+', ' ', text.lower()).strip()
+
+
+def make_issue_id(text: str) -> str:
+    """Deterministic ID for an issue that has no previous identity"""
+    digest = hashlib.sha1(_normalize_issue(text).encode('utf-8')).hexdigest()
+    return f"ISS-{digest[:8].upper()}"
+
+
+def assign_issue_ids(
+    json_data: Dict[str, Any],
+    previous_json: Optional[Dict[str, Any]] = None,
+    keep_existing: bool = False
+) -> Dict[str, Any]:
+    """
+    Give every open issue a stable ID, in place.
+
+    IDs returned by the model are kept when they refer to a previous issue;
+    otherwise issues are matched to the previous shift by normalized text, and
+    anything left gets a new deterministic ID. keep_existing keeps every ID
+    already present (for stored handovers, whose IDs are already assigned) and
+    only fills in missing ones.
+    """
+    previous_issues = (previous_json or {}).get('openIssues', [])
+    previous_ids = {issue['id'] for issue in previous_issues if issue.get('id')}
+    if keep_existing:
+        previous_ids.update(issue['id'] for issue in json_data.get('openIssues', []) if issue.get('id'))
+    previous_by_text = {
+        _normalize_issue(issue.get('issue', '')): issue['id']
+        for issue in previous_issues if issue.get('id')
+    }
+
+    used = set()
+    for issue in json_data.get('openIssues', []):
+        issue_id = issue.get('id')
+        if issue_id not in previous_ids or issue_id in used:
+            issue_id = previous_by_text.get(_normalize_issue(issue.get('issue', '')))
+        if not issue_id or issue_id in used:
+            base_id = issue_id = make_issue_id(issue.get('issue', ''))
+            suffix = 2
+            while issue_id in used:
+                issue_id = f"{base_id}-{suffix}"
+                suffix += 1
+        issue['id'] = issue_id
+        used.add(issue_id)
+
+    return json_data
+
+
+def build_incremental_inputs(
+    previous_alarms_text: Optional[str],
+    previous_trends_csv: Optional[str],
+    alarms_json: Optional[Dict[str, Any]],
+    trends_csv: Optional[str]
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Return (alarms_delta, trends_delta_csv) against the stored previous inputs"""
+    previous_alarms = fast_json.loads(previous_alarms_text) if previous_alarms_text else None
+    return diff_alarms(previous_alarms, alarms_json), diff_trends(previous_trends_csv, trends_csv)
+
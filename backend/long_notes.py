@@ -0,0 +1,195 @@
+"""
+Hierarchical (map-reduce) summarization for shift logs too long for one prompt.
+
+The log is split into entries at timestamps (or blank lines), and entries are
+packed into chunks using content-defined boundaries, so editing or appending
+an entry only changes the chunk that contains it. Each chunk is condensed by
+Gemini in parallel (map), with summaries cached by chunk hash in the database;
+the ordered summaries then replace the raw notes in the normal full or
+incremental generation, which acts as the reduce step.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from typing import Dict, List
+
+from admission import admission_controller
+from database import get_note_chunk_summaries, save_note_chunk_summaries
+from gemini_client import GeminiClient
+
+logger = logging.getLogger(__name__)
+
+MAP_REDUCE_THRESHOLD_CHARS = int(os.getenv("MAP_REDUCE_THRESHOLD_CHARS", "40000"))
+MAP_REDUCE_CHUNK_CHARS = int(os.getenv("MAP_REDUCE_CHUNK_CHARS", "12000"))
+MAP_REDUCE_CONCURRENCY = int(os.getenv("MAP_REDUCE_CONCURRENCY", "4"))
+
+# Bump when CHUNK_SUMMARY_PROMPT changes so stale summaries are not reused
+CHUNK_SUMMARY_VERSION = "2"
+
+# A log entry starts on a line beginning with a date-time or clock time,
+# e.g. "2026-01-07 18:20", "[06:15]", "6:15 AM", "14:30:05 -"
+_ENTRY_START = re.compile(
+    r'^[ \t]*\[?(?:\d{4}-\d{2}-\d{2}[ T]\d{1,2}:\d{2}|\d{1,2}:\d{2}(?::\d{2})?(?:[ \t]*[AaPp][Mm])?)\b',
+    re.MULTILINE
+)
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n')
+
+# On average one entry in 4 is allowed to end a chunk once it reaches the minimum size
+_BOUNDARY_MODULUS = 4
+
+map_reduce_metrics: Dict[str, int] = {
+    "long_requests": 0,
+    "chunks": 0,
+    "chunks_cached": 0,
+}
+
+
+def needs_map_reduce(shift_notes: str) -> bool:
+    return len(shift_notes) > MAP_REDUCE_THRESHOLD_CHARS
+
+
+def _split_at(text: str, starts: List[int]) -> List[str]:
+    bounds = [0] + [s for s in starts if s > 0] + [len(text)]
+    return [text[a:b] for a, b in zip(bounds, bounds[1:]) if text[a:b].strip()]
+
+
+def split_entries(shift_notes: str, max_entry_chars: int = MAP_REDUCE_CHUNK_CHARS) -> List[str]:
+    """Split notes into log entries, falling back to paragraphs, lines and fixed slices"""
+    starts = [m.start() for m in _ENTRY_START.finditer(shift_notes)]
+    if len(starts) > 1:
+        entries = _split_at(shift_notes, starts)
+    else:
+        entries = _split_at(shift_notes, [m.end() for m in _PARAGRAPH_BREAK.finditer(shift_notes)])
+
+    result: List[str] = []
+    for entry in entries:
+        if len(entry) <= max_entry_chars:
+            result.append(entry)
+            continue
+        for line in entry.splitlines(keepends=True):
+            for i in range(0, len(line), max_entry_chars):
+                result.append(line[i:i + max_entry_chars])
+    return result
+
+
+def _is_boundary(entry: str) -> bool:
+    digest = hashlib.sha1(entry.strip().encode("utf-8")).digest()
+    return digest[0] % _BOUNDARY_MODULUS == 0
+
+
+def chunk_entries(entries: List[str], target_chars: int = MAP_REDUCE_CHUNK_CHARS) -> List[str]:
+    """
+    Pack entries into chunks of roughly target_chars.
+
+    A chunk may only end after an entry whose own hash marks it as a
+    boundary (or when it would exceed twice the target), so boundaries depend
+    on local content rather than on everything before them.
+    """
+    min_chars, max_chars = target_chars // 2, target_chars * 2
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+
+    for entry in entries:
+        if current and size + len(entry) > max_chars:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(entry)
+        size += len(entry)
+        if size >= min_chars and _is_boundary(entry):
+            chunks.append("".join(current))
+            current, size = [], 0
+
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def chunk_key(chunk: str, model_name: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(f"{CHUNK_SUMMARY_VERSION}\x00{model_name}\x00".encode("utf-8"))
+    digest.update(chunk.strip().encode("utf-8"))
+    return digest.hexdigest()
+
+
+async def _summarize_chunks(client: GeminiClient, chunks: List[str]) -> List[object]:
+    """
+    Summarize chunks (a result or the exception per chunk). The caller's own
+    admission slot covers one Gemini call at a time; up to
+    MAP_REDUCE_CONCURRENCY - 1 more run in parallel only on slots borrowed
+    from the admission controller, so chunk calls count against
+    MAX_INFLIGHT_GENERATIONS like any other generation.
+    """
+    results: List[object] = [None] * len(chunks)
+    remaining = list(range(len(chunks)))
+
+    async def worker():
+        while remaining:
+            index = remaining.pop(0)
+            try:
+                results[index] = await asyncio.to_thread(client.summarize_notes_chunk, chunks[index])
+            except Exception as e:
+                results[index] = e
+
+    concurrency = admission_controller.concurrency
+    borrowed = 0
+    while borrowed < min(MAP_REDUCE_CONCURRENCY, len(chunks)) - 1 and await concurrency.try_borrow():
+        borrowed += 1
+    admission_controller.counters["borrowed_slots"] += borrowed
+    try:
+        await asyncio.gather(*(worker() for _ in range(borrowed + 1)))
+    finally:
+        for _ in range(borrowed):
+            concurrency.return_borrowed()
+    return results
+
+
+async def condense_notes(db, client: GeminiClient, shift_notes: str) -> str:
+    """
+    Map step: summarize every chunk of the notes (reusing cached summaries)
+    and return the ordered summaries as a condensed log for the reduce step.
+    """
+    chunks = chunk_entries(split_entries(shift_notes))
+    keys = [chunk_key(chunk, client.model_name) for chunk in chunks]
+
+    summaries = await get_note_chunk_summaries(db, list(set(keys)))
+    missing = {key: chunk for key, chunk in zip(keys, chunks) if key not in summaries}
+
+    results = await _summarize_chunks(client, list(missing.values()))
+    fresh = {
+        key: result for key, result in zip(missing, results)
+        if not isinstance(result, BaseException)
+    }
+
+    # Keep what succeeded so a retry only redoes the failed chunks
+    if fresh:
+        try:
+            await save_note_chunk_summaries(db, fresh)
+        except Exception as db_error:
+            await db.rollback()
+            logger.warning(f"Saving chunk summaries failed (non-critical): {db_error}")
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    summaries.update(fresh)
+    cached = len(chunks) - sum(1 for key in keys if key in fresh)
+    map_reduce_metrics["long_requests"] += 1
+    map_reduce_metrics["chunks"] += len(chunks)
+    map_reduce_metrics["chunks_cached"] += cached
+    logger.info(
+        f"Condensed {len(shift_notes)} characters of notes into {len(chunks)} chunks "
+        f"({cached} from cache)"
+    )
+
+    parts = [
+        f"[The shift log ({len(shift_notes)} characters) was too long to include verbatim. "
+        f"Below are chronological summaries of its {len(chunks)} segments.]"
+    ]
+    for index, key in enumerate(keys, start=1):
+        parts.append(f"\n\n--- Segment {index} of {len(chunks)} ---\n{summaries[key]}")
+    return "".join(parts)
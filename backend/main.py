@@ -1,17 +1,50 @@
-from fastapi import FastAPI, HTTPException, Depends
+import time
+
+# Measure how long the application's import graph takes (Gemini SDK, SQLAlchemy,
+# ReportLab...). With gunicorn --preload this is paid once in the master.
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Depends, Query, BackgroundTasks, File, Form, Request, UploadFile
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from contextlib import asynccontextmanager
-from typing import Optional
-import uuid
-from datetime import datetime
+from pydantic import ValidationError
+from contextlib import asynccontextmanager, suppress
+from typing import List, Optional
+import asyncio
+from datetime import date, datetime, timedelta, timezone
 import logging
 import os
 
-from schemas import HandoverRequest, HandoverResponse, ErrorResponse, HandoverStructured
+from schemas import HandoverRequest, HandoverResponse, ErrorResponse, encode_handover_response
 from gemini_client import GeminiClient
-from database import init_db, get_session, save_handover_session
+from database import (
+    init_db, get_session, get_handover_session, get_cached_pdf, save_cached_pdf, session_has_trends,
+    alarm_frequency_by_tag, top_recurring_issues
+)
+from handover_cache import handover_cache
+from generation import audit_similar_hit, generate_coalesced, generation_flights
+from long_notes import map_reduce_metrics
+from maintenance import maintenance_loop, maintenance_state
+from rollups import ANALYTICS_DEFAULT_DAYS
+import fast_json
+from health import health_monitor
+from export import EXPORT_FORMATS, EXPORT_WRITERS, parquet_available
+from request_limits import RequestSizeLimitMiddleware
+import compression
+from compression import CompressionMiddleware
+from admission import AdmissionControlMiddleware, admission_controller
+from profiling import ProfilingMiddleware, allocation_tracker, profile_store, require_profiling_token
+from uploads import MAX_UPLOAD_BYTES, UploadError, aggregate_alarms_upload, summarize_trends_upload
+from pdf_generator import generate_pdf_from_markdown
+from trend_series import (
+    CHART_ENCODINGS, TREND_CHART_DEFAULT_POINTS, TREND_CHART_MAX_POINTS, render_chart_payload, trend_chart_cache
+)
+from warmup import startup_state, warm_up
+from write_behind import WRITE_BEHIND_ENABLED, write_behind
+
+startup_state.import_seconds = time.perf_counter() - _IMPORT_STARTED
 
 # Configure logging
 logging.basicConfig(
@@ -28,16 +61,31 @@ async def lifespan(app: FastAPI):
     print("Initializing database...")
     await init_db()
     print("Database initialized successfully")
+    if WRITE_BEHIND_ENABLED:
+        # Replays sessions a previous run acknowledged but never committed
+        await write_behind.start()
+    logger.info(f"Application imports took {startup_state.import_seconds:.3f}s")
+    ready = await warm_up(get_gemini_client)
+    logger.info(f"Warm-up finished (ready={ready}): {startup_state.steps}")
+    maintenance_task = asyncio.create_task(maintenance_loop())
+    health_monitor.start(lambda: gemini_client is not None)
     yield
     # Shutdown
     print("Shutting down...")
+    await health_monitor.stop()
+    maintenance_task.cancel()
+    # Let an in-flight maintenance pass unwind its database work before the loop closes
+    with suppress(asyncio.CancelledError):
+        await maintenance_task
+    await write_behind.stop()
 
 
 app = FastAPI(
     title="Shift Handover Intelligence API",
     description="AI-powered shift handover generation using Gemini",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if fast_json.orjson_available() else JSONResponse
 )
 
 # CORS configuration - allow GitHub Pages and local development
@@ -57,6 +105,25 @@ if allowed_origins_env.strip():
         if origin and origin not in allowed_origins:
             allowed_origins.append(origin)
 
+# Opt-in request profiling (PROFILING_ENABLED + PROFILING_TOKEN); innermost so it times the app
+app.add_middleware(ProfilingMiddleware)
+
+# Negotiated gzip/br/zstd compression of responses above COMPRESSION_MIN_BYTES
+app.add_middleware(CompressionMiddleware)
+
+# Rate-limit and load-shed the LLM-backed endpoints; reads and probes are exempt
+app.add_middleware(
+    AdmissionControlMiddleware,
+    limited_paths=["/api/handover/generate", "/api/handover/generate-upload", "/api/handover/download-pdf"]
+)
+
+# Refuse oversized bodies before FastAPI buffers and parses them.
+# Added before CORS so that rejections still carry CORS headers.
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    path_limits={"/api/handover/generate-upload": MAX_UPLOAD_BYTES}
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -106,115 +173,307 @@ async def root():
         "status": "running",
         "endpoints": {
             "health": "/health",
+            "liveness": "/livez",
+            "readiness": "/readyz",
             "generate_handover": "/api/handover/generate",
+            "generate_handover_upload": "/api/handover/generate-upload",
             "get_handover": "/api/handover/{session_id}",
+            "handover_trends": "/api/handover/{session_id}/trends",
             "download_pdf": "/api/handover/download-pdf",
-            "download_pdf_by_session": "/api/handover/{session_id}/download-pdf"
+            "download_pdf_by_session": "/api/handover/{session_id}/download-pdf",
+            "export_handovers": "/api/handovers/export",
+            "recurring_issues": "/api/analytics/recurring-issues",
+            "alarm_frequency": "/api/analytics/alarm-frequency",
+            "metrics": "/api/metrics"
         },
         "docs": "/docs",
         "redoc": "/redoc"
     }
 
 
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: the process is up and the event loop is responsive"""
+    return {"status": "alive", "loopLagMs": round(health_monitor.loop_lag_ms, 1)}
+
+
+@app.get("/readyz")
+async def readiness():
+    """
+    Readiness probe: warm-up has finished and the latest background check
+    reached the database. Served from the health snapshot, so it does no I/O.
+    """
+    ready = health_monitor.ready()
+    body = {
+        "status": "ready" if ready else ("starting" if not startup_state.ready else "unavailable"),
+        **startup_state.to_dict(),
+        "health": health_monitor.snapshot,
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+
 @app.get("/health")
-async def health_check(db: AsyncSession = Depends(get_session)):
-    """Health check endpoint with dependency checks"""
-    health_status = {
-        "status": "healthy",
+async def health_check():
+    """Health check endpoint with dependency checks (refreshed in the background)"""
+    age = health_monitor.snapshot_age()
+    return {
+        "status": health_monitor.snapshot.get("status", "starting"),
         "timestamp": datetime.utcnow().isoformat(),
         "service": "shift-handover-intelligence",
-        "checks": {}
+        "snapshotAgeSeconds": round(age, 2) if age is not None else None,
+        **{key: value for key, value in health_monitor.snapshot.items() if key != "status"},
     }
 
-    # Check database connectivity
-    try:
-        await db.execute("SELECT 1")
-        health_status["checks"]["database"] = "ok"
-    except Exception as e:
-        logger.error(f"Database health check failed: {e}")
-        health_status["checks"]["database"] = "error"
-        health_status["status"] = "unhealthy"
-
-    # Check Gemini client initialization
-    try:
-        if gemini_client is not None:
-            health_status["checks"]["gemini_api"] = "initialized"
-        else:
-            health_status["checks"]["gemini_api"] = "not_initialized"
-    except Exception as e:
-        logger.error(f"Gemini API health check failed: {e}")
-        health_status["checks"]["gemini_api"] = "error"
-        health_status["status"] = "degraded"
-
-    return health_status
-
 
 @app.post("/api/handover/generate", response_model=HandoverResponse)
 async def generate_handover(
     request: HandoverRequest,
-    db: AsyncSession = Depends(get_session),
+    response: Response,
+    background_tasks: BackgroundTasks,
     client: GeminiClient = Depends(get_gemini_client)
 ):
     """
     Generate a structured shift handover summary using Gemini AI.
 
     Takes shift notes, optional alarms JSON, and optional trends CSV.
-    Returns both markdown and structured JSON output.
+    Returns both markdown and structured JSON output. Identical requests that
+    arrive while one is being generated share its result and session.
+    """
+
+    result, coalesced = await generate_coalesced(request, client)
+
+    response.headers["X-Handover-Cache"] = result.cache_outcome
+    if coalesced:
+        response.headers["X-Handover-Coalesced"] = "true"
+    elif result.audit_source_session_id:
+        background_tasks.add_task(audit_similar_hit, client, request, result)
+
+    return result.response
+
+
+@app.post("/api/handover/generate-upload", response_model=HandoverResponse)
+async def generate_handover_upload(
+    response: Response,
+    background_tasks: BackgroundTasks,
+    shiftNotes: str = Form(...),
+    alarmsFile: Optional[UploadFile] = File(None),
+    trendsFile: Optional[UploadFile] = File(None),
+    previousSessionId: Optional[str] = Form(None),
+    client: GeminiClient = Depends(get_gemini_client)
+):
+    """
+    Generate a handover from uploaded alarm and trend files (multipart).
+
+    Files may be gzip-compressed. They are streamed chunk by chunk into the
+    trend summarizer and alarm aggregator, so full-shift historian exports far
+    beyond the JSON endpoint's limits can be used.
     """
 
     try:
-        # Generate handover using Gemini
-        markdown, json_data = client.generate_handover(
-            shift_notes=request.shiftNotes,
-            alarms_json=request.alarmsJson,
-            trends_csv=request.trendsCsv
+        alarms_json = None
+        if alarmsFile is not None:
+            alarms_json = await asyncio.to_thread(aggregate_alarms_upload, alarmsFile.file)
+        trends = None
+        if trendsFile is not None:
+            trends = await asyncio.to_thread(summarize_trends_upload, trendsFile.file)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        request = HandoverRequest(
+            shiftNotes=shiftNotes,
+            alarmsJson=alarms_json,
+            trendsCsv=trends.csv_text if trends else None,
+            previousSessionId=previousSessionId
         )
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
 
-        # Validate the structured data using Pydantic
-        structured_handover = HandoverStructured(**json_data)
+    trend_summary = trends.summary if trends else None
+    trends_digest = trends.sha256 if trends and trends.csv_text is None else None
 
-        # Generate unique session ID
-        session_id = str(uuid.uuid4())
+    result, coalesced = await generate_coalesced(request, client, trend_summary, trends_digest)
 
-        # Save to database
-        try:
-            await save_handover_session(
-                session=db,
-                session_id=session_id,
-                shift_notes=request.shiftNotes,
-                alarms_json=request.alarmsJson,
-                trends_csv=request.trendsCsv,
-                markdown_output=markdown,
-                json_output=json_data
-            )
-            logger.info(f"Handover session saved: {session_id}")
-        except Exception as db_error:
-            logger.warning(f"Database save failed (non-critical): {db_error}")
-            # Continue even if DB save fails
-
-        return HandoverResponse(
-            markdown=markdown,
-            json=structured_handover,
-            sessionId=session_id
-        )
+    response.headers["X-Handover-Cache"] = result.cache_outcome
+    if coalesced:
+        response.headers["X-Handover-Coalesced"] = "true"
+    elif result.audit_source_session_id:
+        background_tasks.add_task(audit_similar_hit, client, request, result, trend_summary)
 
-    except Exception as e:
+    return result.response
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Runtime metrics for caches and generation"""
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "handoverCache": handover_cache.metrics(),
+        "generationCoalescing": generation_flights.metrics(),
+        "writeBehind": write_behind.metrics(),
+        "longNotes": dict(map_reduce_metrics),
+        "maintenance": maintenance_state.to_dict(),
+        "profiling": profile_store.metrics(),
+        "trendCharts": trend_chart_cache.metrics(),
+        "gemini": gemini_client.usage_metrics() if gemini_client is not None else None,
+        "admission": admission_controller.metrics()
+    }
+
+
+@app.get("/api/debug/profiles", dependencies=[Depends(require_profiling_token)])
+async def list_profiles():
+    """Buffered request profiles, newest first"""
+    return {"profiles": [record.summary() for record in reversed(profile_store.records)]}
+
+
+@app.get("/api/debug/profiles/{profile_id}", dependencies=[Depends(require_profiling_token)])
+async def get_profile(profile_id: str):
+    """Text report of one buffered profile"""
+    record = profile_store.get(profile_id)
+    if not record:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    summary = record.summary()
+    header = " ".join(f"{key}={value}" for key, value in summary.items())
+    return PlainTextResponse(f"{header}\n\n{record.report}")
+
+
+@app.post("/api/debug/tracemalloc/snapshot", dependencies=[Depends(require_profiling_token)])
+async def tracemalloc_snapshot(limit: int = Query(default=25, ge=1, le=200)):
+    """
+    Top allocation sites and their growth since the previous snapshot.
+    The first call starts tracing and records the baseline.
+    """
+    return await asyncio.to_thread(allocation_tracker.snapshot, limit)
+
+
+@app.post("/api/debug/tracemalloc/stop", dependencies=[Depends(require_profiling_token)])
+async def tracemalloc_stop():
+    """Stop tracing allocations and drop the baseline"""
+    allocation_tracker.stop()
+    return {"tracing": False}
+
+
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """created_at is stored as naive UTC; convert offset-aware query values to match"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@app.get("/api/handovers/export")
+async def export_handovers(
+    start: Optional[datetime] = Query(default=None, description="Inclusive lower bound on created_at"),
+    end: Optional[datetime] = Query(default=None, description="Exclusive upper bound on created_at"),
+    format: str = Query(default="ndjson", description="ndjson, csv or parquet"),
+    batch_size: int = Query(default=500, ge=1, le=10000)
+):
+    """
+    Stream handover history for analytics.
+
+    Rows are read with a server-side cursor in batches and flattened so that
+    open issues and critical alarms become parallel list columns.
+    """
+    export_format = format.lower()
+    if export_format not in EXPORT_FORMATS:
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to generate handover: {str(e)}"
+            status_code=400,
+            detail=f"Unsupported export format '{format}'. Use one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    if export_format == "parquet" and not parquet_available():
+        raise HTTPException(
+            status_code=400,
+            detail="Parquet export requires pyarrow to be installed on the server"
         )
+    start, end = _utc_naive(start), _utc_naive(end)
+    if start and end and start >= end:
+        raise HTTPException(status_code=400, detail="start must be earlier than end")
+
+    media_type, extension = EXPORT_FORMATS[export_format]
+    filename = f"handovers-{datetime.now().strftime('%Y-%m-%d')}.{extension}"
+
+    return StreamingResponse(
+        EXPORT_WRITERS[export_format](start, end, batch_size),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+def _analytics_window(start: Optional[date], end: Optional[date]) -> tuple:
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be later than end")
+    return start, end
+
+
+@app.get("/api/analytics/recurring-issues")
+async def recurring_issues(
+    start: Optional[date] = Query(default=None, description="First day (UTC), inclusive"),
+    end: Optional[date] = Query(default=None, description="Last day (UTC), inclusive"),
+    limit: int = Query(default=20, ge=1, le=500),
+    min_occurrences: int = Query(default=2, ge=1),
+    db: AsyncSession = Depends(get_session)
+):
+    """Most frequent open issues across handovers in a date window"""
+    start, end = _analytics_window(start, end)
+    issues = await top_recurring_issues(db, start, end, limit, min_occurrences)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "issues": [
+            {
+                "issueKey": row["issue_key"],
+                "issue": row["issue"],
+                "occurrences": row["occurrences"],
+                "daysSeen": row["days_seen"],
+                "highPriority": row["high_priority"],
+                "avgConfidence": round(row["avg_confidence"] or 0, 3),
+                "firstSeen": row["first_seen"].isoformat(),
+                "lastSeen": row["last_seen"].isoformat(),
+            }
+            for row in issues
+        ]
+    }
+
+
+@app.get("/api/analytics/alarm-frequency")
+async def alarm_frequency(
+    start: Optional[date] = Query(default=None, description="First day (UTC), inclusive"),
+    end: Optional[date] = Query(default=None, description="Last day (UTC), inclusive"),
+    unit: Optional[str] = Query(default=None, description="Only tags of this unit, e.g. Reactor-B"),
+    limit: int = Query(default=50, ge=1, le=1000),
+    db: AsyncSession = Depends(get_session)
+):
+    """Alarm counts per tag across handovers in a date window"""
+    start, end = _analytics_window(start, end)
+    tags = await alarm_frequency_by_tag(db, start, end, limit, unit)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "unit": unit,
+        "tags": [
+            {
+                "tag": row["tag"],
+                "unit": row["unit"],
+                "occurrences": row["occurrences"],
+                "criticalOccurrences": row["critical_occurrences"],
+                "sessions": row["sessions"],
+                "daysSeen": row["days_seen"],
+                "lastSeen": row["last_seen"].isoformat(),
+            }
+            for row in tags
+        ]
+    }
 
 
 @app.get("/api/handover/{session_id}", response_model=HandoverResponse)
 async def get_handover(
     session_id: str,
+    request: Request,
     db: AsyncSession = Depends(get_session)
 ):
     """Retrieve a previously generated handover by session ID"""
 
-    from database import get_handover_session
-    import json
-
     session = await get_handover_session(db, session_id)
 
     if not session:
@@ -223,39 +482,90 @@ async def get_handover(
             detail=f"Handover session {session_id} not found"
         )
 
-    json_output = json.loads(session.json_output)
+    # Send the body compressed at write time when the client accepts its encoding
+    if session.response_body and compression.accepts(
+        request.headers.get("accept-encoding"), session.response_encoding
+    ):
+        return Response(
+            content=session.response_body,
+            media_type="application/json",
+            headers={"Content-Encoding": session.response_encoding, "Vary": "Accept-Encoding"}
+        )
 
-    return HandoverResponse(
-        markdown=session.markdown_output,
-        json=HandoverStructured(**json_output),
-        sessionId=session.session_id
+    # Stored output was validated at write time; send it without re-parsing
+    return Response(
+        content=encode_handover_response(session.markdown_output, session.json_output, session.session_id),
+        media_type="application/json"
     )
 
 
+@app.get("/api/handover/{session_id}/trends")
+async def get_handover_trends(
+    session_id: str,
+    request: Request,
+    points: int = Query(
+        default=TREND_CHART_DEFAULT_POINTS, ge=3, le=TREND_CHART_MAX_POINTS,
+        description="Maximum points per series (LTTB downsampling)"
+    ),
+    encoding: str = Query(default="base64", description="base64 (little-endian float32 arrays) or json"),
+    tags: Optional[str] = Query(default=None, description="Comma-separated tags; all when omitted"),
+    db: AsyncSession = Depends(get_session)
+):
+    """
+    Chart data for the trends behind a handover: one columnar series per tag,
+    downsampled to at most `points` points. Payloads are cached per session
+    and resolution and carry an ETag for conditional requests.
+    """
+    encoding = encoding.lower()
+    if encoding not in CHART_ENCODINGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported encoding '{encoding}'. Use one of: {', '.join(CHART_ENCODINGS)}"
+        )
+    tag_list: Optional[List[str]] = [tag.strip() for tag in tags.split(",") if tag.strip()] if tags else None
+
+    # Checked on every request: retention and archival can remove the trends
+    # behind a cached payload
+    has_trends = await session_has_trends(db, session_id)
+    if not has_trends:
+        trend_chart_cache.discard(session_id)
+        if has_trends is None:
+            raise HTTPException(status_code=404, detail=f"Handover session {session_id} not found")
+        raise HTTPException(status_code=404, detail=f"No trend data stored for session {session_id}")
+
+    cache_key = trend_chart_cache.key(session_id, points, encoding, tag_list)
+    cached = trend_chart_cache.get(cache_key)
+    if cached is None:
+        session = await get_handover_session(db, session_id)
+        if not session or not session.trends_csv:
+            raise HTTPException(status_code=404, detail=f"No trend data stored for session {session_id}")
+        body = await asyncio.to_thread(
+            render_chart_payload, session_id, session.trends_csv, points, encoding, tag_list
+        )
+        cached = trend_chart_cache.put(cache_key, body)
+
+    body, etag = cached
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
 @app.post("/api/handover/download-pdf")
 async def download_pdf(request: HandoverRequest):
     """
     Generate and download a handover report as a professional PDF.
     
-    Takes the same input as generate_handover but returns a PDF file.
+    Takes the same input as generate_handover but returns a PDF file. The
+    handover goes through the same pipeline (cache, long-log condensing,
+    coalescing) and is saved as a session.
     """
     try:
-        from fastapi.responses import StreamingResponse
-        from pdf_generator import generate_pdf_from_markdown
-        
-        # Generate handover using Gemini
         client = get_gemini_client()
-        markdown, json_data = client.generate_handover(
-            shift_notes=request.shiftNotes,
-            alarms_json=request.alarmsJson,
-            trends_csv=request.trendsCsv
-        )
-
-        # Validate the structured data
-        structured_handover = HandoverStructured(**json_data)
+        result, _ = await generate_coalesced(request, client)
+        markdown = result.response.markdown
 
         # Generate PDF from markdown (formatted report)
-        pdf_bytes = generate_pdf_from_markdown(markdown)
+        pdf_bytes = await asyncio.to_thread(generate_pdf_from_markdown, markdown)
 
         # Create response with PDF file
         timestamp = datetime.now().strftime("%Y-%m-%d")
@@ -264,9 +574,14 @@ async def download_pdf(request: HandoverRequest):
         return StreamingResponse(
             iter([pdf_bytes]),
             media_type="application/pdf",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+            headers={
+                "Content-Disposition": f"attachment; filename={filename}",
+                "X-Handover-Session-Id": result.response.sessionId,
+            }
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"PDF generation error: {str(e)}")
         raise HTTPException(
@@ -278,15 +593,11 @@ async def download_pdf(request: HandoverRequest):
 @app.get("/api/handover/{session_id}/download-pdf")
 async def download_pdf_by_session(
     session_id: str,
+    request: Request,
     db: AsyncSession = Depends(get_session)
 ):
     """Download a previously generated handover as PDF by session ID"""
 
-    from database import get_handover_session
-    from fastapi.responses import StreamingResponse
-    from pdf_generator import generate_pdf_from_markdown
-    import json
-
     session = await get_handover_session(db, session_id)
 
     if not session:
@@ -296,17 +607,31 @@ async def download_pdf_by_session(
         )
 
     try:
-        # Generate PDF from markdown (formatted report)
-        pdf_bytes = generate_pdf_from_markdown(session.markdown_output)
+        # Rendered once per session and kept compressed
+        cached = await get_cached_pdf(db, session_id)
+        if cached is not None:
+            content, encoding = cached.content, cached.encoding
+        else:
+            # Generate PDF from markdown (formatted report)
+            pdf_bytes = await asyncio.to_thread(generate_pdf_from_markdown, session.markdown_output)
+            encoding = compression.PRECOMPRESSED_ENCODING
+            content = await asyncio.to_thread(compression.compress, pdf_bytes, encoding)
+            try:
+                await save_cached_pdf(db, session_id, content, encoding)
+            except Exception as db_error:
+                await db.rollback()
+                logger.warning(f"Caching PDF failed (non-critical): {db_error}")
 
         timestamp = datetime.now().strftime("%Y-%m-%d")
         filename = f"shift-handover-{timestamp}.pdf"
+        headers = {"Content-Disposition": f"attachment; filename={filename}", "Vary": "Accept-Encoding"}
 
-        return StreamingResponse(
-            iter([pdf_bytes]),
-            media_type="application/pdf",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        if compression.accepts(request.headers.get("accept-encoding"), encoding):
+            headers["Content-Encoding"] = encoding
+        else:
+            content = await asyncio.to_thread(compression.decompress, content, encoding)
+
+        return Response(content=content, media_type="application/pdf", headers=headers)
 
     except Exception as e:
         logger.error(f"PDF generation error: {str(e)}")
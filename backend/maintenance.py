@@ -0,0 +1,403 @@
+"""
+Background maintenance for the handover database.
+
+A single worker (elected with a lock) periodically:
+
+- applies per-column retention, clearing bulky raw inputs (trends, alarms,
+  notes) once they are older than their configured age,
+- moves sessions older than ARCHIVE_AFTER_DAYS into compressed archive
+  blocks in the database (see archive), which get_handover_session and the
+  export still read,
+- prunes old chunk summaries, cached PDFs and per-session issue/alarm facts
+  (the daily rollups stay as the long-term aggregates) and, optionally,
+  whole archive months,
+- reclaims free pages with incremental VACUUM and refreshes planner
+  statistics with ANALYZE,
+- on PostgreSQL, creates the upcoming monthly partitions.
+
+All work is done in small batches so that write locks stay short. A value of
+0 for any retention setting keeps that data forever.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, func, select, text, update
+
+import archive
+import postgres
+from database import (
+    ARCHIVED_COLUMNS,
+    IS_POSTGRES,
+    ArchiveBlockDB,
+    ArchivedSessionDB,
+    HandoverAlarmDB,
+    HandoverIssueDB,
+    HandoverPdfDB,
+    HandoverSessionDB,
+    NoteChunkSummaryDB,
+    async_session_maker,
+    engine
+)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "true").lower() == "true"
+MAINTENANCE_INTERVAL_MINUTES = float(os.getenv("MAINTENANCE_INTERVAL_MINUTES", "60"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+# Free pages returned to the OS per run by SQLite's incremental vacuum
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "5000"))
+ANALYZE_INTERVAL_HOURS = float(os.getenv("ANALYZE_INTERVAL_HOURS", "24"))
+# Convert a SQLite file created without incremental auto_vacuum with a full
+# VACUUM (exclusive lock, rewrites the whole file): enable for a maintenance window
+MAINTENANCE_CONVERT_AUTO_VACUUM = os.getenv("MAINTENANCE_CONVERT_AUTO_VACUUM", "false").lower() == "true"
+
+# Per-column retention for the raw inputs, in days
+COLUMN_RETENTION_DAYS = {
+    "trends_csv": float(os.getenv("RETENTION_TRENDS_DAYS", "30")),
+    "alarms_json": float(os.getenv("RETENTION_ALARMS_DAYS", "90")),
+    "shift_notes": float(os.getenv("RETENTION_NOTES_DAYS", "0")),
+}
+# Cache keys are useless once older than the handover cache's max age
+CACHE_KEY_RETENTION_DAYS = float(os.getenv("RETENTION_CACHE_KEYS_DAYS", "7"))
+CHUNK_SUMMARY_RETENTION_DAYS = float(os.getenv("RETENTION_CHUNK_SUMMARIES_DAYS", "30"))
+PDF_CACHE_RETENTION_DAYS = float(os.getenv("RETENTION_PDF_CACHE_DAYS", "30"))
+# Per-session issue/alarm rows behind the rollups; facts of archived sessions go with them
+SESSION_FACTS_RETENTION_DAYS = float(os.getenv("RETENTION_SESSION_FACTS_DAYS", "90"))
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+# Archived outputs are kept for years by default
+ARCHIVE_RETENTION_MONTHS = int(os.getenv("ARCHIVE_RETENTION_MONTHS", "0"))
+# Elects the maintenance worker on SQLite (PostgreSQL uses an advisory lock)
+MAINTENANCE_LOCK_FILE = Path(os.getenv("MAINTENANCE_LOCK_FILE", "./.maintenance.lock"))
+
+# Value a cleared column is set to (shift_notes is NOT NULL)
+_CLEARED_VALUE = {"shift_notes": ""}
+
+_PG_LEADER_LOCK_KEY = 804_211_002
+
+
+class MaintenanceState:
+    """Outcome of the most recent maintenance run, for /api/metrics"""
+
+    def __init__(self):
+        self.leader = False
+        self.runs = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_analyze_at: Optional[datetime] = None
+        self.last_run: Dict[str, Any] = {}
+        self.last_error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "enabled": MAINTENANCE_ENABLED,
+            "leader": self.leader,
+            "runs": self.runs,
+            "lastRunAt": self.last_run_at.isoformat() if self.last_run_at else None,
+            "lastAnalyzeAt": self.last_analyze_at.isoformat() if self.last_analyze_at else None,
+            "lastRun": self.last_run,
+            "lastError": self.last_error,
+        }
+
+
+maintenance_state = MaintenanceState()
+_lock_handle = None
+
+
+async def _acquire_leader_lock() -> bool:
+    """
+    Non-blocking exclusive lock so only one worker process runs maintenance:
+    a session-level advisory lock on PostgreSQL (shared by all replicas),
+    otherwise the MAINTENANCE_LOCK_FILE file lock.
+    """
+    global _lock_handle
+    if _lock_handle is not None:
+        return True
+
+    if IS_POSTGRES:
+        # Held for the life of the process on a dedicated connection
+        conn = await engine.connect()
+        acquired = (await conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": _PG_LEADER_LOCK_KEY}
+        )).scalar()
+        await conn.commit()
+        if not acquired:
+            await conn.close()
+            return False
+        _lock_handle = conn
+        return True
+
+    if fcntl is None:
+        return True
+
+    MAINTENANCE_LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    handle = open(MAINTENANCE_LOCK_FILE, "w")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    _lock_handle = handle
+    return True
+
+
+def _cutoff(days: float) -> datetime:
+    return datetime.utcnow() - timedelta(days=days)
+
+
+async def _batched_update(statement_for_ids, id_query) -> int:
+    """Run statement_for_ids(ids) over id_query in MAINTENANCE_BATCH_SIZE batches"""
+    total = 0
+    while True:
+        async with async_session_maker() as session:
+            ids = (await session.execute(id_query.limit(MAINTENANCE_BATCH_SIZE))).scalars().all()
+            if not ids:
+                return total
+            await session.execute(statement_for_ids(ids))
+            await session.commit()
+        total += len(ids)
+        # Let request handlers get at the database between batches
+        await asyncio.sleep(0)
+
+
+async def apply_column_retention() -> Dict[str, int]:
+    """Clear raw input columns and cache keys past their retention age"""
+    cleared: Dict[str, int] = {}
+    targets = dict(COLUMN_RETENTION_DAYS)
+    targets["request_hash"] = CACHE_KEY_RETENTION_DAYS
+    targets["similarity_signature"] = CACHE_KEY_RETENTION_DAYS
+
+    for column_name, days in targets.items():
+        if days <= 0:
+            continue
+        column = getattr(HandoverSessionDB, column_name)
+        cleared_value = _CLEARED_VALUE.get(column_name)
+        stale = column.is_not(None) if cleared_value is None else column != cleared_value
+
+        id_query = (
+            select(HandoverSessionDB.id)
+            .where(HandoverSessionDB.created_at < _cutoff(days))
+            .where(stale)
+        )
+        cleared[column_name] = await _batched_update(
+            lambda ids, column_name=column_name, value=cleared_value: (
+                update(HandoverSessionDB)
+                .where(HandoverSessionDB.id.in_(ids))
+                .values({column_name: value})
+            ),
+            id_query
+        )
+    return cleared
+
+
+def _archive_row(db_session: HandoverSessionDB) -> Dict[str, Any]:
+    row = {column: getattr(db_session, column) for column in ARCHIVED_COLUMNS}
+    row["created_at"] = row["created_at"].isoformat() if row["created_at"] else None
+    return row
+
+
+async def archive_old_sessions() -> int:
+    """Move sessions older than ARCHIVE_AFTER_DAYS into archive blocks"""
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return 0
+
+    cutoff = _cutoff(ARCHIVE_AFTER_DAYS)
+    archived = 0
+    while True:
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(HandoverSessionDB)
+                .where(HandoverSessionDB.created_at < cutoff)
+                .order_by(HandoverSessionDB.created_at)
+                .limit(MAINTENANCE_BATCH_SIZE)
+            )
+            rows = result.scalars().all()
+            if not rows:
+                return archived
+
+            by_month: Dict[str, List[HandoverSessionDB]] = defaultdict(list)
+            for row in rows:
+                by_month[row.created_at.strftime("%Y-%m")].append(row)
+
+            # Blocks, index rows and the delete share one transaction
+            for month, month_rows in by_month.items():
+                for start in range(0, len(month_rows), archive.ARCHIVE_BLOCK_ROWS):
+                    block_rows = month_rows[start:start + archive.ARCHIVE_BLOCK_ROWS]
+                    content = await asyncio.to_thread(
+                        archive.encode_block, [_archive_row(row) for row in block_rows]
+                    )
+                    block = ArchiveBlockDB(archive_month=month, row_count=len(block_rows), content=content)
+                    session.add(block)
+                    await session.flush()
+                    for row in block_rows:
+                        await session.merge(ArchivedSessionDB(
+                            session_id=row.session_id,
+                            archive_month=month,
+                            block_id=block.id,
+                            created_at=row.created_at
+                        ))
+
+            await session.execute(
+                delete(HandoverSessionDB).where(HandoverSessionDB.id.in_([row.id for row in rows]))
+            )
+            session_ids = [row.session_id for row in rows]
+            for model in (HandoverIssueDB, HandoverAlarmDB):
+                await session.execute(delete(model).where(model.session_id.in_(session_ids)))
+            await session.commit()
+            archived += len(rows)
+        await asyncio.sleep(0)
+
+
+async def prune_expired() -> Dict[str, int]:
+    """
+    Delete old chunk summaries, cached PDFs and session facts and, when
+    configured, whole archive months
+    """
+    pruned = {"chunk_summaries": 0, "cached_pdfs": 0, "issue_facts": 0, "alarm_facts": 0, "archive_months": 0}
+
+    for name, model, days in (
+        ("chunk_summaries", NoteChunkSummaryDB, CHUNK_SUMMARY_RETENTION_DAYS),
+        ("cached_pdfs", HandoverPdfDB, PDF_CACHE_RETENTION_DAYS),
+    ):
+        if days <= 0:
+            continue
+        async with async_session_maker() as session:
+            result = await session.execute(delete(model).where(model.created_at < _cutoff(days)))
+            await session.commit()
+            pruned[name] = result.rowcount or 0
+
+    if SESSION_FACTS_RETENTION_DAYS > 0:
+        oldest_kept = _cutoff(SESSION_FACTS_RETENTION_DAYS).date()
+        for name, model in (("issue_facts", HandoverIssueDB), ("alarm_facts", HandoverAlarmDB)):
+            pruned[name] = await _batched_update(
+                lambda ids, model=model: delete(model).where(model.id.in_(ids)),
+                select(model.id).where(model.day < oldest_kept)
+            )
+
+    if ARCHIVE_RETENTION_MONTHS > 0:
+        now = datetime.utcnow()
+        index = now.year * 12 + now.month - 1 - ARCHIVE_RETENTION_MONTHS
+        oldest_kept = f"{index // 12:04d}-{index % 12 + 1:02d}"
+        async with async_session_maker() as session:
+            months = (await session.execute(
+                select(ArchiveBlockDB.archive_month).distinct()
+                .where(ArchiveBlockDB.archive_month < oldest_kept)
+                .order_by(ArchiveBlockDB.archive_month)
+            )).scalars().all()
+        for month in months:
+            async with async_session_maker() as session:
+                await session.execute(delete(ArchivedSessionDB).where(ArchivedSessionDB.archive_month == month))
+                await session.execute(delete(ArchiveBlockDB).where(ArchiveBlockDB.archive_month == month))
+                await session.commit()
+            pruned["archive_months"] += 1
+
+    return pruned
+
+
+async def compact_database(analyze: bool) -> Dict[str, Any]:
+    """Incremental VACUUM and, when due, ANALYZE"""
+    dialect = engine.dialect.name
+    result: Dict[str, Any] = {"dialect": dialect, "analyzed": False}
+
+    # VACUUM cannot run inside a transaction
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+
+        if dialect == "sqlite":
+            incremental = (await conn.execute(text("PRAGMA auto_vacuum"))).scalar() == 2
+            if not incremental and MAINTENANCE_CONVERT_AUTO_VACUUM:
+                logger.info("Converting SQLite database to incremental auto_vacuum (one-off VACUUM)")
+                await conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+                await conn.execute(text("VACUUM"))
+                incremental = True
+            free_before = (await conn.execute(text("PRAGMA freelist_count"))).scalar()
+            if incremental:
+                await conn.execute(text(f"PRAGMA incremental_vacuum({int(MAINTENANCE_VACUUM_PAGES)})"))
+            elif free_before:
+                logger.info(
+                    f"{free_before} free SQLite pages not reclaimed: the file predates incremental "
+                    "auto_vacuum (set MAINTENANCE_CONVERT_AUTO_VACUUM=true once to convert it)"
+                )
+            free_after = (await conn.execute(text("PRAGMA freelist_count"))).scalar()
+            if analyze:
+                await conn.execute(text("ANALYZE"))
+                await conn.execute(text("PRAGMA optimize"))
+            page_count = (await conn.execute(text("PRAGMA page_count"))).scalar()
+            page_size = (await conn.execute(text("PRAGMA page_size"))).scalar()
+            result.update({
+                "incremental_auto_vacuum": incremental,
+                "pages_reclaimed": (free_before or 0) - (free_after or 0),
+                "free_pages": free_after,
+                "database_bytes": page_count * page_size,
+            })
+        elif dialect == "postgresql":
+            tables = ", ".join(table.name for table in HandoverSessionDB.metadata.sorted_tables)
+            await conn.execute(text(f"VACUUM {'(ANALYZE) ' if analyze else ''}{tables}"))
+        else:
+            return result
+
+    result["analyzed"] = analyze
+    return result
+
+
+async def run_maintenance() -> Dict[str, Any]:
+    """One full maintenance pass"""
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    analyze = (
+        maintenance_state.last_analyze_at is None
+        or now - maintenance_state.last_analyze_at >= timedelta(hours=ANALYZE_INTERVAL_HOURS)
+    )
+
+    if IS_POSTGRES:
+        async with engine.begin() as conn:
+            await postgres.ensure_partitions(conn)
+
+    summary: Dict[str, Any] = {
+        "cleared": await apply_column_retention(),
+        "archived": await archive_old_sessions(),
+        "pruned": await prune_expired(),
+        "compaction": await compact_database(analyze),
+    }
+    async with async_session_maker() as session:
+        summary["hot_rows"] = (await session.execute(select(func.count(HandoverSessionDB.id)))).scalar()
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+
+    maintenance_state.runs += 1
+    maintenance_state.last_run_at = now
+    maintenance_state.last_run = summary
+    if analyze:
+        maintenance_state.last_analyze_at = now
+    return summary
+
+
+async def maintenance_loop():
+    """Run maintenance every MAINTENANCE_INTERVAL_MINUTES in the elected worker"""
+    if not MAINTENANCE_ENABLED:
+        return
+    if not await _acquire_leader_lock():
+        logger.info("Database maintenance runs in another worker")
+        return
+    maintenance_state.leader = True
+
+    while True:
+        try:
+            summary = await run_maintenance()
+            maintenance_state.last_error = None
+            logger.info(f"Database maintenance finished: {summary}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            maintenance_state.last_error = str(e)
+            logger.error(f"Database maintenance failed: {e}", exc_info=True)
+        await asyncio.sleep(MAINTENANCE_INTERVAL_MINUTES * 60)
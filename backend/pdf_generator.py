@@ -6,6 +6,7 @@ using ReportLab (lighter weight than WeasyPrint)
 
 from io import BytesIO
 from datetime import datetime
+from functools import lru_cache
 from typing import Dict, Any
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -69,9 +70,9 @@ def apply_markdown_formatting(text: str) -> str:
     return text
 
 
-def parse_markdown_to_story(markdown_text: str) -> list:
-    """Convert markdown text to ReportLab story with formatting"""
-    story = []
+@lru_cache(maxsize=1)
+def get_report_styles() -> Dict[str, ParagraphStyle]:
+    """Build the report paragraph styles once and reuse them for every PDF"""
     styles = getSampleStyleSheet()
     
     # Custom styles for beautiful formatting
@@ -125,6 +126,44 @@ def parse_markdown_to_story(markdown_text: str) -> list:
         spaceAfter=6
     )
     
+    footer_style = ParagraphStyle(
+        'Footer',
+        parent=styles['Normal'],
+        fontSize=9,
+        textColor=grey,
+        alignment=TA_CENTER
+    )
+    
+    return {
+        'title': title_style,
+        'heading1': heading1_style,
+        'heading2': heading2_style,
+        'normal': normal_style,
+        'code': code_style,
+        'footer': footer_style,
+    }
+
+
+def warm_up() -> int:
+    """
+    Prime the cached styles, fonts and ReportLab's lazily imported modules by
+    rendering a tiny report. Returns the size of the rendered PDF.
+    """
+    return len(generate_pdf_from_markdown(
+        "# Warm-up\n\n## Section\n- **item** _note_\n1. step\n\n```\ncode\n```"
+    ))
+
+
+def parse_markdown_to_story(markdown_text: str) -> list:
+    """Convert markdown text to ReportLab story with formatting"""
+    story = []
+    report_styles = get_report_styles()
+    title_style = report_styles['title']
+    heading1_style = report_styles['heading1']
+    heading2_style = report_styles['heading2']
+    normal_style = report_styles['normal']
+    code_style = report_styles['code']
+    
     # Parse markdown lines
     lines = markdown_text.split('\n')
     i = 0
@@ -235,14 +274,7 @@ def parse_markdown_to_story(markdown_text: str) -> list:
     # Footer
     story.append(Spacer(1, 0.3*inch))
     footer_text = f"<i>Generated by Shift Handover Intelligence System on {datetime.now().strftime('%B %d, %Y at %H:%M:%S')}</i>"
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor=grey,
-        alignment=TA_CENTER
-    )
-    story.append(Paragraph(footer_text, footer_style))
+    story.append(Paragraph(footer_text, report_styles['footer']))
     
     return story
 
@@ -0,0 +1,253 @@
+"""
+PostgreSQL-specific schema and bulk loading.
+
+On PostgreSQL handover_sessions is range-partitioned by month on created_at,
+alarms_json and json_output are JSONB with GIN indexes, and batches of
+sessions are written with COPY. Partitioning requires the partition key in
+every unique constraint, so the primary key is (id, created_at). Lookups and
+write-behind replay rely on session_id being unique across all partitions,
+so insert and delete triggers keep every session_id in the
+handover_session_ids table, whose primary key rejects a duplicate with the
+same unique violation a plain table would raise.
+
+A handover_sessions table created before partitioning (a plain table with
+TEXT JSON columns) is migrated at startup: it is renamed, its rows are copied
+into the partitioned table with the JSON cast to JSONB, and it is dropped, all
+in the startup transaction.
+"""
+
+import logging
+import os
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError
+
+logger = logging.getLogger(__name__)
+
+# Partitions are created ahead of time so inserts never hit the default partition
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+# Serializes DDL across workers and replicas starting at the same time
+_SCHEMA_LOCK_KEY = 804_211_001
+
+_CREATE_SESSIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS handover_sessions (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+    session_id VARCHAR NOT NULL,
+    shift_notes TEXT NOT NULL,
+    alarms_json JSONB,
+    trends_csv TEXT,
+    markdown_output TEXT NOT NULL,
+    json_output JSONB NOT NULL,
+    previous_session_id VARCHAR,
+    request_hash VARCHAR(64),
+    similarity_signature TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    response_body BYTEA,
+    response_encoding VARCHAR(8),
+    PRIMARY KEY (id, created_at),
+    UNIQUE (session_id, created_at)
+) PARTITION BY RANGE (created_at)
+"""
+
+# Columns added after the partitioned table was first introduced
+_ADD_SESSIONS_COLUMNS = [
+    "ALTER TABLE handover_sessions ADD COLUMN IF NOT EXISTS response_body BYTEA",
+    "ALTER TABLE handover_sessions ADD COLUMN IF NOT EXISTS response_encoding VARCHAR(8)",
+]
+
+_CREATE_SESSIONS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_handover_sessions_created_at ON handover_sessions (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_handover_sessions_previous_session_id ON handover_sessions (previous_session_id)",
+    "CREATE INDEX IF NOT EXISTS ix_handover_sessions_request_hash ON handover_sessions (request_hash)",
+    # Containment queries, e.g. json_output @> '{"openIssues": [{"priority": "High"}]}'
+    "CREATE INDEX IF NOT EXISTS ix_handover_sessions_json_output_gin "
+    "ON handover_sessions USING GIN (json_output jsonb_path_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_handover_sessions_alarms_json_gin "
+    "ON handover_sessions USING GIN (alarms_json jsonb_path_ops)",
+]
+
+_CREATE_SESSION_IDS_TABLE = "CREATE TABLE IF NOT EXISTS handover_session_ids (session_id VARCHAR PRIMARY KEY)"
+
+_CREATE_SESSION_IDS_FUNCTION = """
+CREATE OR REPLACE FUNCTION handover_session_ids_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO handover_session_ids (session_id) VALUES (NEW.session_id);
+        RETURN NEW;
+    END IF;
+    DELETE FROM handover_session_ids WHERE session_id = OLD.session_id;
+    RETURN OLD;
+END
+$$
+"""
+
+# Trigger name -> event; row-level AFTER triggers also fire for COPY
+_SESSION_IDS_TRIGGERS = {
+    "handover_session_ids_insert": "INSERT",
+    "handover_session_ids_delete": "DELETE",
+}
+
+_LEGACY_SESSIONS_TABLE = "handover_sessions_unpartitioned"
+
+# Columns the partitioned table has that an older plain table may lack
+_LEGACY_MISSING_COLUMNS = [
+    "previous_session_id VARCHAR",
+    "request_hash VARCHAR(64)",
+    "similarity_signature TEXT",
+    "response_body BYTEA",
+    "response_encoding VARCHAR(8)",
+]
+
+_COPY_LEGACY_SESSIONS = f"""
+INSERT INTO handover_sessions (
+    id, session_id, shift_notes, alarms_json, trends_csv, markdown_output, json_output,
+    previous_session_id, request_hash, similarity_signature, created_at, response_body, response_encoding
+)
+SELECT
+    id, session_id, shift_notes, NULLIF(alarms_json::text, '')::jsonb, trends_csv, markdown_output,
+    json_output::text::jsonb, previous_session_id, request_hash, similarity_signature,
+    COALESCE(created_at, now() AT TIME ZONE 'utc'), response_body, response_encoding
+FROM {_LEGACY_SESSIONS_TABLE}
+"""
+
+# Columns written by COPY, in order (only id is left to its default)
+COPY_COLUMNS = (
+    "session_id",
+    "shift_notes",
+    "alarms_json",
+    "trends_csv",
+    "markdown_output",
+    "json_output",
+    "previous_session_id",
+    "request_hash",
+    "similarity_signature",
+    "created_at",
+    "response_body",
+    "response_encoding",
+)
+
+
+def _month_start(year: int, month: int) -> date:
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return date(year, month, 1)
+
+
+def partition_name(month_start: date) -> str:
+    return f"handover_sessions_{month_start:%Y_%m}"
+
+
+async def ensure_partitions(conn, months_ahead: int = PARTITION_MONTHS_AHEAD, since: Optional[date] = None):
+    """
+    Create monthly partitions from this month (or the month of since) to
+    months_ahead, plus a default partition
+    """
+    today = datetime.utcnow().date()
+    first = since if since is not None and since < today else today
+    months = (today.year - first.year) * 12 + today.month - first.month + months_ahead
+    for offset in range(months + 1):
+        start = _month_start(first.year, first.month + offset)
+        end = _month_start(start.year, start.month + 1)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF handover_sessions "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS handover_sessions_default PARTITION OF handover_sessions DEFAULT"
+    ))
+
+
+async def _sessions_table_kind(conn) -> Optional[str]:
+    """'p' for the partitioned table, 'r' for a plain one, None when it does not exist"""
+    return (await conn.execute(text(
+        "SELECT relkind::text FROM pg_class WHERE oid = to_regclass('handover_sessions')"
+    ))).scalar()
+
+
+async def _ensure_session_id_guard(conn):
+    """Global session_id uniqueness for the partitioned table (see module docstring)"""
+    new_table = (await conn.execute(text("SELECT to_regclass('handover_session_ids') IS NULL"))).scalar()
+    await conn.execute(text(_CREATE_SESSION_IDS_TABLE))
+    if new_table:
+        # Sessions written before the guard existed
+        await conn.execute(text(
+            "INSERT INTO handover_session_ids (session_id) SELECT session_id FROM handover_sessions "
+            "ON CONFLICT DO NOTHING"
+        ))
+    await conn.execute(text(_CREATE_SESSION_IDS_FUNCTION))
+    for name, event in _SESSION_IDS_TRIGGERS.items():
+        exists = (await conn.execute(text(
+            "SELECT 1 FROM pg_trigger WHERE tgname = :name AND tgrelid = 'handover_sessions'::regclass"
+        ), {"name": name})).scalar()
+        if not exists:
+            await conn.execute(text(
+                f"CREATE TRIGGER {name} AFTER {event} ON handover_sessions "
+                "FOR EACH ROW EXECUTE FUNCTION handover_session_ids_sync()"
+            ))
+
+
+async def _copy_legacy_sessions(conn):
+    """Move the rows of the renamed plain table into the partitioned one and drop it"""
+    for column in _LEGACY_MISSING_COLUMNS:
+        await conn.execute(text(f"ALTER TABLE {_LEGACY_SESSIONS_TABLE} ADD COLUMN IF NOT EXISTS {column}"))
+    oldest = (await conn.execute(text(f"SELECT min(created_at) FROM {_LEGACY_SESSIONS_TABLE}"))).scalar()
+    # Real partitions for every month of history; the default partition stays empty
+    await ensure_partitions(conn, since=oldest.date() if oldest else None)
+    try:
+        await conn.execute(text(_COPY_LEGACY_SESSIONS))
+    except Exception as e:
+        raise RuntimeError(
+            "Could not migrate the existing unpartitioned handover_sessions table to the partitioned "
+            f"PostgreSQL schema (alarms_json/json_output must hold valid JSON): {e}"
+        ) from e
+    await conn.execute(text(
+        "SELECT setval(pg_get_serial_sequence('handover_sessions', 'id'), COALESCE(max(id), 0) + 1, false) "
+        "FROM handover_sessions"
+    ))
+    await conn.execute(text(f"DROP TABLE {_LEGACY_SESSIONS_TABLE}"))
+
+
+async def create_schema(conn):
+    """
+    Create the partitioned sessions table, its indexes and partitions,
+    migrating a plain handover_sessions table from an older release first
+    """
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _SCHEMA_LOCK_KEY})
+    legacy = await _sessions_table_kind(conn) == "r"
+    if legacy:
+        logger.warning("Migrating the unpartitioned handover_sessions table to monthly partitions")
+        await conn.execute(text(f"ALTER TABLE handover_sessions RENAME TO {_LEGACY_SESSIONS_TABLE}"))
+    await conn.execute(text(_CREATE_SESSIONS_TABLE))
+    for statement in _ADD_SESSIONS_COLUMNS:
+        await conn.execute(text(statement))
+    await _ensure_session_id_guard(conn)
+    if legacy:
+        # Dropped before the indexes are created: it still owns the ix_handover_sessions_* names
+        await _copy_legacy_sessions(conn)
+    for statement in _CREATE_SESSIONS_INDEXES:
+        await conn.execute(text(statement))
+    await ensure_partitions(conn)
+
+
+async def copy_sessions(conn, rows: Sequence[Dict[str, Any]]) -> int:
+    """
+    Bulk insert session rows (dicts keyed by COPY_COLUMNS, JSON as text)
+    with a single binary COPY on the connection's asyncpg driver connection.
+    Constraint and data errors are raised as the SQLAlchemy IntegrityError /
+    DataError a regular insert would raise.
+    """
+    import asyncpg
+
+    raw_connection = await conn.get_raw_connection()
+    records: List[tuple] = [tuple(row.get(column) for column in COPY_COLUMNS) for row in rows]
+    try:
+        await raw_connection.driver_connection.copy_records_to_table(
+            "handover_sessions", records=records, columns=list(COPY_COLUMNS)
+        )
+    except asyncpg.IntegrityConstraintViolationError as e:
+        raise IntegrityError("COPY handover_sessions", None, e) from e
+    except asyncpg.DataError as e:
+        raise DataError("COPY handover_sessions", None, e) from e
+    return len(records)
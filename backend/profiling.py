@@ -0,0 +1,337 @@
+"""
+Opt-in, token-protected profiling of live requests.
+
+With PROFILING_ENABLED=true and a PROFILING_TOKEN set, a request carrying
+``X-Profile: 1`` and a matching ``X-Profile-Token`` is profiled (pyinstrument
+when installed, otherwise cProfile) and its report is kept in a small rolling
+buffer; the response carries ``X-Profile-Id``. PROFILING_SAMPLE_EVERY=N also
+profiles one in every N API requests. At most one request is profiled at a
+time per worker, so the overhead is bounded however much traffic arrives.
+
+Only the event-loop thread is profiled: Gemini calls and PDF rendering run in
+worker threads and show up as wall time not covered by the profile.
+"""
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import sysconfig
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from fastapi import Header, HTTPException
+
+try:
+    import pyinstrument
+except ImportError:  # pragma: no cover - optional dependency
+    pyinstrument = None
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+# Profile one in every N API requests (0 = only on request)
+PROFILING_SAMPLE_EVERY = int(os.getenv("PROFILING_SAMPLE_EVERY", "0"))
+PROFILING_BUFFER_SIZE = int(os.getenv("PROFILING_BUFFER_SIZE", "50"))
+PROFILING_TOP_FUNCTIONS = int(os.getenv("PROFILING_TOP_FUNCTIONS", "40"))
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "1"))
+
+_DEBUG_PREFIX = "/api/debug/"
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+_STDLIB_DIR = sysconfig.get_paths()["stdlib"]
+
+
+def profiling_active() -> bool:
+    """Profiling needs both the flag and a token; without a token it stays off"""
+    return PROFILING_ENABLED and bool(PROFILING_TOKEN)
+
+
+def token_valid(token: Optional[str]) -> bool:
+    return bool(token) and hmac.compare_digest(token.encode("utf-8"), PROFILING_TOKEN.encode("utf-8"))
+
+
+def require_profiling_token(x_profile_token: Optional[str] = Header(default=None)):
+    """Dependency for the debug endpoints: 404 while profiling is off, 403 on a bad token"""
+    if not profiling_active():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token_valid(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Profile-Token")
+
+
+def _package_of(filename: str) -> str:
+    """Group profiled functions by library, stdlib module or application module"""
+    if filename.startswith(_BACKEND_DIR):
+        return "app." + os.path.splitext(os.path.basename(filename))[0]
+    for marker in ("site-packages" + os.sep, "dist-packages" + os.sep):
+        if marker in filename:
+            return os.path.splitext(filename.split(marker, 1)[1].split(os.sep, 1)[0])[0]
+    if filename.startswith(_STDLIB_DIR + os.sep):
+        module = os.path.relpath(filename, _STDLIB_DIR).split(os.sep, 1)[0]
+        return os.path.splitext(module)[0]
+    if filename.startswith("~") or filename.startswith("<"):
+        return "builtins"
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def _cprofile_report(profile: cProfile.Profile, top: int) -> str:
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+
+    by_package: Dict[str, float] = defaultdict(float)
+    for (filename, _, _), (_, _, own_time, _, _) in stats.stats.items():
+        by_package[_package_of(filename)] += own_time
+    stream.write("Own time by package (s):\n")
+    for package, seconds in sorted(by_package.items(), key=lambda item: -item[1])[:15]:
+        stream.write(f"  {seconds:10.4f}  {package}\n")
+    stream.write("\n")
+
+    stats.sort_stats("cumulative").print_stats(top)
+    return stream.getvalue()
+
+
+class _RequestProfiler:
+    """pyinstrument (async-aware) when available, otherwise cProfile"""
+
+    def __init__(self):
+        if pyinstrument is not None:
+            self.engine = "pyinstrument"
+            self._profiler = pyinstrument.Profiler(interval=0.001, async_mode="enabled")
+        else:
+            self.engine = "cProfile"
+            self._profiler = cProfile.Profile()
+
+    def start(self):
+        if self.engine == "pyinstrument":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if self.engine == "pyinstrument":
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def report(self, top: int) -> str:
+        if self.engine == "pyinstrument":
+            return self._profiler.output_text(unicode=True, show_all=False)
+        # cProfile also sees other requests interleaved on the event loop
+        return _cprofile_report(self._profiler, top)
+
+
+@dataclass
+class ProfileRecord:
+    id: str
+    method: str
+    path: str
+    trigger: str
+    engine: str
+    status: int
+    duration_ms: float
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    report: str = ""
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "engine": self.engine,
+            "status": self.status,
+            "durationMs": round(self.duration_ms, 1),
+            "createdAt": self.created_at.isoformat(),
+        }
+
+
+class ProfileStore:
+    """Rolling buffer of reports plus the one-profile-at-a-time guard"""
+
+    def __init__(self, max_records: int = PROFILING_BUFFER_SIZE):
+        self.records: Deque[ProfileRecord] = deque(maxlen=max_records)
+        self.busy = False
+        self.requests_seen = 0
+        self.counters: Dict[str, int] = {"captured": 0, "skipped_busy": 0, "rejected_token": 0}
+
+    def try_begin(self) -> bool:
+        if self.busy:
+            self.counters["skipped_busy"] += 1
+            return False
+        self.busy = True
+        return True
+
+    def finish(self, record: ProfileRecord):
+        self.busy = False
+        self.records.append(record)
+        self.counters["captured"] += 1
+
+    def get(self, profile_id: str) -> Optional[ProfileRecord]:
+        for record in self.records:
+            if record.id == profile_id:
+                return record
+        return None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "enabled": profiling_active(),
+            "engine": "pyinstrument" if pyinstrument is not None else "cProfile",
+            "sampleEvery": PROFILING_SAMPLE_EVERY,
+            "buffered": len(self.records),
+            "tracemalloc": tracemalloc.is_tracing(),
+            **self.counters,
+        }
+
+
+profile_store = ProfileStore()
+
+
+class ProfilingMiddleware:
+    """Profile requests asked for by header, or sampled one in PROFILING_SAMPLE_EVERY"""
+
+    def __init__(self, app, store: ProfileStore = profile_store):
+        self.app = app
+        self.store = store
+
+    def _trigger(self, scope) -> Optional[str]:
+        requested = token = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                requested = value.decode("latin-1").strip().lower() in ("1", "true")
+            elif name == b"x-profile-token":
+                token = value.decode("latin-1")
+        if requested:
+            if token_valid(token):
+                return "header"
+            self.store.counters["rejected_token"] += 1
+
+        path = scope.get("path", "")
+        if PROFILING_SAMPLE_EVERY > 0 and path.startswith("/api/") and not path.startswith(_DEBUG_PREFIX):
+            self.store.requests_seen += 1
+            if self.store.requests_seen % PROFILING_SAMPLE_EVERY == 0:
+                return "sample"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiling_active():
+            await self.app(scope, receive, send)
+            return
+
+        trigger = self._trigger(scope)
+        if trigger is None or not self.store.try_begin():
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+        status = 500
+
+        async def profiled_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {
+                    **message,
+                    "headers": list(message["headers"]) + [(b"x-profile-id", profile_id.encode("latin-1"))],
+                }
+            await send(message)
+
+        profiler = _RequestProfiler()
+        record = ProfileRecord(
+            id=profile_id, method=scope["method"], path=scope["path"],
+            trigger=trigger, engine=profiler.engine, status=status, duration_ms=0.0
+        )
+        started = time.perf_counter()
+        profiling = False
+        try:
+            # Inside the try: a profiler that fails to start (e.g. cProfile's "another
+            # profiler is active") must still release the busy flag through finish
+            try:
+                profiler.start()
+                profiling = True
+            except Exception as e:
+                record.report = f"Profiler failed to start: {e}"
+            try:
+                await self.app(scope, receive, profiled_send)
+            finally:
+                if profiling:
+                    profiler.stop()
+        finally:
+            record.duration_ms = (time.perf_counter() - started) * 1000
+            record.status = status
+            if profiling:
+                try:
+                    record.report = profiler.report(PROFILING_TOP_FUNCTIONS)
+                except Exception as e:
+                    record.report = f"Profile report failed: {e}"
+            self.store.finish(record)
+
+
+class AllocationTracker:
+    """tracemalloc snapshots, each diffed against the previous one"""
+
+    def __init__(self):
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    def stop(self):
+        with self._lock:
+            self._previous = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def snapshot(self, limit: int, frames: int = TRACEMALLOC_FRAMES) -> Dict[str, Any]:
+        """
+        Take a snapshot and return the top allocation sites and their growth
+        since the previous snapshot. The first call starts tracing and only
+        records the baseline. Blocking: call it from a worker thread.
+        """
+        with self._lock:
+            return self._snapshot(limit, frames)
+
+    def _snapshot(self, limit: int, frames: int) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._previous = None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        result: Dict[str, Any] = {
+            "tracing": True,
+            "tracedKb": round(current / 1024, 1),
+            "peakKb": round(peak / 1024, 1),
+            "baseline": self._previous is None,
+            "top": _format_stats(snapshot.statistics("lineno")[:limit]),
+        }
+        if self._previous is not None:
+            diff = snapshot.compare_to(self._previous, "lineno")
+            result["diff"] = _format_stats(diff[:limit])
+        self._previous = snapshot
+        return result
+
+
+def _format_stats(stats: List[Any]) -> List[Dict[str, Any]]:
+    formatted = []
+    for stat in stats:
+        frame = stat.traceback[0]
+        entry = {
+            "location": f"{frame.filename}:{frame.lineno}",
+            "sizeKb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        }
+        if isinstance(stat, tracemalloc.StatisticDiff):
+            entry["sizeDiffKb"] = round(stat.size_diff / 1024, 1)
+            entry["countDiff"] = stat.count_diff
+        formatted.append(entry)
+    return formatted
+
+
+allocation_tracker = AllocationTracker()
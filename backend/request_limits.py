@@ -0,0 +1,80 @@
+"""
+ASGI middleware that rejects oversized request bodies before they are parsed.
+
+The declared Content-Length is checked up front, and bodies streamed without
+one are counted chunk by chunk, so a too-large payload is refused without
+buffering or JSON-decoding it.
+"""
+
+import os
+from typing import Dict, Iterable, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+# Notes (1M chars, up to 4 bytes each in UTF-8) + 1MB trends + 1MB alarms + envelope
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(6_500_000)))
+
+_BODY_METHODS = {"POST", "PUT", "PATCH"}
+
+
+class RequestSizeLimitMiddleware:
+    """
+    Reject request bodies larger than max_body_bytes with 413. path_limits
+    overrides the limit for specific paths (e.g. file uploads).
+    """
+
+    def __init__(
+        self,
+        app,
+        max_body_bytes: int = MAX_REQUEST_BYTES,
+        exempt_paths: Iterable[str] = (),
+        path_limits: Optional[Dict[str, int]] = None
+    ):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.exempt_paths = frozenset(exempt_paths)
+        self.path_limits = dict(path_limits or {})
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in _BODY_METHODS
+            or scope["path"] in self.exempt_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        max_body_bytes = self.path_limits.get(scope["path"], self.max_body_bytes)
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > max_body_bytes:
+                    response = JSONResponse(
+                        status_code=413,
+                        content={"detail": f"Request body exceeds maximum size ({max_body_bytes} bytes)"}
+                    )
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_bytes:
+                    # FastAPI re-raises HTTPException from body parsing unchanged
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Request body exceeds maximum size ({max_body_bytes} bytes)"
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,74 @@
+"""
+Facts extracted from each handover for the recurring-issue and alarm rollups.
+
+Issues are keyed by their stable issue ID (see incremental.assign_issue_ids),
+so the same problem reported across shifts is counted as one recurring
+issue. Alarms come from the alarms input, keyed by tag, and are flagged as
+critical when the generated handover lists them under criticalAlarms.
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from incremental import alarm_key, iter_alarm_records, make_issue_id
+
+# Rollup text columns are truncated to this length
+MAX_FACT_TEXT = 500
+# Lengths of the fixed-width columns (HandoverIssueDB / HandoverAlarmDB); model
+# output is free text, and PostgreSQL rejects values longer than the column
+MAX_ISSUE_KEY = 64
+MAX_ISSUE_PRIORITY = 8
+MAX_ALARM_PRIORITY = 16
+# Window used by the analytics endpoints when no start date is given
+ANALYTICS_DEFAULT_DAYS = int(os.getenv("ANALYTICS_DEFAULT_DAYS", "30"))
+
+
+def extract_issue_facts(json_output: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One fact per open issue: key, text, priority, confidence"""
+    facts = []
+    for issue in json_output.get("openIssues") or []:
+        text = str(issue.get("issue", ""))
+        facts.append({
+            "issue_key": str(issue.get("id") or make_issue_id(text))[:MAX_ISSUE_KEY],
+            "issue": text[:MAX_FACT_TEXT],
+            "priority": str(issue.get("priority", "")).strip()[:MAX_ISSUE_PRIORITY],
+            "confidence": float(issue.get("confidence") or 0),
+        })
+    return facts
+
+
+def _mentions(text: str, token: str) -> bool:
+    """Whether text names token as a whole ID or tag: P-1 is not mentioned by "P-10" or "XP-1" """
+    pattern = r"(?<![\w.-])" + re.escape(token.lower()) + r"(?![\w-]|\.\w)"
+    return re.search(pattern, text) is not None
+
+
+def _unit_of(tag: str) -> str:
+    # Tags are "<unit>.<measurement>", e.g. "Reactor-B.Pressure"
+    return tag.split(".", 1)[0]
+
+
+def extract_alarm_facts(
+    alarms_json: Optional[Dict[str, Any]],
+    json_output: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """One fact per input alarm record: key, tag, unit, priority, critical flag"""
+    critical_text = " ".join(
+        str(alarm.get("alarm", "")) for alarm in json_output.get("criticalAlarms") or []
+    ).lower()
+
+    facts = []
+    for _, record in iter_alarm_records(alarms_json):
+        tag = str(record.get("tag") or "")
+        alarm_id = str(record.get("id") or "")
+        facts.append({
+            "alarm_key": alarm_key(record)[:MAX_FACT_TEXT],
+            "tag": tag[:MAX_FACT_TEXT],
+            "unit": _unit_of(tag)[:MAX_FACT_TEXT],
+            "priority": str(record.get("priority") or record.get("severity") or "").strip()[:MAX_ALARM_PRIORITY],
+            "critical": bool(critical_text) and any(
+                token and _mentions(critical_text, token) for token in (alarm_id, tag)
+            ),
+        })
+    return facts
@@ -1,7 +1,72 @@
 from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List, Dict, Any
 from enum import Enum
-import bleach
+import re
+import threading
+from bleach.sanitizer import Cleaner
+
+import fast_json
+
+
+# Notes beyond MAP_REDUCE_THRESHOLD_CHARS are summarized in chunks (see long_notes)
+MAX_SHIFT_NOTES_CHARS = 1_000_000
+MAX_TRENDS_CSV_CHARS = 1_000_000
+MAX_ALARMS_JSON_BYTES = 1_000_000
+MAX_ALARMS_JSON_DEPTH = 32
+
+# Characters that bleach would escape, strip or normalize. Text without any of
+# them comes back from bleach.clean unchanged, so it can skip the HTML parser.
+_NEEDS_SANITIZING = re.compile(r'[<>&\x00-\x08\x0b-\x1f]')
+
+# bleach Cleaner instances are not thread-safe, so share one per thread
+_sanitizer_local = threading.local()
+
+
+def _get_sanitizer() -> Cleaner:
+    cleaner = getattr(_sanitizer_local, "cleaner", None)
+    if cleaner is None:
+        cleaner = Cleaner(tags=[], strip=True)
+        _sanitizer_local.cleaner = cleaner
+    return cleaner
+
+
+def sanitize_text(text: str) -> str:
+    """Strip all HTML from text, skipping the parser when there is nothing to strip"""
+    if not _NEEDS_SANITIZING.search(text):
+        return text
+    return _get_sanitizer().clean(text)
+
+
+def check_json_bounds(value: Any, max_bytes: int, max_depth: int) -> None:
+    """
+    Walk a parsed JSON value and raise ValueError as soon as its approximate
+    serialized size or nesting depth exceeds the given limits.
+    """
+    budget = max_bytes
+    stack = [(value, 1)]
+
+    while stack:
+        item, depth = stack.pop()
+        if depth > max_depth:
+            raise ValueError(f'Alarms JSON exceeds maximum nesting depth ({max_depth})')
+
+        if isinstance(item, dict):
+            budget -= 2
+            for key, child in item.items():
+                budget -= len(key) + 4
+                stack.append((child, depth + 1))
+        elif isinstance(item, list):
+            budget -= 2
+            for child in item:
+                budget -= 1
+                stack.append((child, depth + 1))
+        elif isinstance(item, str):
+            budget -= len(item) + 2
+        else:
+            budget -= 8
+
+        if budget < 0:
+            raise ValueError(f'Alarms JSON exceeds maximum size ({max_bytes // 1_000_000}MB)')
 
 
 class PriorityLevel(str, Enum):
@@ -16,6 +81,7 @@ class CriticalAlarm(BaseModel):
 
 
 class OpenIssue(BaseModel):
+    id: Optional[str] = Field(default=None, description="Stable issue identifier carried across shifts")
     issue: str
     priority: PriorityLevel
     confidence: float = Field(ge=0, le=100, description="Confidence percentage 0-100")
@@ -29,12 +95,31 @@ class HandoverStructured(BaseModel):
     recommendedActions: List[str]
     questions: List[str]
 
+    @classmethod
+    def from_trusted(cls, data: Dict[str, Any]) -> "HandoverStructured":
+        """
+        Build from data that was already validated when it was written,
+        skipping Pydantic validation (e.g. rows read back from the database).
+        """
+        return cls.model_construct(
+            shiftSummary=data.get('shiftSummary', []),
+            criticalAlarms=[CriticalAlarm.model_construct(**a) for a in data.get('criticalAlarms', [])],
+            openIssues=[OpenIssue.model_construct(**i) for i in data.get('openIssues', [])],
+            recommendedActions=data.get('recommendedActions', []),
+            questions=data.get('questions', [])
+        )
+
 
 class HandoverRequest(BaseModel):
     """Request payload for handover generation"""
-    shiftNotes: str = Field(min_length=10, max_length=50000, description="Shift handover notes from operator")
+    shiftNotes: str = Field(min_length=10, max_length=MAX_SHIFT_NOTES_CHARS, description="Shift handover notes from operator")
     alarmsJson: Optional[Dict[str, Any]] = None
-    trendsCsv: Optional[str] = Field(default=None, max_length=1000000)
+    trendsCsv: Optional[str] = Field(default=None, max_length=MAX_TRENDS_CSV_CHARS)
+    previousSessionId: Optional[str] = Field(
+        default=None,
+        max_length=64,
+        description="Session ID of the previous shift's handover; enables incremental generation"
+    )
 
     @field_validator('shiftNotes')
     @classmethod
@@ -42,14 +127,13 @@ class HandoverRequest(BaseModel):
         if not v or not v.strip():
             raise ValueError('Shift notes cannot be empty')
         # Sanitize input to prevent XSS
-        cleaned = bleach.clean(v.strip(), tags=[], strip=True)
-        return cleaned
+        return sanitize_text(v.strip())
 
     @field_validator('alarmsJson')
     @classmethod
     def validate_alarms_size(cls, v: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
-        if v and len(str(v)) > 1_000_000:  # 1MB limit
-            raise ValueError('Alarms JSON exceeds maximum size (1MB)')
+        if v:
+            check_json_bounds(v, MAX_ALARMS_JSON_BYTES, MAX_ALARMS_JSON_DEPTH)
         return v
 
 
@@ -60,6 +144,25 @@ class HandoverResponse(BaseModel):
     sessionId: Optional[str] = None
 
 
+def encode_handover_response(markdown: str, json_output: str, session_id: Optional[str]) -> bytes:
+    """
+    Serialize a HandoverResponse body from stored parts.
+
+    json_output is the JSON text saved at write time, where it was already
+    validated against HandoverStructured, so it is spliced in verbatim instead
+    of being parsed, revalidated and re-encoded.
+    """
+    return b"".join((
+        b'{"markdown":',
+        fast_json.dumps_bytes(markdown),
+        b',"json":',
+        json_output.encode("utf-8"),
+        b',"sessionId":',
+        fast_json.dumps_bytes(session_id),
+        b"}"
+    ))
+
+
 class ErrorResponse(BaseModel):
     """Standard error response"""
     error: str
@@ -0,0 +1,70 @@
+"""
+Single-flight deduplication of concurrent identical work.
+
+The first caller for a key starts the work as its own task; callers arriving
+while it is still running await the same task instead of starting another.
+The work is shielded, so it completes for the remaining callers even if the
+caller that started it disconnects.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._metrics = {
+            "leaders": 0,
+            "coalesced": 0,
+            "max_waiters": 0,
+        }
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run fn() once per key at a time.
+
+        Returns (result, shared) where shared is True for callers that joined
+        an execution started by another caller. Exceptions propagate to all.
+        """
+        call = self._calls.get(key)
+        shared = call is not None
+
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            self._metrics["leaders"] += 1
+            call.task.add_done_callback(lambda task: self._finish(key, call))
+        else:
+            self._metrics["coalesced"] += 1
+
+        call.waiters += 1
+        self._metrics["max_waiters"] = max(self._metrics["max_waiters"], call.waiters)
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+
+    def _finish(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Mark the exception as retrieved when every caller has gone away
+        if not call.task.cancelled():
+            call.task.exception()
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            **self._metrics,
+            "in_flight": len(self._calls),
+            "callers_waiting": sum(call.waiters for call in self._calls.values()),
+        }
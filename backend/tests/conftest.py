@@ -0,0 +1,42 @@
+"""
+Test setup: run against a throwaway SQLite database.
+
+Settings are read at import time, so they are set here before any backend
+module is imported.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+_TMP_DIR = tempfile.mkdtemp(prefix="shift-handover-tests-")
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_TMP_DIR}/handover.db"
+os.environ["WRITE_BEHIND_JOURNAL_DIR"] = os.path.join(_TMP_DIR, "write-behind")
+os.environ["MAINTENANCE_LOCK_FILE"] = os.path.join(_TMP_DIR, ".maintenance.lock")
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def run():
+    """
+    Run a coroutine on one event loop shared by the whole session (the
+    database engine's pooled connections belong to the loop that opened them).
+    """
+    loop = asyncio.new_event_loop()
+
+    async def setup():
+        from database import init_db
+        await init_db()
+
+    loop.run_until_complete(setup())
+    yield loop.run_until_complete
+
+    from database import engine
+    loop.run_until_complete(engine.dispose())
+    loop.close()
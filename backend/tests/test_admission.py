@@ -0,0 +1,22 @@
+from admission import _client_key, _key_digest
+
+
+def _scope(*headers, client=("203.0.113.7", 50000)):
+    return {"headers": [(name.encode(), value.encode()) for name, value in headers], "client": client}
+
+
+def test_allowed_api_key_gets_its_own_bucket():
+    allowed = frozenset({_key_digest(b"team-a")})
+    key = _client_key(_scope(("x-api-key", "team-a")), allowed)
+    assert key == "key:" + _key_digest(b"team-a")
+    assert "team-a" not in key
+
+
+def test_unknown_api_keys_fall_back_to_client_ip():
+    allowed = frozenset({_key_digest(b"team-a")})
+    keys = {_client_key(_scope(("x-api-key", f"random-{i}")), allowed) for i in range(5)}
+    assert keys == {"ip:203.0.113.7"}
+
+
+def test_no_api_keys_configured():
+    assert _client_key(_scope(("x-api-key", "team-a")), frozenset()) == "ip:203.0.113.7"
@@ -0,0 +1,118 @@
+import pytest
+
+from alarm_context import (
+    TagIndex,
+    _is_active,
+    _is_high_limit,
+    describe_alarm,
+    slope_before,
+    time_beyond,
+    value_at
+)
+from gemini_client import GeminiClient
+from trend_series import TIME_BASE_TIME_OF_DAY, TrendSeries, parse_trend_series
+
+TRENDS_CSV = """timestamp,tag,value,unit
+06:00,FIC-101,100,m3/h
+06:10,FIC-101,110,m3/h
+06:20,FIC-101,130,m3/h
+06:30,FIC-101,140,m3/h
+06:00,B201_DO,4.0,mg/L
+06:30,B201_DO,1.5,mg/L
+"""
+
+
+def _series(times, values):
+    return TrendSeries("T-1", None, [float(t) for t in times], [float(v) for v in values], TIME_BASE_TIME_OF_DAY)
+
+
+@pytest.mark.parametrize("status, active", [
+    ("Active", True),
+    ("Unresolved", True),
+    ("Not cleared", True),
+    ("Abnormal", True),
+    ("unacknowledged", True),
+    ("Cleared", False),
+    ("RESOLVED", False),
+    ("Returned to normal", False),
+    ("RTN", False),
+    ("inactive", False),
+])
+def test_status_words(status, active):
+    assert _is_active("alarms", {"status": status}) is active
+
+
+@pytest.mark.parametrize("section, active", [
+    ("activeAlarms", True),
+    ("unresolved_alarms", True),
+    ("clearedAlarms", False),
+    ("resolved_alarms", False),
+])
+def test_section_names(section, active):
+    assert _is_active(section, {}) is active
+
+
+def test_lookup_by_tag_id_and_id_without_limit_suffix():
+    index = TagIndex(parse_trend_series(TRENDS_CSV))
+    assert index.lookup({"tag": "fic-101"}).tag == "FIC-101"
+    assert index.lookup({"id": "FIC_101"}).tag == "FIC-101"
+    assert index.lookup({"id": "B201-DO-LO"}).tag == "B201_DO"
+    assert index.lookup({"id": "TI-999-HI"}) is None
+
+
+def test_value_at_interpolates_and_clamps():
+    entry = _series([0, 60, 120], [10, 20, 20])
+    assert value_at(entry, 30) == 15
+    assert value_at(entry, -10) == 10
+    assert value_at(entry, 500) == 20
+
+
+def test_time_beyond_interpolates_crossings():
+    entry = _series([0, 60, 120], [0, 20, 0])
+    assert time_beyond(entry, 10, above=True) == 60
+    assert time_beyond(entry, 10, above=False) == 60
+    assert time_beyond(entry, 30, above=True) == 0
+
+
+def test_slope_before_uses_only_the_window():
+    entry = _series([0, 60, 120, 180], [100, 0, 10, 20])
+    assert slope_before(entry, 180, 120) == pytest.approx(10)
+    assert slope_before(entry, 0, 120) is None
+
+
+@pytest.mark.parametrize("alarm, high", [
+    ({"id": "FIC-101-HI", "description": "High flow on feed line"}, True),
+    ({"id": "FIC-101", "description": "High flow on feed line"}, True),
+    ({"id": "FIC-101", "description": "Feed flow low"}, False),
+    ({"id": "B201-DO-LO", "description": "Dissolved oxygen"}, False),
+    ({"id": "LI-7-LL", "description": "High level trip bypassed"}, False),
+    ({"id": "TI-3", "description": "Below normal"}, True),
+])
+def test_limit_direction(alarm, high):
+    assert _is_high_limit(alarm) is high
+
+
+def test_high_flow_alarm_is_described_as_a_high_limit():
+    entry = parse_trend_series(TRENDS_CSV)["FIC-101"]
+    line = describe_alarm(
+        {"id": "FIC-101-HI", "description": "High flow on feed line", "setpoint": 120, "timestamp": "06:20"},
+        entry
+    )
+    assert line.startswith("FIC-101-HI (FIC-101):")
+    assert "value at alarm 130 m3/h" in line
+    assert "setpoint 120 m3/h (high limit)" in line
+    assert "15 min above setpoint" in line
+    assert "latest 140 m3/h" in line
+
+
+def test_prompt_gets_correlation_block_for_active_alarms_only():
+    client = GeminiClient.__new__(GeminiClient)
+    alarms = {"activeAlarms": [{"id": "FIC-101-HI", "setpoint": 120, "timestamp": "06:20"}],
+              "clearedAlarms": [{"id": "B201-DO-LO", "setpoint": 2}]}
+    prompt = client._build_prompt("Feed flow rising all shift.", alarms, TRENDS_CSV)
+    header = "=== ALARM-TREND CORRELATION (computed from trend data) ==="
+    assert header in prompt
+    block = prompt.split(header, 1)[1].split("===", 1)[0]
+    assert "FIC-101-HI (FIC-101)" in block and "B201" not in block
+
+    assert header not in client._build_prompt("Quiet shift, nothing to report.", alarms, None)
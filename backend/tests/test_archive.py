@@ -0,0 +1,95 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import maintenance
+from database import (
+    ArchiveBlockDB,
+    async_session_maker,
+    bulk_save_handover_sessions,
+    get_handover_session,
+    stream_handover_sessions
+)
+
+
+def _row(created_at: datetime) -> dict:
+    session_id = str(uuid.uuid4())
+    return {
+        "session_id": session_id,
+        "shift_notes": f"notes {session_id}",
+        "alarms_json": None,
+        "trends_csv": None,
+        "markdown_output": "# Report",
+        "json_output": {"shiftSummary": [session_id]},
+        "created_at": created_at,
+    }
+
+
+def test_archived_sessions_stay_readable_and_exported(run, monkeypatch):
+    monkeypatch.setattr(maintenance, "ARCHIVE_AFTER_DAYS", 180)
+    monkeypatch.setattr(maintenance.archive, "ARCHIVE_BLOCK_ROWS", 2)
+    window_start = datetime(2001, 1, 1)
+    old = [_row(window_start + timedelta(days=day)) for day in (0, 1, 2, 40, 41)]
+    recent = [_row(datetime.utcnow() - timedelta(days=1))]
+
+    async def scenario():
+        async with async_session_maker() as session:
+            await bulk_save_handover_sessions(session, old + recent)
+        archived = await maintenance.archive_old_sessions()
+
+        async with async_session_maker() as session:
+            blocks = (await session.execute(
+                ArchiveBlockDB.__table__.select().where(ArchiveBlockDB.archive_month.in_(["2001-01", "2001-02"]))
+            )).all()
+            fetched = await get_handover_session(session, old[3]["session_id"])
+            current = await get_handover_session(session, recent[0]["session_id"])
+
+        exported = []
+        async for batch in stream_handover_sessions(window_start, None):
+            exported.extend(batch)
+        return archived, blocks, fetched, current, exported
+
+    archived, blocks, fetched, current, exported = run(scenario())
+
+    assert archived >= len(old)
+    # Two months, blocks of at most two rows
+    assert sorted(block.row_count for block in blocks) == [1, 2, 2]
+    assert fetched.shift_notes == old[3]["shift_notes"]
+    assert fetched.created_at == old[3]["created_at"]
+    assert current is not None
+
+    ids = [session_id for session_id, _, _ in exported]
+    assert ids[:len(old)] == [row["session_id"] for row in old]
+    assert recent[0]["session_id"] in ids
+    created = [created_at for _, created_at, _ in exported]
+    assert created == sorted(created)
+
+
+def test_export_accepts_mixed_naive_and_aware_bounds(run):
+    from main import export_handovers
+
+    row = _row(datetime(2002, 3, 1, 10, 0))
+    plus_two = timezone(timedelta(hours=2))
+
+    async def scenario():
+        async with async_session_maker() as session:
+            await bulk_save_handover_sessions(session, [row])
+
+        # 11:00+02:00 is 09:00 UTC, after a naive 08:00 end
+        with pytest.raises(HTTPException) as exc:
+            await export_handovers(
+                start=datetime(2002, 3, 1, 11, 0, tzinfo=plus_two), end=datetime(2002, 3, 1, 8, 0),
+                format="ndjson", batch_size=100
+            )
+        assert exc.value.status_code == 400
+
+        response = await export_handovers(
+            start=datetime(2002, 3, 1, 11, 0, tzinfo=plus_two), end=datetime(2002, 3, 1, 10, 30),
+            format="ndjson", batch_size=100
+        )
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    body = run(scenario())
+    assert row["session_id"].encode() in body
@@ -0,0 +1,35 @@
+import asyncio
+
+from compression import CompressionMiddleware, merge_vary
+
+
+def test_merge_vary_keeps_existing_fields():
+    assert merge_vary([]) == b"Accept-Encoding"
+    assert merge_vary([b"Origin"]) == b"Origin, Accept-Encoding"
+    assert merge_vary([b"Origin, accept-encoding"]) == b"Origin, accept-encoding"
+    assert merge_vary([b"Origin", b"Cookie"]) == b"Origin, Cookie, Accept-Encoding"
+    assert merge_vary([b"*"]) == b"*"
+
+
+def test_compressed_response_merges_vary_header():
+    body = b"x" * 4096
+
+    async def app(scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain"), (b"vary", b"Origin")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(app, minimum_size=1024)(scope, None, send))
+
+    headers = dict(messages[0]["headers"])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"vary"] == b"Origin, Accept-Encoding"
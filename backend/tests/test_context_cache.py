@@ -0,0 +1,171 @@
+from types import SimpleNamespace
+
+import pytest
+from google.genai import errors
+
+import context_cache
+from context_cache import ContextCacheManager, TokenUsage
+from gemini_client import GeminiClient
+
+INSTRUCTION = "x" * (context_cache.CONTEXT_CACHE_MIN_TOKENS * 4)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _StubCaches:
+    def __init__(self):
+        self.created = 0
+        self.updated = []
+        self.during_call = None  # Runs inside each API call
+
+    def create(self, model, contents, config):
+        if self.during_call:
+            self.during_call()
+        self.created += 1
+        return SimpleNamespace(name=f"cachedContents/{self.created}")
+
+    def update(self, name, config):
+        if self.during_call:
+            self.during_call()
+        self.updated.append(name)
+
+
+def _manager(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(context_cache.time, "monotonic", clock)
+    caches = _StubCaches()
+    return ContextCacheManager(SimpleNamespace(caches=caches), "test-model"), caches, clock
+
+
+def test_create_refresh_and_recreate(monkeypatch):
+    manager, caches, clock = _manager(monkeypatch)
+
+    assert manager.cache_name("handover", INSTRUCTION) == "cachedContents/1"
+    assert manager.cache_name("handover", INSTRUCTION) == "cachedContents/1"
+    assert caches.created == 1
+
+    # Close to expiry the TTL is extended rather than a new cache created
+    clock.now += context_cache.CONTEXT_CACHE_TTL_SECONDS - context_cache.CONTEXT_CACHE_REFRESH_SECONDS + 1
+    assert manager.cache_name("handover", INSTRUCTION) == "cachedContents/1"
+    assert caches.updated == ["cachedContents/1"]
+
+    # A 404 from generate_content invalidates the handle; the next call recreates it
+    manager.invalidate("handover")
+    assert manager.cache_name("handover", INSTRUCTION) == "cachedContents/2"
+    assert manager.counters == {"created": 2, "refreshed": 1, "recreated": 1, "create_failed": 0}
+
+
+def test_api_calls_run_outside_the_lock(monkeypatch):
+    manager, caches, clock = _manager(monkeypatch)
+    seen = []
+
+    def concurrent_caller():
+        seen.append(manager._lock.locked())
+        # Another thread asking meanwhile is not blocked and does not start a second create
+        seen.append(manager.cache_name("handover", INSTRUCTION))
+
+    caches.during_call = concurrent_caller
+    assert manager.cache_name("handover", INSTRUCTION) == "cachedContents/1"
+    assert seen == [False, None]
+
+    # During a refresh the current handle stays usable
+    seen.clear()
+    clock.now += context_cache.CONTEXT_CACHE_TTL_SECONDS - context_cache.CONTEXT_CACHE_REFRESH_SECONDS + 1
+    assert manager.cache_name("handover", INSTRUCTION) == "cachedContents/1"
+    assert seen == [False, "cachedContents/1"]
+    assert caches.created == 1
+
+
+class _StubModels:
+    """generate_content that can reject calls made through a cache"""
+
+    def __init__(self, reject_cache_with=None):
+        self.calls = []
+        self.reject_cache_with = reject_cache_with
+
+    def generate_content(self, model, contents, config):
+        self.calls.append(config)
+        if config.cached_content and self.reject_cache_with:
+            raise errors.ClientError(
+                self.reject_cache_with,
+                SimpleNamespace(body_segments=[{"error": {"message": "cache rejected", "status": "NOT_FOUND"}}])
+            )
+        cached = 900 if config.cached_content else 0
+        return SimpleNamespace(usage_metadata=SimpleNamespace(
+            prompt_token_count=1000, cached_content_token_count=cached, candidates_token_count=50
+        ))
+
+
+def _gemini(monkeypatch, models):
+    monkeypatch.setattr(context_cache.time, "monotonic", _Clock())
+    client = SimpleNamespace(models=models, caches=_StubCaches())
+    gemini = GeminiClient.__new__(GeminiClient)
+    gemini.client = client
+    gemini.model_name = "test-model"
+    gemini.context_cache = ContextCacheManager(client, "test-model")
+    gemini.token_usage = TokenUsage()
+    return gemini
+
+
+def test_generate_uses_the_explicit_cache(monkeypatch):
+    models = _StubModels()
+    gemini = _gemini(monkeypatch, models)
+
+    gemini._generate("handover", INSTRUCTION, "notes")
+    gemini._generate("handover", INSTRUCTION, "more notes")
+
+    assert [config.cached_content for config in models.calls] == ["cachedContents/1"] * 2
+    assert all(config.system_instruction is None for config in models.calls)
+    tokens = gemini.usage_metrics()["tokens"]["handover"]
+    assert tokens["calls"] == 2
+    assert tokens["explicitCacheCalls"] == 2
+    assert tokens["cachedTokens"] == 1800
+    assert tokens["uncachedTokens"] == 200
+    assert tokens["outputTokens"] == 100
+
+
+@pytest.mark.parametrize("code", [400, 403, 404])
+def test_generate_falls_back_inline_when_the_cache_is_rejected(monkeypatch, code):
+    models = _StubModels(reject_cache_with=code)
+    gemini = _gemini(monkeypatch, models)
+
+    gemini._generate("handover", INSTRUCTION, "notes")
+
+    assert [config.cached_content for config in models.calls] == ["cachedContents/1", None]
+    assert models.calls[1].system_instruction == INSTRUCTION
+    tokens = gemini.usage_metrics()["tokens"]["handover"]
+    assert tokens["calls"] == 1
+    assert tokens["explicitCacheCalls"] == 0
+    assert tokens["cachedTokens"] == 0
+    assert tokens["uncachedTokens"] == 1000
+
+    # The rejected handle is dropped and recreated on the next call
+    models.reject_cache_with = None
+    gemini._generate("handover", INSTRUCTION, "notes")
+    assert models.calls[-1].cached_content == "cachedContents/2"
+
+
+def test_other_client_errors_are_not_retried(monkeypatch):
+    models = _StubModels(reject_cache_with=429)
+    gemini = _gemini(monkeypatch, models)
+
+    with pytest.raises(errors.ClientError):
+        gemini._generate("handover", INSTRUCTION, "notes")
+    assert len(models.calls) == 1
+
+
+def test_short_instructions_are_sent_inline(monkeypatch):
+    models = _StubModels()
+    gemini = _gemini(monkeypatch, models)
+
+    gemini._generate("summary", "short", "notes")
+
+    assert models.calls[0].cached_content is None
+    assert models.calls[0].system_instruction == "short"
+    assert gemini.client.caches.created == 0
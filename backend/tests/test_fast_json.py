@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+import fast_json
+from handover_cache import request_fingerprint
+
+WIDE = 2 ** 70
+
+
+@pytest.mark.parametrize("dump", [fast_json.dumps, fast_json.dumps_pretty])
+def test_integers_wider_than_64_bits_serialize(dump):
+    text = dump({"alarmId": WIDE, "count": 3})
+    assert json.loads(text) == {"alarmId": WIDE, "count": 3}
+
+
+def test_wide_integers_in_canonical_and_byte_output():
+    assert fast_json.dumps_canonical({"b": WIDE, "a": 1}) == b'{"a":1,"b":1180591620717411303424}'
+    assert json.loads(fast_json.dumps_bytes([WIDE])) == [WIDE]
+
+
+def test_request_fingerprint_accepts_wide_integers():
+    alarms = {"alarms": [{"id": "TI-101", "raw": WIDE}]}
+    assert request_fingerprint("notes", alarms, None) == request_fingerprint("notes", alarms, None)
+
+
+def test_loads_accepts_wide_integers():
+    # Exact with the standard library; orjson releases that parse it at all give a float
+    assert fast_json.loads(f'{{"raw": {WIDE}}}')["raw"] == pytest.approx(WIDE)
+
+
+def test_invalid_json_still_raises():
+    with pytest.raises(fast_json.JSONDecodeError):
+        fast_json.loads("{not json")
+    with pytest.raises(TypeError):
+        fast_json.dumps({"value": object()})
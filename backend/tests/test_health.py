@@ -0,0 +1,13 @@
+import database
+from health import HealthMonitor
+
+
+class _ExhaustedEngine:
+    def connect(self):
+        raise TimeoutError("QueuePool limit reached, connection timed out")
+
+
+def test_database_check_does_not_use_the_request_pool(run, monkeypatch):
+    monkeypatch.setattr(database, "engine", _ExhaustedEngine())
+    result = run(HealthMonitor()._check_database())
+    assert result["status"] == "ok"
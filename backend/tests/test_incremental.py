@@ -0,0 +1,64 @@
+import uuid
+
+from generation import generate_and_save
+from incremental import assign_issue_ids, make_issue_id
+from schemas import HandoverRequest
+
+
+def _handover(issue: str, issue_id=None) -> dict:
+    return {
+        "shiftSummary": ["Unit running"],
+        "criticalAlarms": [],
+        "openIssues": [{"id": issue_id, "issue": issue, "priority": "High", "confidence": 80}],
+        "recommendedActions": [],
+        "questions": [],
+    }
+
+
+class _ShiftClient:
+    """Returns the next wording of the same issue each shift, echoing the id it was given"""
+
+    def __init__(self, wordings):
+        self.wordings = list(wordings)
+        self.previous_handovers = []
+
+    def generate_handover(self, shift_notes, alarms_json, trends_csv, trend_summary=None):
+        return "# Shift", _handover(self.wordings.pop(0))
+
+    def generate_incremental_handover(self, previous_handover, shift_notes, alarms_delta,
+                                      trends_delta_csv, trend_summary=None):
+        self.previous_handovers.append(previous_handover)
+        carried = previous_handover["openIssues"][0]["id"]
+        return "# Shift", _handover(self.wordings.pop(0), carried)
+
+
+def test_issue_id_survives_rewording_across_three_shifts(run):
+    client = _ShiftClient([
+        "Pump P-101 seal leak",
+        "Pump P-101 seal leak worsening, drips every few seconds",
+        "P-101 mechanical seal now leaking steadily",
+    ])
+
+    async def scenario():
+        ids, previous = [], None
+        for shift in range(3):
+            request = HandoverRequest(
+                shiftNotes=f"Shift {shift}: pump P-101 seal still leaking {uuid.uuid4()}",
+                previousSessionId=previous,
+            )
+            result = await generate_and_save(request, client, fingerprint=str(uuid.uuid4()))
+            ids.append(result.response.json.openIssues[0].id)
+            previous = result.response.sessionId
+        return ids
+
+    ids = run(scenario())
+    assert ids == [make_issue_id("Pump P-101 seal leak")] * 3
+    # The third shift's prompt sees the stored id, not one re-hashed from shift 2's wording
+    assert [prev["openIssues"][0]["id"] for prev in client.previous_handovers] == ids[:2]
+
+
+def test_keep_existing_only_fills_missing_ids():
+    stored = {"openIssues": [{"id": "ISS-00000001", "issue": "Reworded leak"}, {"issue": "New trip"}]}
+    assign_issue_ids(stored, keep_existing=True)
+    assert stored["openIssues"][0]["id"] == "ISS-00000001"
+    assert stored["openIssues"][1]["id"] == make_issue_id("New trip")
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+
+import long_notes
+from admission import ConcurrencyLimiter, admission_controller
+
+
+class _ChunkClient:
+    """Records how many chunk summaries run at once"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def summarize_notes_chunk(self, chunk: str) -> str:
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.02)
+        with self._lock:
+            self.active -= 1
+        if chunk == "bad":
+            raise ValueError("model error")
+        return chunk.upper()
+
+
+def _run(limiter: ConcurrencyLimiter, held_slots: int, chunks, monkeypatch):
+    monkeypatch.setattr(admission_controller, "concurrency", limiter)
+    monkeypatch.setattr(long_notes, "MAP_REDUCE_CONCURRENCY", 4)
+    client = _ChunkClient()
+
+    async def scenario():
+        for _ in range(held_slots):
+            assert await limiter.acquire() is None
+        results = await long_notes._summarize_chunks(client, chunks)
+        return results, limiter.in_flight
+
+    results, in_flight_after = asyncio.run(scenario())
+    return client, results, in_flight_after
+
+
+def test_chunks_borrow_only_free_admission_slots(monkeypatch):
+    # One slot held by the request itself, two free: three chunk calls at a time
+    limiter = ConcurrencyLimiter(max_in_flight=3, max_queued=0, latency_budget=1)
+    client, results, in_flight_after = _run(limiter, 1, [f"c{i}" for i in range(8)], monkeypatch)
+    assert client.peak == 3
+    assert results == [f"C{i}" for i in range(8)]
+    assert in_flight_after == 1
+
+
+def test_chunks_run_sequentially_when_admission_is_full(monkeypatch):
+    limiter = ConcurrencyLimiter(max_in_flight=2, max_queued=0, latency_budget=1)
+    client, results, in_flight_after = _run(limiter, 2, ["a", "bad", "c"], monkeypatch)
+    assert client.peak == 1
+    assert results[0] == "A" and isinstance(results[1], ValueError) and results[2] == "C"
+    assert in_flight_after == 2
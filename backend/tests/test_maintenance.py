@@ -0,0 +1,41 @@
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import maintenance
+
+
+def _compact(tmp_path, monkeypatch, convert: bool):
+    monkeypatch.setattr(maintenance, "MAINTENANCE_CONVERT_AUTO_VACUUM", convert)
+
+    async def scenario():
+        # A file from before incremental auto_vacuum, with free pages to reclaim
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/old.db")
+        async with engine.begin() as conn:
+            await conn.execute(text("CREATE TABLE filler (data BLOB)"))
+            await conn.execute(text("INSERT INTO filler SELECT randomblob(4096) FROM (SELECT 1 UNION SELECT 2)"))
+            await conn.execute(text("DELETE FROM filler"))
+        monkeypatch.setattr(maintenance, "engine", engine)
+        try:
+            result = await maintenance.compact_database(analyze=False)
+            async with engine.connect() as conn:
+                mode = (await conn.execute(text("PRAGMA auto_vacuum"))).scalar()
+        finally:
+            await engine.dispose()
+        return result, mode
+
+    return asyncio.run(scenario())
+
+
+def test_old_sqlite_file_is_not_rewritten_by_default(tmp_path, monkeypatch):
+    result, mode = _compact(tmp_path, monkeypatch, convert=False)
+    assert mode == 0
+    assert result["incremental_auto_vacuum"] is False
+    assert result["pages_reclaimed"] == 0
+
+
+def test_conversion_runs_when_opted_in(tmp_path, monkeypatch):
+    result, mode = _compact(tmp_path, monkeypatch, convert=True)
+    assert mode == 2
+    assert result["incremental_auto_vacuum"] is True
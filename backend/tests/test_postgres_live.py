@@ -0,0 +1,214 @@
+"""
+Tests against a real PostgreSQL server, skipped unless TEST_POSTGRES_URL
+(postgresql+asyncpg://...) is set. Each test runs in a schema of its own,
+dropped afterwards.
+"""
+
+import asyncio
+import copy
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import database
+import fast_json
+import maintenance
+import postgres
+
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL", "")
+
+pytestmark = pytest.mark.skipif(
+    not TEST_POSTGRES_URL.startswith("postgresql+asyncpg://"),
+    reason="set TEST_POSTGRES_URL to a postgresql+asyncpg:// database"
+)
+
+
+def _run_in_schema(scenario):
+    schema = f"handover_test_{uuid.uuid4().hex[:12]}"
+    options = copy.deepcopy(database._engine_options(True))
+    options["connect_args"]["server_settings"]["search_path"] = schema
+
+    async def main():
+        engine = create_async_engine(TEST_POSTGRES_URL, **options)
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"CREATE SCHEMA {schema}"))
+            return await scenario(engine)
+        finally:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+def _record(created_at: datetime, session_id=None) -> dict:
+    """A COPY row as database.bulk_save_handover_sessions builds it (JSON as text)"""
+    return {
+        "session_id": session_id or str(uuid.uuid4()),
+        "shift_notes": "notes",
+        "alarms_json": fast_json.dumps({"activeAlarms": [{"tag": "FIC-101"}]}),
+        "trends_csv": None,
+        "markdown_output": "# Report",
+        "json_output": fast_json.dumps({"openIssues": [{"issue": "Seal leak", "priority": "High"}]}),
+        "previous_session_id": None,
+        "request_hash": None,
+        "similarity_signature": None,
+        "created_at": created_at,
+        "response_body": None,
+        "response_encoding": None,
+    }
+
+
+def _next_month(now: datetime) -> datetime:
+    start = postgres._month_start(now.year, now.month + 1)
+    return datetime(start.year, start.month, start.day, 1, 0)
+
+
+async def _partitions(conn) -> dict:
+    result = await conn.execute(text("SELECT session_id, tableoid::regclass::text FROM handover_sessions"))
+    return {session_id: table.split(".")[-1] for session_id, table in result.all()}
+
+
+def test_copy_routes_rows_into_monthly_partitions():
+    now = datetime.utcnow()
+    rows = [_record(now), _record(_next_month(now))]
+
+    async def scenario(engine):
+        async with engine.begin() as conn:
+            await postgres.create_schema(conn)
+            assert await postgres.copy_sessions(conn, rows) == 2
+            return await _partitions(conn)
+
+    partitions = _run_in_schema(scenario)
+    assert partitions[rows[0]["session_id"]] == postgres.partition_name(now.date())
+    assert partitions[rows[1]["session_id"]] == postgres.partition_name(_next_month(now).date())
+
+
+def test_session_id_is_unique_across_partitions():
+    now = datetime.utcnow()
+    first = _record(now)
+    duplicate = _record(_next_month(now), session_id=first["session_id"])
+
+    async def scenario(engine):
+        async with engine.begin() as conn:
+            await postgres.create_schema(conn)
+            await postgres.copy_sessions(conn, [first])
+        with pytest.raises(IntegrityError):
+            async with engine.begin() as conn:
+                await postgres.copy_sessions(conn, [duplicate])
+        with pytest.raises(IntegrityError):
+            async with engine.begin() as conn:
+                await conn.execute(insert(database.HandoverSessionDB).values(
+                    session_id=first["session_id"], shift_notes="n", markdown_output="# R",
+                    json_output="{}", created_at=_next_month(now)
+                ))
+        # Deleting a session (archival, pruning) frees its id
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("DELETE FROM handover_sessions WHERE session_id = :id"), {"id": first["session_id"]}
+            )
+            await postgres.copy_sessions(conn, [duplicate])
+            return (await conn.execute(text("SELECT count(*) FROM handover_session_ids"))).scalar()
+
+    assert _run_in_schema(scenario) == 1
+
+
+def test_jsonb_round_trip_through_the_engine_serializers():
+    payload = {"openIssues": [{"id": "ISS-1", "issue": "Seal leak", "priority": "High", "confidence": 80}]}
+
+    async def scenario(engine):
+        async with engine.begin() as conn:
+            await postgres.create_schema(conn)
+            await conn.execute(insert(database.HandoverSessionDB).values(
+                session_id="s-1", shift_notes="notes", markdown_output="# Report",
+                json_output=fast_json.dumps(payload), created_at=datetime.utcnow()
+            ))
+            stored = (await conn.execute(select(database.HandoverSessionDB.json_output))).scalar_one()
+            kind = (await conn.execute(text("SELECT jsonb_typeof(json_output) FROM handover_sessions"))).scalar()
+            matched = (await conn.execute(
+                text("SELECT count(*) FROM handover_sessions WHERE json_output @> CAST(:query AS jsonb)"),
+                {"query": '{"openIssues": [{"priority": "High"}]}'}
+            )).scalar()
+            return stored, kind, matched
+
+    stored, kind, matched = _run_in_schema(scenario)
+    # Text in, text out (like SQLite), but stored as a JSON object rather than a JSON string
+    assert isinstance(stored, str) and fast_json.loads(stored) == payload
+    assert kind == "object"
+    assert matched == 1
+
+
+def test_plain_table_from_an_older_release_is_migrated():
+    old = datetime(2023, 11, 5, 8, 0)
+
+    async def scenario(engine):
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "CREATE TABLE handover_sessions (id SERIAL PRIMARY KEY, session_id VARCHAR UNIQUE NOT NULL, "
+                "shift_notes TEXT NOT NULL, alarms_json TEXT, trends_csv TEXT, markdown_output TEXT NOT NULL, "
+                "json_output TEXT NOT NULL, created_at TIMESTAMP)"
+            ))
+            await conn.execute(text("CREATE INDEX ix_handover_sessions_created_at ON handover_sessions (created_at)"))
+            await conn.execute(text(
+                "INSERT INTO handover_sessions (session_id, shift_notes, alarms_json, markdown_output, json_output, "
+                "created_at) VALUES ('old-1', 'n', '', '# R', :old_json, :old), "
+                "('old-2', 'n', :alarms, '# R', :new_json, NULL)"
+            ), {
+                "old": old,
+                "old_json": '{"openIssues": []}',
+                "alarms": '{"activeAlarms": []}',
+                "new_json": '{"shiftSummary": ["x"]}',
+            })
+
+        async with engine.begin() as conn:
+            await postgres.create_schema(conn)
+
+        async with engine.begin() as conn:
+            kind = await postgres._sessions_table_kind(conn)
+            legacy = (await conn.execute(text("SELECT to_regclass('handover_sessions_unpartitioned')"))).scalar()
+            partitions = await _partitions(conn)
+            json_kinds = (await conn.execute(text(
+                "SELECT count(*) FROM handover_sessions WHERE jsonb_typeof(json_output) = 'object'"
+            ))).scalar()
+            guarded = (await conn.execute(text("SELECT count(*) FROM handover_session_ids"))).scalar()
+            await postgres.copy_sessions(conn, [_record(datetime.utcnow())])
+            ids = (await conn.execute(text("SELECT id FROM handover_sessions ORDER BY id"))).scalars().all()
+            return kind, legacy, partitions, json_kinds, guarded, ids
+
+    kind, legacy, partitions, json_kinds, guarded, ids = _run_in_schema(scenario)
+    assert kind == "p" and legacy is None
+    assert partitions["old-1"] == postgres.partition_name(old.date())
+    assert partitions["old-2"] == postgres.partition_name(datetime.utcnow().date())
+    assert json_kinds == 2 and guarded == 2
+    # The identity continues after the migrated ids
+    assert ids[:2] == [1, 2] and ids[2] > 2
+
+
+def test_only_one_maintenance_leader(monkeypatch):
+    async def scenario(engine):
+        monkeypatch.setattr(maintenance, "engine", engine)
+        monkeypatch.setattr(maintenance, "IS_POSTGRES", True)
+        monkeypatch.setattr(maintenance, "_lock_handle", None)
+
+        assert await maintenance._acquire_leader_lock()
+        leader = maintenance._lock_handle
+        # Another process: the lock is held on the leader's connection
+        maintenance._lock_handle = None
+        assert not await maintenance._acquire_leader_lock()
+
+        # The leader goes away
+        await leader.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": maintenance._PG_LEADER_LOCK_KEY})
+        await leader.close()
+        assert await maintenance._acquire_leader_lock()
+        await maintenance._lock_handle.execute(
+            text("SELECT pg_advisory_unlock(:key)"), {"key": maintenance._PG_LEADER_LOCK_KEY}
+        )
+        await maintenance._lock_handle.close()
+
+    _run_in_schema(scenario)
@@ -0,0 +1,87 @@
+"""
+create_schema against a recording stand-in for a PostgreSQL connection
+(no server is needed): checks which DDL runs, and in what order, for a new
+database, an already partitioned one and a plain table from an older release.
+"""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import postgres
+
+
+class _Result:
+    def __init__(self, value):
+        self._value = value
+
+    def scalar(self):
+        return self._value
+
+
+class _RecordingConnection:
+    def __init__(self, relkind=None, oldest=None, fail_copy=False):
+        self.relkind = relkind
+        self.oldest = oldest
+        self.fail_copy = fail_copy
+        self.statements = []
+
+    async def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.statements.append(sql)
+        if "FROM pg_class" in sql:
+            return _Result(self.relkind)
+        if sql.startswith("SELECT min(created_at)"):
+            return _Result(self.oldest)
+        if sql.startswith("INSERT INTO handover_sessions") and self.fail_copy:
+            raise ValueError('invalid input syntax for type json')
+        return _Result(None)
+
+    def index_of(self, prefix: str) -> int:
+        return next(i for i, sql in enumerate(self.statements) if sql.startswith(prefix))
+
+    def has(self, prefix: str) -> bool:
+        return any(sql.startswith(prefix) for sql in self.statements)
+
+
+def test_new_database_gets_partitioned_table():
+    conn = _RecordingConnection(relkind=None)
+    asyncio.run(postgres.create_schema(conn))
+    assert conn.has("CREATE TABLE IF NOT EXISTS handover_sessions (")
+    assert not conn.has("ALTER TABLE handover_sessions RENAME")
+    assert conn.has("CREATE TABLE IF NOT EXISTS handover_sessions_default PARTITION OF")
+
+
+def test_partitioned_database_is_left_alone():
+    conn = _RecordingConnection(relkind="p")
+    asyncio.run(postgres.create_schema(conn))
+    assert not conn.has("ALTER TABLE handover_sessions RENAME")
+    assert not conn.has("INSERT INTO handover_sessions")
+
+
+def test_plain_table_is_migrated_before_indexes_are_created():
+    conn = _RecordingConnection(relkind="r", oldest=datetime(2023, 11, 5))
+    asyncio.run(postgres.create_schema(conn))
+
+    rename = conn.index_of("ALTER TABLE handover_sessions RENAME TO handover_sessions_unpartitioned")
+    create = conn.index_of("CREATE TABLE IF NOT EXISTS handover_sessions (")
+    copy = conn.index_of("INSERT INTO handover_sessions")
+    drop = conn.index_of("DROP TABLE handover_sessions_unpartitioned")
+    gin = conn.index_of("CREATE INDEX IF NOT EXISTS ix_handover_sessions_json_output_gin")
+    assert rename < create < copy < drop < gin
+
+    # Partitions cover the oldest migrated month so rows do not land in the default partition
+    first_partition = conn.index_of("CREATE TABLE IF NOT EXISTS handover_sessions_2023_11 PARTITION OF")
+    assert first_partition < copy
+    # The session_id guard exists before the copy, so migrated rows are registered too
+    assert create < conn.index_of("CREATE TRIGGER handover_session_ids_insert") < copy
+    assert "json_output::text::jsonb" in conn.statements[copy]
+    assert conn.has("ALTER TABLE handover_sessions_unpartitioned ADD COLUMN IF NOT EXISTS request_hash")
+
+
+def test_failed_migration_reports_clear_error():
+    conn = _RecordingConnection(relkind="r", oldest=None, fail_copy=True)
+    with pytest.raises(RuntimeError, match="unpartitioned handover_sessions"):
+        asyncio.run(postgres.create_schema(conn))
+    assert not conn.has("DROP TABLE handover_sessions_unpartitioned")
@@ -0,0 +1,133 @@
+import pytest
+from fastapi import HTTPException
+
+import profiling
+from profiling import AllocationTracker, ProfileStore, ProfilingMiddleware, require_profiling_token
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_EVERY", 0)
+
+
+async def _ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def _request(run, middleware, path="/api/shifts", headers=()):
+    scope = {
+        "type": "http", "method": "GET", "path": path,
+        "headers": [(name.encode(), value.encode()) for name, value in headers],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    run(middleware(scope, receive, send))
+    return dict(sent[0]["headers"])
+
+
+def test_debug_endpoints_are_hidden_while_off(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", False)
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "secret")
+    with pytest.raises(HTTPException) as exc:
+        require_profiling_token("secret")
+    assert exc.value.status_code == 404
+
+
+def test_bad_token_is_forbidden(enabled):
+    with pytest.raises(HTTPException) as exc:
+        require_profiling_token("wrong")
+    assert exc.value.status_code == 403
+    with pytest.raises(HTTPException):
+        require_profiling_token(None)
+    require_profiling_token("secret")
+
+
+def test_header_triggers_capture(run, enabled):
+    store = ProfileStore(max_records=5)
+    middleware = ProfilingMiddleware(_ok_app, store=store)
+
+    headers = _request(run, middleware, headers=[("x-profile", "1"), ("x-profile-token", "secret")])
+
+    profile_id = headers[b"x-profile-id"].decode()
+    record = store.get(profile_id)
+    assert record is not None
+    assert record.trigger == "header"
+    assert record.status == 200
+    assert record.report
+    assert not store.busy
+
+    headers = _request(run, middleware, headers=[("x-profile", "1"), ("x-profile-token", "wrong")])
+    assert b"x-profile-id" not in headers
+    assert store.counters["rejected_token"] == 1
+    assert store.counters["captured"] == 1
+
+
+def test_sampling_profiles_one_in_n(run, enabled, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_EVERY", 3)
+    store = ProfileStore(max_records=10)
+    middleware = ProfilingMiddleware(_ok_app, store=store)
+
+    profiled = [b"x-profile-id" in _request(run, middleware) for _ in range(6)]
+    assert profiled == [False, False, True, False, False, True]
+
+    # Debug endpoints and non-API paths are not counted
+    _request(run, middleware, path="/api/debug/profiles")
+    _request(run, middleware, path="/livez")
+    assert store.requests_seen == 6
+    assert [record.trigger for record in store.records] == ["sample", "sample"]
+
+
+def test_buffer_keeps_the_newest_records(run, enabled):
+    store = ProfileStore(max_records=2)
+    middleware = ProfilingMiddleware(_ok_app, store=store)
+    ids = [
+        _request(run, middleware, headers=[("x-profile", "1"), ("x-profile-token", "secret")])[b"x-profile-id"].decode()
+        for _ in range(3)
+    ]
+    assert [record.id for record in store.records] == ids[1:]
+    assert store.get(ids[0]) is None
+    assert store.counters["captured"] == 3
+
+
+def test_failed_profiler_start_releases_the_store(run, enabled, monkeypatch):
+    def refuse(self):
+        raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profiling._RequestProfiler, "start", refuse)
+    store = ProfileStore(max_records=5)
+    middleware = ProfilingMiddleware(_ok_app, store=store)
+
+    headers = _request(run, middleware, headers=[("x-profile", "1"), ("x-profile-token", "secret")])
+
+    record = store.get(headers[b"x-profile-id"].decode())
+    assert record.status == 200
+    assert "failed to start" in record.report
+    assert not store.busy
+    assert store.try_begin()
+
+
+def test_tracemalloc_baseline_then_diff():
+    tracker = AllocationTracker()
+    try:
+        first = tracker.snapshot(limit=5)
+        assert first["baseline"] is True
+        assert "diff" not in first
+
+        retained = [bytearray(1024) for _ in range(100)]
+        second = tracker.snapshot(limit=5)
+        assert second["baseline"] is False
+        assert second["diff"]
+        assert any(entry["sizeKb"] > 0 for entry in second["diff"])
+        del retained
+    finally:
+        tracker.stop()
+    assert not profiling.tracemalloc.is_tracing()
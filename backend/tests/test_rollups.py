@@ -0,0 +1,114 @@
+import uuid
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select
+
+import maintenance
+from database import (
+    HandoverAlarmDB,
+    HandoverIssueDB,
+    async_session_maker,
+    bulk_save_handover_sessions,
+    save_handover_session
+)
+from rollups import MAX_ALARM_PRIORITY, MAX_ISSUE_PRIORITY, extract_alarm_facts, extract_issue_facts
+
+
+def test_free_text_priorities_fit_their_columns():
+    issues = extract_issue_facts({"openIssues": [{"issue": "Pump seal leak", "priority": "High - escalate now"}]})
+    alarms = extract_alarm_facts(
+        {"alarms": [{"tag": "Reactor-B.Pressure", "severity": "Critical (plant-wide trip risk)"}]}, {}
+    )
+    assert issues[0]["priority"] == "High - escalate now"[:MAX_ISSUE_PRIORITY]
+    assert len(alarms[0]["priority"]) == MAX_ALARM_PRIORITY
+
+
+def test_reused_results_are_not_counted_twice(run):
+    json_output = {"openIssues": [{"issue": "Cooling tower fan vibration", "priority": "High"}]}
+    alarms_json = {"alarms": [{"tag": "Tower-1.Vibration", "priority": "High"}]}
+    session_ids = [str(uuid.uuid4()), str(uuid.uuid4())]
+
+    async def scenario():
+        async with async_session_maker() as session:
+            for session_id, record_facts in zip(session_ids, (True, False)):
+                await save_handover_session(
+                    session=session, session_id=session_id, shift_notes="notes", alarms_json=alarms_json,
+                    trends_csv=None, markdown_output="# Report", json_output=json_output,
+                    record_facts=record_facts
+                )
+            counts = []
+            for model in (HandoverIssueDB, HandoverAlarmDB):
+                counts.append((await session.execute(
+                    select(func.count()).select_from(model).where(model.session_id.in_(session_ids))
+                )).scalar())
+            return counts
+
+    assert run(scenario()) == [1, 1]
+
+
+def test_critical_flag_matches_whole_ids_and_tags():
+    alarms_json = {"alarms": [
+        {"id": "P-1", "tag": "Pump-1.Flow"},
+        {"id": "P-10", "tag": "Pump-10.Flow"},
+        {"id": "TI-7", "tag": "Reactor-B.Temp"},
+    ]}
+    json_output = {"criticalAlarms": [
+        {"alarm": "P-10 low flow (Pump-10.Flow)"},
+        {"alarm": "High temperature on Reactor-B.Temp."},
+    ]}
+    critical = {fact["tag"]: fact["critical"] for fact in extract_alarm_facts(alarms_json, json_output)}
+    assert critical == {"Pump-1.Flow": False, "Pump-10.Flow": True, "Reactor-B.Temp": True}
+
+
+def _facts_for(session_ids):
+    async def count():
+        async with async_session_maker() as session:
+            return [
+                (await session.execute(
+                    select(func.count()).select_from(model).where(model.session_id.in_(session_ids))
+                )).scalar()
+                for model in (HandoverIssueDB, HandoverAlarmDB)
+            ]
+    return count()
+
+
+def test_old_facts_are_pruned(run, monkeypatch):
+    monkeypatch.setattr(maintenance, "SESSION_FACTS_RETENTION_DAYS", 90)
+    old_id, new_id = str(uuid.uuid4()), str(uuid.uuid4())
+
+    async def scenario():
+        async with async_session_maker() as session:
+            for session_id, day in ((old_id, date.today() - timedelta(days=120)), (new_id, date.today())):
+                session.add(HandoverIssueDB(
+                    session_id=session_id, day=day, issue_key="ISS-1", issue="Leak", priority="High", confidence=50
+                ))
+                session.add(HandoverAlarmDB(
+                    session_id=session_id, day=day, alarm_key="A", tag="T", unit="U", priority="High", critical=False
+                ))
+            await session.commit()
+        pruned = await maintenance.prune_expired()
+        return pruned, await _facts_for([old_id]), await _facts_for([new_id])
+
+    pruned, old, new = run(scenario())
+    assert pruned["issue_facts"] >= 1 and pruned["alarm_facts"] >= 1
+    assert old == [0, 0] and new == [1, 1]
+
+
+def test_archived_sessions_take_their_facts_along(run, monkeypatch):
+    monkeypatch.setattr(maintenance, "ARCHIVE_AFTER_DAYS", 180)
+    session_id = str(uuid.uuid4())
+    row = {
+        "session_id": session_id, "shift_notes": "notes", "trends_csv": None, "markdown_output": "# Report",
+        "alarms_json": {"alarms": [{"tag": "Tower-1.Vibration"}]},
+        "json_output": {"openIssues": [{"issue": "Fan vibration", "priority": "High"}]},
+        "created_at": datetime(2002, 3, 1),
+    }
+
+    async def scenario():
+        async with async_session_maker() as session:
+            await bulk_save_handover_sessions(session, [row])
+        before = await _facts_for([session_id])
+        await maintenance.archive_old_sessions()
+        return before, await _facts_for([session_id])
+
+    assert run(scenario()) == ([1, 1], [0, 0])
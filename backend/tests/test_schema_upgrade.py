@@ -0,0 +1,58 @@
+from sqlalchemy import create_engine, inspect, text
+
+from database import ADDED_SESSION_COLUMNS, HandoverSessionDB, _add_missing_session_columns
+
+# handover_sessions as created by the first release
+BASELINE_SESSIONS_TABLE = """
+CREATE TABLE handover_sessions (
+    id INTEGER NOT NULL PRIMARY KEY,
+    session_id VARCHAR NOT NULL UNIQUE,
+    shift_notes TEXT NOT NULL,
+    alarms_json TEXT,
+    trends_csv TEXT,
+    markdown_output TEXT NOT NULL,
+    json_output TEXT NOT NULL,
+    created_at DATETIME
+)
+"""
+
+
+def _baseline_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/baseline.db")
+    with engine.begin() as conn:
+        conn.execute(text(BASELINE_SESSIONS_TABLE))
+        conn.execute(text(
+            "INSERT INTO handover_sessions (session_id, shift_notes, markdown_output, json_output) "
+            "VALUES ('old', 'notes', '# Report', '{}')"
+        ))
+    return engine
+
+
+def test_adds_missing_columns_to_existing_table(tmp_path):
+    engine = _baseline_engine(tmp_path)
+    with engine.begin() as conn:
+        added = _add_missing_session_columns(conn)
+
+    assert added == [name for name, _ in ADDED_SESSION_COLUMNS]
+    columns = {column["name"] for column in inspect(engine).get_columns("handover_sessions")}
+    assert set(added) <= columns
+    indexes = {index["name"] for index in inspect(engine).get_indexes("handover_sessions")}
+    assert "ix_handover_sessions_created_at" in indexes
+
+
+def test_upgrade_is_idempotent_and_keeps_rows(tmp_path):
+    engine = _baseline_engine(tmp_path)
+    with engine.begin() as conn:
+        _add_missing_session_columns(conn)
+    with engine.begin() as conn:
+        assert _add_missing_session_columns(conn) == []
+        assert conn.execute(text("SELECT session_id FROM handover_sessions")).scalars().all() == ["old"]
+
+
+def test_upgraded_table_matches_model(tmp_path):
+    engine = _baseline_engine(tmp_path)
+    with engine.begin() as conn:
+        _add_missing_session_columns(conn)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("handover_sessions")}
+    assert set(HandoverSessionDB.__table__.columns.keys()) <= columns
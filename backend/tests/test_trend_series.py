@@ -0,0 +1,93 @@
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import delete, update
+from starlette.requests import Request
+
+from alarm_context import value_at
+from database import HandoverSessionDB, async_session_maker, save_handover_session
+from trend_series import SECONDS_PER_DAY, TIME_BASE_TIME_OF_DAY, lttb, parse_trend_series
+
+NIGHT_SHIFT_CSV = """timestamp,tag,value
+22:00,Reactor-B.Pressure,10
+23:30,Reactor-B.Pressure,11
+00:15,Reactor-B.Pressure,12
+03:00,Reactor-B.Pressure,13
+05:45,Reactor-B.Pressure,14
+"""
+
+
+def test_night_shift_keeps_file_order_across_midnight():
+    entry = parse_trend_series(NIGHT_SHIFT_CSV)["Reactor-B.Pressure"]
+    assert entry.time_base == TIME_BASE_TIME_OF_DAY
+    assert entry.values == [10, 11, 12, 13, 14]
+    assert entry.times == [79200, 84600, 900 + SECONDS_PER_DAY, 10800 + SECONDS_PER_DAY, 20700 + SECONDS_PER_DAY]
+
+    # An alarm at 03:00 lands after midnight on the series axis
+    assert value_at(entry, entry.align_time(10800)) == 13
+    assert entry.align_time(23 * 3600) == 23 * 3600
+
+
+def test_rows_out_of_order_within_the_day_are_still_sorted():
+    csv_text = "time,FIC-101\n06:10,2\n06:00,1\n06:20,3\n"
+    entry = parse_trend_series(csv_text)["FIC-101"]
+    assert entry.times == [21600, 22200, 22800]
+    assert entry.values == [1, 2, 3]
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 4, 5, 10, 101])
+@pytest.mark.parametrize("threshold", [0, 2, 3, 4, 9, 100, 200])
+def test_lttb_edge_sizes(n, threshold):
+    xs = [float(i) for i in range(n)]
+    ys = [float((i * 7) % 5) for i in range(n)]
+    keep = lttb(xs, ys, threshold)
+    if threshold >= n or threshold < 3:
+        assert keep == list(range(n))
+    else:
+        assert len(keep) == threshold
+        assert keep[0] == 0 and keep[-1] == n - 1
+        assert keep == sorted(set(keep))
+
+
+def test_cached_chart_is_dropped_once_its_trends_are_gone(run):
+    from main import get_handover_trends
+    from trend_series import trend_chart_cache
+
+    session_id = f"trends-{uuid.uuid4().hex[:8]}"
+    request = Request({"type": "http", "headers": []})
+
+    async def fetch():
+        async with async_session_maker() as db:
+            return await get_handover_trends(session_id, request, points=100, encoding="json", tags=None, db=db)
+
+    async def scenario():
+        async with async_session_maker() as db:
+            await save_handover_session(
+                db, session_id, "notes", None, NIGHT_SHIFT_CSV, "# Handover", {"issues": []}, record_facts=False
+            )
+        first = await fetch()
+        cached = await fetch()
+        assert cached.body == first.body
+        assert trend_chart_cache.get(trend_chart_cache.key(session_id, 100, "json", None)) is not None
+
+        # Retention clears the column: the cached payload must not be served
+        async with async_session_maker() as db:
+            await db.execute(
+                update(HandoverSessionDB).where(HandoverSessionDB.session_id == session_id).values(trends_csv=None)
+            )
+            await db.commit()
+        with pytest.raises(HTTPException) as exc:
+            await fetch()
+        assert exc.value.status_code == 404
+        assert "No trend data" in exc.value.detail
+        assert trend_chart_cache.get(trend_chart_cache.key(session_id, 100, "json", None)) is None
+
+        async with async_session_maker() as db:
+            await db.execute(delete(HandoverSessionDB).where(HandoverSessionDB.session_id == session_id))
+            await db.commit()
+        with pytest.raises(HTTPException) as exc:
+            await fetch()
+        assert "not found" in exc.value.detail
+
+    run(scenario())
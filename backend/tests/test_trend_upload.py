@@ -0,0 +1,41 @@
+from gemini_client import GeminiClient
+from utils import TrendSummarizer, parse_csv_to_summary
+
+CSV_TEXT = (
+    'timestamp,tag,value,comment\r\n'
+    '2024-01-01T00:00,TI-101,20.5,"first line\nsecond line"\r\n'
+    '2024-01-01T00:01,TI-101,21.0,"quoted ""x"", with comma"\r\n'
+    '\r\n'
+    '2024-01-01T00:02,TI-101,21.5,plain\r\n'
+)
+
+
+def _summarize_in_chunks(text: str, size: int) -> TrendSummarizer:
+    summarizer = TrendSummarizer()
+    for start in range(0, len(text), size):
+        summarizer.feed(text[start:start + size])
+    summarizer.close()
+    return summarizer
+
+
+def test_streamed_summary_matches_whole_file_for_any_chunk_size():
+    expected = parse_csv_to_summary(CSV_TEXT)
+    for size in (1, 2, 3, 7, 16, len(CSV_TEXT)):
+        summarizer = _summarize_in_chunks(CSV_TEXT, size)
+        assert summarizer.row_count == 3
+        assert summarizer.first_rows[0]["comment"] == "first line\nsecond line"
+        assert summarizer.summary() == expected
+
+
+def test_input_without_trailing_newline():
+    summarizer = _summarize_in_chunks("tag,value\nA,1\nB,2", 4)
+    assert summarizer.row_count == 2
+    assert summarizer.last_row == {"tag": "B", "value": "2"}
+
+
+def test_incremental_prompt_uses_uploaded_trend_summary():
+    client = GeminiClient()
+    prompt = client._build_incremental_prompt(
+        {"shiftSummary": []}, "notes", None, None, trend_summary="Trend data contains 3 records"
+    )
+    assert "=== TREND DATA FOR THIS SHIFT ===\nTrend data contains 3 records" in prompt
@@ -0,0 +1,155 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import fast_json
+import write_behind
+from database import async_session_maker, get_handover_session, pending_sessions
+from write_behind import Journal, WriteBehindQueue
+
+
+def _row(**overrides) -> dict:
+    row = {
+        "session_id": str(uuid.uuid4()),
+        "shift_notes": "notes",
+        "alarms_json": None,
+        "trends_csv": None,
+        "markdown_output": "# Report",
+        "json_output": {"shiftSummary": ["ok"]},
+        "created_at": datetime.utcnow(),
+    }
+    row.update(overrides)
+    return row
+
+
+async def _stored(session_id: str) -> bool:
+    async with async_session_maker() as session:
+        return await get_handover_session(session, session_id) is not None
+
+
+def test_poison_row_is_dead_lettered(run, tmp_path, monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_MAX_ATTEMPTS", 2)
+    queue = WriteBehindQueue()
+    queue.journal, _ = Journal.claim(tmp_path)
+    # NOT NULL violation: the database is up but rejects this row every time
+    good, poison, other = _row(), _row(shift_notes=None), _row()
+
+    async def scenario():
+        queue._space = asyncio.Condition()
+        queue._journal_lock = asyncio.Lock()
+        for row in (good, poison, other):
+            pending_sessions[row["session_id"]] = row
+            queue._order.append(row["session_id"])
+
+        first = await queue.flush()
+        assert not first and queue._order == [poison["session_id"]]
+        assert await _stored(good["session_id"]) and await _stored(other["session_id"])
+
+        assert await queue.flush()
+        assert queue._order == [] and poison["session_id"] not in pending_sessions
+        return await _stored(poison["session_id"])
+
+    assert run(scenario()) is False
+    assert queue.counters["dead_lettered"] == 1
+    assert queue.counters["committed"] == 2
+    dead = [fast_json.loads(line) for line in (tmp_path / "dead-letter.journal").read_bytes().splitlines()]
+    assert [entry["put"]["session_id"] for entry in dead] == [poison["session_id"]]
+
+
+@pytest.mark.skipif(write_behind.fcntl is None, reason="journal locks need fcntl")
+def test_orphan_journal_stays_locked_until_replayed(run, tmp_path, monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_JOURNAL_DIR", tmp_path)
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_DURABILITY", "journal")
+    orphan_path = tmp_path / "sessions-1.journal"
+    row = _row()
+    orphan_path.write_bytes(fast_json.dumps_bytes({"put": write_behind._encode_row(row)}) + b"\n")
+
+    journal, orphans = Journal.claim(tmp_path)
+    assert [orphan.path for orphan in orphans] == [orphan_path]
+    # A second worker starting now can neither replay nor claim the orphan
+    assert Journal._lock(orphan_path) is None
+    other, other_orphans = Journal.claim(tmp_path)
+    assert other.path.name == "sessions-2.journal" and other_orphans == []
+    for handle in (journal, other, *orphans):
+        handle.release()
+
+    orphan_path.write_bytes(fast_json.dumps_bytes({"put": write_behind._encode_row(row)}) + b"\n")
+    queue = WriteBehindQueue()
+
+    async def scenario():
+        await queue.start()
+        await queue.stop()
+        return await _stored(row["session_id"])
+
+    assert run(scenario())
+    assert queue.counters["replayed"] == 1
+    assert not orphan_path.exists()
+
+
+def test_replay_skips_rows_committed_meanwhile(run):
+    row = _row()
+    queue = WriteBehindQueue()
+    # The same session twice in one batch: the batch insert fails, the retry stores it once
+    assert run(queue._replay([row, dict(row)])) == 1
+    assert run(_stored(row["session_id"]))
+
+
+def test_locked_database_is_not_counted_against_rows(run, monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_MAX_ATTEMPTS", 2)
+    queue = WriteBehindQueue()
+    row = _row()
+    real_save = write_behind.bulk_save_handover_sessions
+
+    async def locked(session, rows):
+        raise OperationalError("INSERT", None, Exception("database is locked"))
+
+    async def scenario():
+        queue._space = asyncio.Condition()
+        pending_sessions[row["session_id"]] = row
+        queue._order.append(row["session_id"])
+        monkeypatch.setattr(write_behind, "bulk_save_handover_sessions", locked)
+        for _ in range(5):
+            assert not await queue.flush()
+        assert queue._attempts == {} and queue._order == [row["session_id"]]
+
+        monkeypatch.setattr(write_behind, "bulk_save_handover_sessions", real_save)
+        assert await queue.flush()
+        return await _stored(row["session_id"])
+
+    assert run(scenario())
+    assert queue.counters["dead_lettered"] == 0
+
+
+def test_truncate_never_erases_an_acknowledged_put(run, tmp_path, monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_JOURNAL_DIR", tmp_path)
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_DURABILITY", "journal")
+    # Keep the flusher out of the way so the new row stays pending
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_FLUSH_MS", 60000)
+    queue = WriteBehindQueue()
+    row = _row()
+
+    async def scenario():
+        await queue.start()
+        truncate = queue.journal.truncate
+
+        def slow_truncate():
+            time.sleep(0.2)
+            truncate()
+
+        queue.journal.truncate = slow_truncate
+
+        async def submit_during_truncate():
+            await asyncio.sleep(0.05)
+            await queue.submit(row)
+
+        # A batch commit empties the buffer and truncates while a new session is acknowledged
+        await asyncio.gather(queue._committed([], 0.0), submit_during_truncate())
+        uncommitted = Journal.read_uncommitted(queue.journal.path)
+        await queue.stop()
+        return uncommitted
+
+    assert [entry["session_id"] for entry in run(scenario())] == [row["session_id"]]
@@ -0,0 +1,318 @@
+"""
+Chart-ready trend series for a handover.
+
+The stored trend CSV is split into one (time, value) series per tag, in long
+format (timestamp, tag/parameter, value[, unit]) or wide format (timestamp
+plus one column per tag). "HH:MM" times are kept in file order and gain a
+day each time they pass midnight, so night shifts stay continuous. Each
+series is downsampled with Largest-Triangle-Three-Buckets, which keeps the
+visual shape (peaks, steps) that plain decimation loses, and encoded
+column-wise: time offsets and values as base64 little-endian float32 arrays,
+or plain JSON arrays.
+Encoded payloads are cached per session, resolution and tag selection.
+"""
+
+import base64
+import csv
+import hashlib
+import math
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from io import StringIO
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import fast_json
+
+TREND_CHART_DEFAULT_POINTS = int(os.getenv("TREND_CHART_DEFAULT_POINTS", "500"))
+TREND_CHART_MAX_POINTS = int(os.getenv("TREND_CHART_MAX_POINTS", "5000"))
+TREND_CHART_CACHE_ENTRIES = int(os.getenv("TREND_CHART_CACHE_ENTRIES", "256"))
+
+TAG_COLUMNS = ("tag", "parameter", "tagname", "name", "point")
+TIME_COLUMNS = ("timestamp", "time", "datetime", "date", "ts")
+VALUE_COLUMNS = ("value", "val", "reading", "pv")
+UNIT_COLUMNS = ("unit", "units", "uom", "eu")
+
+CHART_ENCODINGS = ("base64", "json")
+
+# Time bases of a series: absolute UTC epoch seconds, seconds since midnight
+# ("06:30" style times) or row order when no time column parses
+TIME_BASE_EPOCH = "epoch"
+TIME_BASE_TIME_OF_DAY = "time-of-day"
+TIME_BASE_INDEX = "index"
+
+SECONDS_PER_DAY = 86400.0
+# A time-of-day step back by more than this is the clock passing midnight
+# (a night shift); smaller steps are rows out of order within the day
+_MIDNIGHT_WRAP_SECONDS = SECONDS_PER_DAY / 2
+
+
+@dataclass
+class TrendSeries:
+    tag: str
+    unit: Optional[str] = None
+    times: List[float] = field(default_factory=list)
+    values: List[float] = field(default_factory=list)
+    time_base: str = TIME_BASE_EPOCH
+
+    def sort(self):
+        """Order points by time (historian exports are not always sorted)"""
+        if any(b < a for a, b in zip(self.times, self.times[1:])):
+            pairs = sorted(zip(self.times, self.values))
+            self.times = [t for t, _ in pairs]
+            self.values = [v for _, v in pairs]
+
+    def align_time(self, seconds: float) -> float:
+        """
+        Place a time on this series' axis: a time-of-day is moved by whole
+        days to land nearest the (possibly past-midnight) series span
+        """
+        if self.time_base != TIME_BASE_TIME_OF_DAY or not self.times:
+            return seconds
+        start, end = self.times[0], self.times[-1]
+
+        def distance(candidate: float) -> float:
+            return max(start - candidate, candidate - end, 0.0)
+
+        days = int((end - start) // SECONDS_PER_DAY) + 1
+        return min((seconds + day * SECONDS_PER_DAY for day in range(days + 1)), key=distance)
+
+
+def unwrap_time_of_day(times: List[float]) -> List[float]:
+    """Add a day each time a time-of-day series, in file order, wraps past midnight"""
+    unwrapped = []
+    offset = 0.0
+    previous = None
+    for seconds in times:
+        if previous is not None and previous - seconds > _MIDNIGHT_WRAP_SECONDS:
+            offset += SECONDS_PER_DAY
+        previous = seconds
+        unwrapped.append(seconds + offset)
+    return unwrapped
+
+
+def parse_timestamp(text: Optional[str]) -> Tuple[Optional[float], str]:
+    """Seconds and time base of a timestamp cell; (None, ...) when it does not parse"""
+    text = (text or "").strip()
+    if not text:
+        return None, TIME_BASE_INDEX
+    if len(text) <= 8 and ":" in text:
+        try:
+            parts = [float(part) for part in text.split(":")]
+        except ValueError:
+            return None, TIME_BASE_INDEX
+        seconds = parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)
+        return seconds, TIME_BASE_TIME_OF_DAY
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None, TIME_BASE_INDEX
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp(), TIME_BASE_EPOCH
+
+
+def _parse_number(text: Optional[str]) -> Optional[float]:
+    try:
+        value = float((text or "").strip())
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+def _find_column(fieldnames: Sequence[str], candidates: Sequence[str]) -> Optional[str]:
+    by_lower = {name.strip().lower(): name for name in fieldnames if name}
+    for candidate in candidates:
+        if candidate in by_lower:
+            return by_lower[candidate]
+    return None
+
+
+def _to_series(tag: str, unit: Optional[str], rows: List[Tuple[Optional[str], float]]) -> TrendSeries:
+    parsed = [parse_timestamp(time_text) for time_text, _ in rows]
+    time_bases = {time_base for _, time_base in parsed}
+    values = [value for _, value in rows]
+    if len(time_bases) != 1 or TIME_BASE_INDEX in time_bases:
+        # Missing, unparseable or mixed timestamps: fall back to row order
+        return TrendSeries(tag, unit, [float(i) for i in range(len(rows))], values, TIME_BASE_INDEX)
+    time_base = time_bases.pop()
+    times = [seconds for seconds, _ in parsed]
+    if time_base == TIME_BASE_TIME_OF_DAY:
+        # "22:00 ... 23:59, 00:00 ... 06:00" is one night, not two halves of a day
+        times = unwrap_time_of_day(times)
+    entry = TrendSeries(tag, unit, times, values, time_base)
+    entry.sort()
+    return entry
+
+
+def parse_trend_series(csv_text: Optional[str]) -> Dict[str, TrendSeries]:
+    """Split trend CSV into per-tag series sorted by time; rows with non-numeric values are skipped"""
+    if not csv_text or not csv_text.strip():
+        return {}
+
+    reader = csv.DictReader(StringIO(csv_text))
+    fieldnames = reader.fieldnames or []
+    time_column = _find_column(fieldnames, TIME_COLUMNS)
+    tag_column = _find_column(fieldnames, TAG_COLUMNS)
+    value_column = _find_column(fieldnames, VALUE_COLUMNS)
+    unit_column = _find_column(fieldnames, UNIT_COLUMNS)
+
+    rows_by_tag: Dict[str, List[Tuple[Optional[str], float]]] = {}
+    units: Dict[str, Optional[str]] = {}
+
+    if tag_column and value_column:
+        for row in reader:
+            tag = (row.get(tag_column) or "").strip()
+            value = _parse_number(row.get(value_column))
+            if not tag or value is None:
+                continue
+            rows_by_tag.setdefault(tag, []).append((row.get(time_column) if time_column else None, value))
+            if tag not in units:
+                units[tag] = ((row.get(unit_column) or "").strip() or None) if unit_column else None
+    else:
+        # Wide format: every other column is a tag
+        tag_columns = [name for name in fieldnames if name and name != time_column]
+        for row in reader:
+            time_text = row.get(time_column) if time_column else None
+            for name in tag_columns:
+                value = _parse_number(row.get(name))
+                if value is not None:
+                    rows_by_tag.setdefault(name.strip(), []).append((time_text, value))
+
+    return {tag: _to_series(tag, units.get(tag), rows) for tag, rows in rows_by_tag.items()}
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling"""
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+
+        ax, ay = xs[a], ys[a]
+        best_area, best = -1.0, int(i * every) + 1
+        for j in range(int(i * every) + 1, next_start):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area, best = area, j
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def _float32_base64(values: Sequence[float]) -> str:
+    packed = array("f", values)
+    if sys.byteorder != "little":  # pragma: no cover
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+def build_chart_payload(
+    session_id: str,
+    series: Dict[str, TrendSeries],
+    points: int,
+    encoding: str,
+    tags: Optional[Sequence[str]] = None
+) -> Dict[str, object]:
+    """Downsample and encode the selected series (all when tags is None)"""
+    selected = [series[tag] for tag in tags if tag in series] if tags else list(series.values())
+    encoded = []
+    for entry in selected:
+        t0 = entry.times[0] if entry.times else 0.0
+        offsets = [t - t0 for t in entry.times]
+        keep = lttb(offsets, entry.values, points)
+        offsets = [offsets[i] for i in keep]
+        values = [entry.values[i] for i in keep]
+        encoded.append({
+            "tag": entry.tag,
+            "unit": entry.unit,
+            "timeBase": entry.time_base,
+            "t0": t0,
+            "sourcePoints": len(entry.values),
+            "points": len(values),
+            "min": min(entry.values) if entry.values else None,
+            "max": max(entry.values) if entry.values else None,
+            "t": _float32_base64(offsets) if encoding == "base64" else offsets,
+            "v": _float32_base64(values) if encoding == "base64" else values,
+        })
+    return {
+        "sessionId": session_id,
+        "points": points,
+        "encoding": "base64-float32-le" if encoding == "base64" else "json",
+        "series": encoded,
+    }
+
+
+def render_chart_payload(
+    session_id: str,
+    csv_text: str,
+    points: int,
+    encoding: str,
+    tags: Optional[Sequence[str]] = None
+) -> bytes:
+    """Parse, downsample and serialize in one go (CPU-bound: run in a worker thread)"""
+    payload = build_chart_payload(session_id, parse_trend_series(csv_text), points, encoding, tags)
+    return fast_json.dumps(payload).encode("utf-8")
+
+
+class TrendChartCache:
+    """LRU of serialized chart payloads with their ETags"""
+
+    def __init__(self, max_entries: int = TREND_CHART_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[bytes, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(session_id: str, points: int, encoding: str, tags: Optional[Sequence[str]]) -> Tuple:
+        return session_id, points, encoding, tuple(sorted(tags)) if tags else None
+
+    def get(self, key: Tuple) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple, body: bytes) -> Tuple[bytes, str]:
+        entry = (body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"')
+        if self.max_entries <= 0:
+            return entry
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def discard(self, session_id: str):
+        """Drop every cached payload of a session"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == session_id]:
+                del self._entries[key]
+
+    def metrics(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+trend_chart_cache = TrendChartCache()
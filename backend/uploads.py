@@ -0,0 +1,334 @@
+"""
+Streaming ingestion of uploaded alarm and trend files.
+
+Files are read in fixed-size chunks, gunzipped on the fly when compressed, and
+fed straight into the trend summarizer and the alarm aggregator. A full-shift
+historian dump is reduced to a bounded summary (plus the raw CSV when it is
+small enough to store) without the whole text ever being held in memory.
+"""
+
+import codecs
+import hashlib
+import heapq
+import json
+import os
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from schemas import MAX_TRENDS_CSV_CHARS
+from utils import TrendSummarizer
+
+UPLOAD_CHUNK_BYTES = 256 * 1024
+# Limit on the (possibly compressed) multipart body
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+# Limit on the decompressed size of each file, to stop gzip bombs
+MAX_UPLOAD_DECOMPRESSED_BYTES = int(os.getenv("MAX_UPLOAD_DECOMPRESSED_BYTES", str(1024 * 1024 * 1024)))
+# Alarm records kept verbatim for the prompt; the rest are only counted
+MAX_UPLOAD_ALARMS = int(os.getenv("MAX_UPLOAD_ALARMS", "500"))
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_PRIORITY_RANK = {"critical": 0, "high": 1, "medium": 2, "med": 2, "low": 3}
+_TOP_TAGS = 20
+# A single alarm record (or metadata value) larger than this is rejected
+_MAX_RECORD_CHARS = 1_000_000
+
+
+class UploadError(ValueError):
+    """An uploaded file is malformed or exceeds the configured limits"""
+
+
+def iter_decompressed(
+    fileobj: BinaryIO,
+    chunk_size: int = UPLOAD_CHUNK_BYTES,
+    max_bytes: int = MAX_UPLOAD_DECOMPRESSED_BYTES
+) -> Iterator[bytes]:
+    """Yield the file's bytes in chunks, gunzipping when it starts with the gzip magic"""
+    chunk = fileobj.read(chunk_size)
+    total = 0
+
+    if not chunk.startswith(_GZIP_MAGIC):
+        while chunk:
+            total += len(chunk)
+            if total > max_bytes:
+                raise UploadError(f"Uploaded file exceeds {max_bytes} bytes")
+            yield chunk
+            chunk = fileobj.read(chunk_size)
+        return
+
+    decompressor = zlib.decompressobj(wbits=31)
+    member_open = False
+    try:
+        while chunk:
+            data = chunk
+            while data:
+                member_open = True
+                # Bounded output per call so a small highly-compressed chunk
+                # cannot expand into one huge allocation
+                out = decompressor.decompress(data, chunk_size)
+                total += len(out)
+                if total > max_bytes:
+                    raise UploadError(f"Decompressed upload exceeds {max_bytes} bytes")
+                if out:
+                    yield out
+                data = decompressor.unconsumed_tail
+                if decompressor.eof:
+                    # Concatenated gzip members (e.g. rotated, appended logs)
+                    data = decompressor.unused_data + data
+                    decompressor = zlib.decompressobj(wbits=31)
+                    member_open = False
+            chunk = fileobj.read(chunk_size)
+        if member_open:
+            raise UploadError("Truncated gzip upload")
+    except zlib.error as e:
+        raise UploadError(f"Invalid gzip upload: {e}")
+
+
+def iter_text(chunks: Iterator[bytes]) -> Iterator[str]:
+    """Decode UTF-8 (with or without BOM) across chunk boundaries"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    try:
+        for chunk in chunks:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+    except UnicodeDecodeError as e:
+        raise UploadError(f"Uploaded file is not valid UTF-8: {e}")
+
+
+@dataclass
+class TrendUpload:
+    summary: str
+    row_count: int
+    # Raw CSV, kept only when it fits the stored trends limit
+    csv_text: Optional[str]
+    sha256: str
+
+
+def summarize_trends_upload(fileobj: BinaryIO) -> TrendUpload:
+    """Stream a (optionally gzipped) trend CSV into a TrendSummarizer"""
+    summarizer = TrendSummarizer()
+    digest = hashlib.sha256()
+    retained: Optional[List[str]] = []
+    retained_chars = 0
+
+    for text in iter_text(iter_decompressed(fileobj)):
+        digest.update(text.encode("utf-8"))
+        summarizer.feed(text)
+        if retained is not None:
+            retained_chars += len(text)
+            if retained_chars > MAX_TRENDS_CSV_CHARS:
+                retained = None
+            else:
+                retained.append(text)
+    summarizer.close()
+
+    return TrendUpload(
+        summary=summarizer.summary(),
+        row_count=summarizer.row_count,
+        csv_text="".join(retained) if retained else None,
+        sha256=digest.hexdigest()
+    )
+
+
+class AlarmStreamParser:
+    """
+    Incremental parser for alarm exports.
+
+    Handles the two shapes the API accepts: an object whose list values hold
+    alarm records (``{"metadata": {...}, "activeAlarms": [...]}``) or a bare
+    list of alarms. Each record is decoded on its own as soon as it is
+    complete, so memory use is bounded by the largest single record.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._section: Optional[str] = None
+        self._key: Optional[str] = None
+        self._top_level_list = False
+        self.metadata: Dict[str, Any] = {}
+
+    def feed(self, text: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Consume a chunk of text and yield the (section, alarm) records completed by it"""
+        if self._pos > UPLOAD_CHUNK_BYTES:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        self._buffer += text
+        yield from self._parse(final=False)
+
+    def close(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        yield from self._parse(final=True)
+        if self._state == "start":
+            # Empty file: no alarms uploaded
+            return
+        if self._state != "done":
+            raise UploadError("Alarms upload ended before the JSON document was complete")
+        if self._buffer[self._pos:].strip():
+            raise UploadError("Unexpected data after the alarms JSON document")
+
+    def _skip_whitespace(self) -> Optional[str]:
+        buffer, pos = self._buffer, self._pos
+        while pos < len(buffer) and buffer[pos] in " \t\r\n":
+            pos += 1
+        self._pos = pos
+        return buffer[pos] if pos < len(buffer) else None
+
+    def _decode_value(self, final: bool):
+        """Decode one JSON value at the cursor; None when more input is needed"""
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError as e:
+            if final:
+                raise UploadError(f"Invalid alarms JSON: {e}")
+            if len(self._buffer) - self._pos > _MAX_RECORD_CHARS:
+                raise UploadError(f"Invalid alarms JSON or record larger than {_MAX_RECORD_CHARS} characters")
+            return None
+        # A number or literal that ends the buffer may continue in the next chunk
+        if end == len(self._buffer) and not final:
+            return None
+        self._pos = end
+        return (value,)
+
+    def _parse(self, final: bool) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        while True:
+            char = self._skip_whitespace()
+            if char is None:
+                return
+
+            if self._state == "start":
+                if char == "{":
+                    self._state = "key"
+                elif char == "[":
+                    self._top_level_list = True
+                    self._section = "alarms"
+                    self._state = "array"
+                else:
+                    raise UploadError("Alarms upload must be a JSON object or array")
+                self._pos += 1
+
+            elif self._state == "key":
+                if char == "}":
+                    self._pos += 1
+                    self._state = "done"
+                elif char == ",":
+                    self._pos += 1
+                else:
+                    decoded = self._decode_value(final)
+                    if decoded is None:
+                        return
+                    if not isinstance(decoded[0], str):
+                        raise UploadError("Invalid alarms JSON: expected an object key")
+                    self._key = decoded[0]
+                    self._state = "colon"
+
+            elif self._state == "colon":
+                if char != ":":
+                    raise UploadError("Invalid alarms JSON: expected ':'")
+                self._pos += 1
+                self._state = "value"
+
+            elif self._state == "value":
+                if char == "[":
+                    self._pos += 1
+                    self._section = self._key
+                    self._state = "array"
+                else:
+                    decoded = self._decode_value(final)
+                    if decoded is None:
+                        return
+                    self.metadata[self._key] = decoded[0]
+                    self._state = "key"
+
+            elif self._state == "array":
+                if char == "]":
+                    self._pos += 1
+                    self._state = "done" if self._top_level_list else "key"
+                elif char == ",":
+                    self._pos += 1
+                else:
+                    decoded = self._decode_value(final)
+                    if decoded is None:
+                        return
+                    if isinstance(decoded[0], dict):
+                        yield self._section, decoded[0]
+
+            else:  # done
+                return
+
+
+class AlarmAggregator:
+    """
+    Reduce an arbitrarily long alarm stream to a bounded alarms payload.
+
+    Every alarm is counted by section, priority and tag; only the most
+    significant MAX_UPLOAD_ALARMS records (active first, then by priority,
+    then most recent) are kept verbatim, in their original order and sections.
+    """
+
+    def __init__(self, max_alarms: int = MAX_UPLOAD_ALARMS):
+        self.max_alarms = max_alarms
+        self.total = 0
+        self.by_section: Counter = Counter()
+        self.by_priority: Counter = Counter()
+        self.by_tag: Counter = Counter()
+        self._kept: List[Tuple[Tuple[int, int, str, int], str, Dict[str, Any]]] = []
+
+    @staticmethod
+    def _significance(record: Dict[str, Any], seq: int) -> Tuple[int, int, str, int]:
+        # Larger is more significant; heapq pops the smallest first
+        active = 0 if str(record.get("status", "")).lower() in ("cleared", "resolved", "inactive") else 1
+        rank = _PRIORITY_RANK.get(str(record.get("priority") or record.get("severity") or "").lower(), 4)
+        return (active, -rank, str(record.get("timestamp") or ""), -seq)
+
+    def add(self, section: str, record: Dict[str, Any]):
+        seq = self.total
+        self.total += 1
+        self.by_section[section] += 1
+        self.by_priority[str(record.get("priority") or record.get("severity") or "Unknown")] += 1
+        if record.get("tag"):
+            self.by_tag[str(record["tag"])] += 1
+
+        entry = (self._significance(record, seq), section, record)
+        if len(self._kept) < self.max_alarms:
+            heapq.heappush(self._kept, entry)
+        elif entry[0] > self._kept[0][0]:
+            heapq.heapreplace(self._kept, entry)
+
+    def result(self, metadata: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        if not self.total and not metadata:
+            return None
+
+        alarms: Dict[str, Any] = dict(metadata or {})
+        for _, section, record in sorted(self._kept, key=lambda entry: -entry[0][3]):
+            alarms.setdefault(section, []).append(record)
+
+        if self.total > len(self._kept):
+            alarms["uploadSummary"] = {
+                "totalAlarms": self.total,
+                "omittedAlarms": self.total - len(self._kept),
+                "alarmsBySection": dict(self.by_section),
+                "alarmsByPriority": dict(self.by_priority),
+                "topTags": dict(self.by_tag.most_common(_TOP_TAGS)),
+            }
+        return alarms
+
+
+def aggregate_alarms_upload(fileobj: BinaryIO, max_alarms: int = MAX_UPLOAD_ALARMS) -> Optional[Dict[str, Any]]:
+    """Stream a (optionally gzipped) alarms JSON file into an AlarmAggregator"""
+    parser = AlarmStreamParser()
+    aggregator = AlarmAggregator(max_alarms)
+
+    for text in iter_text(iter_decompressed(fileobj)):
+        for section, record in parser.feed(text):
+            aggregator.add(section, record)
+    for section, record in parser.close():
+        aggregator.add(section, record)
+
+    return aggregator.result(parser.metadata)
@@ -1,37 +1,112 @@
-import json
 import csv
 from io import StringIO
 from typing import Dict, Any, Optional, List
 import re
 
+import fast_json
 
-def parse_csv_to_summary(csv_content: str) -> str:
-    """Parse CSV trend data and create a human-readable summary"""
-    if not csv_content or not csv_content.strip():
-        return ""
 
-    try:
-        reader = csv.DictReader(StringIO(csv_content))
-        rows = list(reader)
+class TrendSummarizer:
+    """
+    Builds the trend summary incrementally, one row at a time, so that large
+    trend files never have to be held in memory as a list of rows.
+    """
 
-        if not rows:
-            return "Empty trend data."
+    SAMPLE_ROWS = 5
+
+    def __init__(self):
+        self.fieldnames: Optional[List[str]] = None
+        self.row_count = 0
+        self.first_rows: List[Dict[str, Any]] = []
+        self.last_row: Optional[Dict[str, Any]] = None
+        self._pending = ""
+
+    def add_row(self, row: Dict[str, Any]):
+        self.row_count += 1
+        if len(self.first_rows) < self.SAMPLE_ROWS:
+            self.first_rows.append(row)
+        self.last_row = row
+
+    def feed(self, text: str):
+        """
+        Feed a chunk of CSV text. Only complete records are parsed; the rest,
+        including a quoted field whose newlines continue in the next chunk, is
+        carried over.
+        """
+        data = self._pending + text
+        # A record ends at a newline outside quotes; quote parity per line tells which
+        in_quotes = False
+        start = end = 0
+        while True:
+            newline = data.find("\n", start)
+            if newline < 0:
+                break
+            if data.count('"', start, newline) % 2:
+                in_quotes = not in_quotes
+            start = newline + 1
+            if not in_quotes:
+                end = start
+        self._pending = data[end:]
+        if end:
+            self._add_records(data[:end])
+
+    def close(self):
+        """Parse whatever is left once the input ends"""
+        if self._pending:
+            self._add_records(self._pending)
+            self._pending = ""
+
+    def _add_records(self, text: str):
+        for values in csv.reader(StringIO(text)):
+            if not values or (len(values) == 1 and not values[0].strip()):
+                continue
+            if self.fieldnames is None:
+                self.fieldnames = values
+                continue
+            # Same shape as csv.DictReader rows
+            row: Dict[Any, Any] = dict(zip(self.fieldnames, values))
+            if len(values) > len(self.fieldnames):
+                row[None] = values[len(self.fieldnames):]
+            for name in self.fieldnames[len(values):]:
+                row[name] = None
+            self.add_row(row)
+
+    def summary(self) -> str:
+        if not self.row_count:
+            return "Empty trend data." if self.fieldnames is not None else ""
 
         # Create a summary of the trend data
-        fieldnames = reader.fieldnames or []
         summary_lines = [
-            f"Trend data contains {len(rows)} records with fields: {', '.join(fieldnames)}",
+            f"Trend data contains {self.row_count} records with fields: {', '.join(self.fieldnames or [])}",
         ]
 
         # Add sample of first few and last few rows
-        if len(rows) <= 5:
-            summary_lines.append(f"All records: {rows}")
+        if self.row_count <= self.SAMPLE_ROWS:
+            summary_lines.append(f"All records: {self.first_rows}")
         else:
-            summary_lines.append(f"First record: {rows[0]}")
-            summary_lines.append(f"Last record: {rows[-1]}")
+            summary_lines.append(f"First record: {self.first_rows[0]}")
+            summary_lines.append(f"Last record: {self.last_row}")
 
         return "\n".join(summary_lines)
 
+
+def parse_csv_to_summary(csv_content: str) -> str:
+    """Parse CSV trend data and create a human-readable summary"""
+    if not csv_content or not csv_content.strip():
+        return ""
+
+    try:
+        reader = csv.DictReader(StringIO(csv_content))
+        summarizer = TrendSummarizer()
+        for row in reader:
+            summarizer.add_row(row)
+
+        if not summarizer.row_count:
+            return "Empty trend data."
+
+        summarizer.fieldnames = reader.fieldnames or []
+        return summarizer.summary()
+
     except Exception as e:
         return f"Could not parse CSV trend data: {str(e)}"
 
@@ -43,7 +118,7 @@ def format_alarms_json(alarms: Dict[str, Any]) -> str:
 
     try:
         # Pretty format the JSON for better readability
-        return json.dumps(alarms, indent=2)
+        return fast_json.dumps_pretty(alarms)
     except Exception as e:
         return f"Could not format alarms: {str(e)}"
 
@@ -58,8 +133,8 @@ def extract_json_from_text(text: str) -> Optional[Dict[str, Any]]:
 
     # Strategy 1: Try to parse the entire text as JSON
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
+        return fast_json.loads(text)
+    except fast_json.JSONDecodeError:
         pass
 
     # Strategy 2: Look for JSON in markdown code blocks
@@ -67,8 +142,8 @@ def extract_json_from_text(text: str) -> Optional[Dict[str, Any]]:
     matches = re.findall(json_block_pattern, text, re.DOTALL)
     for match in matches:
         try:
-            return json.loads(match)
-        except json.JSONDecodeError:
+            return fast_json.loads(match)
+        except fast_json.JSONDecodeError:
             continue
 
     # Strategy 3: Find JSON object boundaries
@@ -78,11 +153,11 @@ def extract_json_from_text(text: str) -> Optional[Dict[str, Any]]:
     # Try matches in reverse order (often the last one is most complete)
     for match in reversed(matches):
         try:
-            parsed = json.loads(match)
+            parsed = fast_json.loads(match)
             # Validate it has expected structure
             if isinstance(parsed, dict) and any(key in parsed for key in ['shiftSummary', 'openIssues', 'recommendedActions']):
                 return parsed
-        except json.JSONDecodeError:
+        except fast_json.JSONDecodeError:
             continue
 
     return None
@@ -132,11 +207,16 @@ def validate_handover_json(data: Dict[str, Any]) -> Dict[str, Any]:
                 except (ValueError, TypeError):
                     confidence = 50
 
-                repaired['openIssues'].append({
+                repaired_issue = {
                     'issue': str(issue.get('issue', '')),
                     'priority': priority,
                     'confidence': confidence
-                })
+                }
+                # Stable identity carried across incremental shifts
+                if issue.get('id'):
+                    repaired_issue['id'] = str(issue['id'])
+
+                repaired['openIssues'].append(repaired_issue)
 
     # Validate recommendedActions
     if 'recommendedActions' in data:
@@ -0,0 +1,93 @@
+"""
+Startup warm-up and readiness state.
+
+Each worker runs the warm-up from the FastAPI lifespan before it accepts
+traffic, so the first real requests don't pay for lazy initialisation of the
+Gemini client, ReportLab or the database connection pool.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+import pdf_generator
+from database import ping_database
+from handover_cache import rebuild_index
+
+logger = logging.getLogger(__name__)
+
+
+class StartupState:
+    """What the worker did at startup and whether it is ready for traffic"""
+
+    def __init__(self):
+        self.ready = False
+        self.started_at = datetime.utcnow()
+        self.import_seconds: Optional[float] = None
+        self.steps: Dict[str, Dict[str, Any]] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "startedAt": self.started_at.isoformat(),
+            "importSeconds": round(self.import_seconds, 4) if self.import_seconds is not None else None,
+            "warmUp": self.steps,
+        }
+
+
+startup_state = StartupState()
+
+
+async def _run_step(name: str, step) -> bool:
+    started = time.perf_counter()
+    try:
+        detail = await step()
+        status = "ok"
+    except Exception as e:
+        detail = str(e)
+        status = "error"
+        logger.error(f"Warm-up step '{name}' failed: {e}")
+
+    startup_state.steps[name] = {
+        "status": status,
+        "seconds": round(time.perf_counter() - started, 4),
+        "detail": detail,
+    }
+    return status == "ok"
+
+
+async def warm_up(build_gemini_client: Callable[[], Any]) -> bool:
+    """
+    Open a database connection, build the Gemini client, render a tiny PDF
+    and load the handover cache index. The worker is marked ready unless the
+    database is unreachable; a missing Gemini key only affects generation.
+    """
+
+    async def database():
+        await ping_database(pooled=True)
+        return "connected"
+
+    async def gemini():
+        try:
+            build_gemini_client()
+        except Exception as e:
+            return f"skipped: {getattr(e, 'detail', e)}"
+        return "client initialized"
+
+    async def pdf():
+        size = await asyncio.to_thread(pdf_generator.warm_up)
+        return f"rendered {size} bytes"
+
+    async def cache_index():
+        return f"{await rebuild_index()} recent sessions indexed"
+
+    database_ok = await _run_step("database", database)
+    await _run_step("gemini", gemini)
+    await _run_step("pdf", pdf)
+    if database_ok:
+        await _run_step("handover_cache", cache_index)
+
+    startup_state.ready = database_ok
+    return startup_state.ready
@@ -0,0 +1,443 @@
+"""
+Optional write-behind persistence for generated handovers.
+
+With WRITE_BEHIND_ENABLED=true a new session is put in the pending buffer
+(database.pending_sessions, which readers check first) and acknowledged
+right away; a background task commits pending sessions in batches of up to
+WRITE_BEHIND_BATCH_SIZE, at most WRITE_BEHIND_FLUSH_MS after the first one
+arrived (group commit). Response latency then no longer includes the
+database commit, and SQLite sees one write transaction per batch instead of
+one per request.
+
+WRITE_BEHIND_DURABILITY decides what an acknowledgement guarantees:
+
+- ``fsync``: the session is in an append-only journal that has been fsynced
+  (journal writes from concurrent requests share one fsync)
+- ``journal``: the session is in the journal but possibly only in the OS page
+  cache, so it survives a process crash but not a power loss
+- ``memory``: nothing is written before the commit; a crash loses the batch
+
+Journal entries of sessions that were never committed are replayed into the
+database at startup. Each worker process claims its own journal file, and
+holds the lock on any orphaned journal it replays until the file is gone.
+
+A batch that fails is retried row by row. A row that keeps failing
+(WRITE_BEHIND_MAX_ATTEMPTS) is dead-lettered: dropped from the pending
+buffer, logged, and appended to dead-letter.journal in the journal directory
+so it can be recovered by hand.
+
+Pending sessions live in the worker that generated them, so read-your-writes
+holds within that worker only; another worker sees a session once it is
+committed.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
+
+import fast_json
+from database import HandoverSessionDB, async_session_maker, bulk_save_handover_sessions, pending_sessions
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "64"))
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "100"))
+# Requests wait for the flusher once this many sessions are pending
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "5000"))
+WRITE_BEHIND_DURABILITY = os.getenv("WRITE_BEHIND_DURABILITY", "fsync").lower()
+WRITE_BEHIND_JOURNAL_DIR = Path(os.getenv("WRITE_BEHIND_JOURNAL_DIR", "./write-behind"))
+# Failed commits of one session before it is dead-lettered
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+
+DURABILITY_MODES = ("fsync", "journal", "memory")
+_RETRY_SECONDS = 5.0
+_MAX_JOURNAL_SLOTS = 64
+_DEAD_LETTER_FILE = "dead-letter.journal"
+
+
+def _encode_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {**row, "created_at": row["created_at"].isoformat()}
+
+
+def _decode_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {**row, "created_at": datetime.fromisoformat(row["created_at"])}
+
+
+def _append_dead_letter(path: Path, entry: Dict[str, Any]):
+    with open(path, "ab") as f:
+        f.write(fast_json.dumps_bytes(entry) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+async def _is_stored(session_id: str) -> bool:
+    """Whether a session whose insert failed is committed after all (e.g. by another worker)"""
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(HandoverSessionDB.session_id).where(HandoverSessionDB.session_id == session_id)
+        )
+        return result.scalar_one_or_none() is not None
+
+
+class Journal:
+    """
+    Append-only JSON-lines journal: ``{"put": row}`` when a session is
+    acknowledged, ``{"done": [session_id, ...]}`` once a batch is committed.
+    Truncated whenever nothing is pending.
+    """
+
+    def __init__(self, path: Path, handle):
+        self.path = path
+        self._handle = handle
+
+    @staticmethod
+    def _lock(path: Path):
+        """Open handle holding the lock on path, or None when another process has it"""
+        handle = open(path, "a+b")
+        if fcntl is None:
+            return handle
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # An orphan unlinked by its replayer while we waited is a stale inode
+            if os.fstat(handle.fileno()).st_ino == os.stat(path).st_ino:
+                return handle
+        except OSError:
+            pass
+        handle.close()
+        return None
+
+    @classmethod
+    def claim(cls, directory: Path) -> Tuple["Journal", List["Journal"]]:
+        """
+        Lock the first free journal slot for this process. Also locks and
+        returns the other unlocked journals (left by workers that no longer
+        exist) so their contents can be replayed; release them once done.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        journal: Optional[Journal] = None
+        orphans: List[Journal] = []
+        for slot in range(_MAX_JOURNAL_SLOTS):
+            path = directory / f"sessions-{slot}.journal"
+            if journal is not None and not path.exists():
+                continue
+            handle = cls._lock(path)
+            if handle is None:
+                continue
+            if journal is None:
+                journal = cls(path, handle)
+            else:
+                orphans.append(cls(path, handle))
+        if journal is None:
+            raise RuntimeError(f"No free write-behind journal slot in {directory}")
+        return journal, orphans
+
+    @staticmethod
+    def read_uncommitted(path: Path) -> List[Dict[str, Any]]:
+        """Rows put but never marked done; a torn final line is ignored"""
+        rows: Dict[str, Dict[str, Any]] = {}
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    entry = fast_json.loads(line)
+                except fast_json.JSONDecodeError:
+                    break
+                if "put" in entry:
+                    rows[entry["put"]["session_id"]] = entry["put"]
+                for session_id in entry.get("done", ()):
+                    rows.pop(session_id, None)
+        return [_decode_row(row) for row in rows.values()]
+
+    def append(self, entries: List[Dict[str, Any]], sync: bool):
+        data = b"".join(fast_json.dumps_bytes(entry) + b"\n" for entry in entries)
+        self._handle.write(data)
+        self._handle.flush()
+        if sync:
+            os.fsync(self._handle.fileno())
+
+    def truncate(self):
+        self._handle.truncate(0)
+        self._handle.flush()
+
+    def release(self):
+        """Delete a replayed orphan journal, then drop its lock"""
+        self.path.unlink(missing_ok=True)
+        self._handle.close()
+
+
+class WriteBehindQueue:
+    """Pending buffer, journal writer and batch flusher for one worker"""
+
+    def __init__(self):
+        self.durability = WRITE_BEHIND_DURABILITY if WRITE_BEHIND_DURABILITY in DURABILITY_MODES else "fsync"
+        self.journal: Optional[Journal] = None
+        self._order: List[str] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._journal_waiters: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._journal_wakeup: Optional[asyncio.Event] = None
+        # Serializes journal appends and truncates (they run on executor threads)
+        self._journal_lock: Optional[asyncio.Lock] = None
+        self._tasks: List[asyncio.Task] = []
+        self._attempts: Dict[str, int] = {}
+        self.counters: Dict[str, Any] = {
+            "acknowledged": 0,
+            "committed": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "dead_lettered": 0,
+            "replayed": 0,
+            "journal_syncs": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        """Replay leftover journals, then start the journal writer and the flusher"""
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._journal_wakeup = asyncio.Event()
+        self._journal_lock = asyncio.Lock()
+
+        if self.durability != "memory":
+            self.journal, orphans = await asyncio.to_thread(Journal.claim, WRITE_BEHIND_JOURNAL_DIR)
+            rows = await asyncio.to_thread(Journal.read_uncommitted, self.journal.path)
+            for orphan in orphans:
+                rows.extend(await asyncio.to_thread(Journal.read_uncommitted, orphan.path))
+            if rows:
+                self.counters["replayed"] = await self._replay(rows)
+                logger.info(f"Write-behind journal replayed {self.counters['replayed']} uncommitted sessions")
+            await asyncio.to_thread(self.journal.truncate)
+            # Orphans stay locked until deleted, so no other worker replays or claims them meanwhile
+            for orphan in orphans:
+                await asyncio.to_thread(orphan.release)
+            self._tasks.append(asyncio.create_task(self._journal_loop()))
+
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+
+    async def _replay(self, rows: List[Dict[str, Any]]) -> int:
+        async with async_session_maker() as session:
+            existing: Set[str] = set()
+            ids = [row["session_id"] for row in rows]
+            for start in range(0, len(ids), 500):
+                result = await session.execute(
+                    select(HandoverSessionDB.session_id).where(HandoverSessionDB.session_id.in_(ids[start:start + 500]))
+                )
+                existing.update(result.scalars())
+        missing = [row for row in rows if row["session_id"] not in existing]
+
+        replayed = 0
+        for start in range(0, len(missing), WRITE_BEHIND_BATCH_SIZE):
+            batch = missing[start:start + WRITE_BEHIND_BATCH_SIZE]
+            try:
+                async with async_session_maker() as session:
+                    replayed += await bulk_save_handover_sessions(session, batch)
+            except IntegrityError:
+                # Committed since the check (e.g. by a flush before a crash): insert the rest one by one
+                for row in batch:
+                    try:
+                        async with async_session_maker() as session:
+                            replayed += await bulk_save_handover_sessions(session, [row])
+                    except IntegrityError as e:
+                        if await _is_stored(row["session_id"]):
+                            logger.warning(f"Write-behind session {row['session_id']} already committed")
+                        else:
+                            await self._dead_letter_row(row, e)
+        return replayed
+
+    async def submit(self, row: Dict[str, Any]):
+        """
+        Acknowledge a session: once this returns it is readable through
+        database.get_handover_session and as durable as WRITE_BEHIND_DURABILITY.
+        """
+        row = {**row, "created_at": row.get("created_at") or datetime.utcnow()}
+        async with self._space:
+            await self._space.wait_for(lambda: len(pending_sessions) < WRITE_BEHIND_MAX_PENDING)
+            pending_sessions[row["session_id"]] = row
+            self._order.append(row["session_id"])
+
+        if self.journal is not None:
+            future = asyncio.get_running_loop().create_future()
+            self._journal_waiters.append(({"put": _encode_row(row)}, future))
+            self._journal_wakeup.set()
+            await future
+
+        self.counters["acknowledged"] += 1
+        self._wakeup.set()
+
+    async def _journal_loop(self):
+        """Write queued journal entries together, with one fsync per group"""
+        while True:
+            await self._journal_wakeup.wait()
+            self._journal_wakeup.clear()
+            async with self._journal_lock:
+                waiters, self._journal_waiters = self._journal_waiters, []
+                if not waiters:
+                    continue
+                sync = self.durability == "fsync"
+                try:
+                    await asyncio.to_thread(self.journal.append, [entry for entry, _ in waiters], sync)
+                    self.counters["journal_syncs"] += sync
+                    for _, future in waiters:
+                        if not future.done():
+                            future.set_result(None)
+                except Exception as e:
+                    for _, future in waiters:
+                        if not future.done():
+                            future.set_exception(e)
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # Let a batch build up, unless one is already full
+            if len(self._order) < WRITE_BEHIND_BATCH_SIZE:
+                await asyncio.sleep(WRITE_BEHIND_FLUSH_MS / 1000)
+            self._wakeup.clear()
+            if not await self.flush():
+                await asyncio.sleep(_RETRY_SECONDS)
+            if self._order:
+                self._wakeup.set()
+
+    async def flush(self, drain: bool = False) -> bool:
+        """Commit up to one batch (every pending session when drain is set); False on failure"""
+        while self._order:
+            batch_ids = self._order[:WRITE_BEHIND_BATCH_SIZE]
+            rows = [pending_sessions[session_id] for session_id in batch_ids]
+            started = time.perf_counter()
+            try:
+                async with async_session_maker() as session:
+                    await bulk_save_handover_sessions(session, rows)
+            except Exception as e:
+                self.counters["failed_batches"] += 1
+                logger.warning(f"Write-behind batch of {len(rows)} failed, retrying row by row: {e}")
+                if not await self._flush_individually(batch_ids):
+                    return False
+                if not drain:
+                    return True
+                continue
+
+            await self._committed(batch_ids, time.perf_counter() - started)
+            if not drain:
+                return True
+        return True
+
+    async def _flush_individually(self, batch_ids: List[str]) -> bool:
+        """
+        Isolate the rows that broke a batch. Rows the database rejects
+        (IntegrityError, DataError, or a row that cannot be encoded) stay
+        pending until they reach WRITE_BEHIND_MAX_ATTEMPTS and are
+        dead-lettered; any other database error (outage, lock contention)
+        only ends the pass.
+        """
+        ok = True
+        for session_id in batch_ids:
+            started = time.perf_counter()
+            try:
+                async with async_session_maker() as session:
+                    await bulk_save_handover_sessions(session, [pending_sessions[session_id]])
+            except Exception as e:
+                if isinstance(e, DBAPIError) and not isinstance(e, (IntegrityError, DataError)):
+                    # Unreachable, locked or busy (e.g. SQLite "database is locked"), not a bad row:
+                    # retry later and count nothing
+                    logger.error(f"Write-behind session {session_id} failed, will retry: {e}")
+                    return False
+                try:
+                    stored = await _is_stored(session_id)
+                except Exception:
+                    logger.error(f"Write-behind session {session_id} failed, database unreachable: {e}")
+                    return False
+                if stored:
+                    # Already stored (e.g. replayed by another worker): nothing left to do
+                    logger.warning(f"Write-behind session {session_id} already committed")
+                    await self._committed([session_id], time.perf_counter() - started)
+                    continue
+                attempts = self._attempts[session_id] = self._attempts.get(session_id, 0) + 1
+                if attempts >= WRITE_BEHIND_MAX_ATTEMPTS:
+                    await self._dead_letter(session_id, e)
+                else:
+                    logger.error(
+                        f"Write-behind session {session_id} failed ({attempts}/{WRITE_BEHIND_MAX_ATTEMPTS}), "
+                        f"will retry: {e}"
+                    )
+                    ok = False
+                continue
+            await self._committed([session_id], time.perf_counter() - started)
+        return ok
+
+    async def _dead_letter(self, session_id: str, error: Exception):
+        """Give up on a pending session that keeps failing"""
+        await self._dead_letter_row(pending_sessions[session_id], error)
+        await self._committed([session_id], 0.0, count=False)
+
+    async def _dead_letter_row(self, row: Dict[str, Any], error: Exception):
+        """Log and count a row that cannot be stored, keeping a copy next to the journal"""
+        logger.error(f"Write-behind session {row['session_id']} dead-lettered: {error}", exc_info=error)
+        if self.journal is not None:
+            entry = {"put": _encode_row(row), "error": f"{type(error).__name__}: {error}"[:500]}
+            await asyncio.to_thread(_append_dead_letter, self.journal.path.parent / _DEAD_LETTER_FILE, entry)
+        self.counters["dead_lettered"] += 1
+
+    async def _committed(self, session_ids: List[str], seconds: float, count: bool = True):
+        """Drop sessions from the pending buffer and mark them done in the journal"""
+        done = set(session_ids)
+        self._order = [session_id for session_id in self._order if session_id not in done]
+        for session_id in session_ids:
+            pending_sessions.pop(session_id, None)
+            self._attempts.pop(session_id, None)
+
+        if count:
+            self.counters["committed"] += len(session_ids)
+            self.counters["batches"] += 1
+            self.counters["last_batch_size"] = len(session_ids)
+            self.counters["last_flush_ms"] = round(seconds * 1000, 2)
+
+        if self.journal is not None:
+            # Checked under the lock: an acknowledged put is never written and then truncated away
+            async with self._journal_lock:
+                if pending_sessions or self._journal_waiters:
+                    await asyncio.to_thread(self.journal.append, [{"done": session_ids}], False)
+                else:
+                    await asyncio.to_thread(self.journal.truncate)
+
+        async with self._space:
+            self._space.notify_all()
+
+    async def stop(self):
+        """Stop the background tasks and commit whatever is still pending"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._order and not await self.flush(drain=True):
+            logger.error(f"{len(self._order)} write-behind sessions left uncommitted; the journal keeps them")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "durability": self.durability,
+            "pending": len(pending_sessions),
+            **self.counters,
+        }
+
+
+write_behind = WriteBehindQueue()
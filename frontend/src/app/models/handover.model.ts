@@ -4,6 +4,7 @@ export interface CriticalAlarm {
 }
 
 export interface OpenIssue {
+    id?: string | null;
     issue: string;
     priority: 'High' | 'Med' | 'Low';
     confidence: number;
@@ -21,6 +22,7 @@ export interface HandoverRequest {
     shiftNotes: string;
     alarmsJson?: any;
     trendsCsv?: string;
+    previousSessionId?: string;
 }
 
 export interface HandoverResponse {